@@ -0,0 +1,248 @@
+"""
+Cursor-paginated admin queries for Smallie
+
+Serves /api/admin/signups, /api/admin/votes and /api/admin/payments one page
+at a time. Filters and ordering run in Firestore, and pages continue from a
+keyset cursor (the last document's sort value and id), so a page costs
+page_size + 1 document reads however large the collection is.
+
+Each collection declares the filters and orderings it accepts. Equality
+filters combined with an ordering need composite indexes. They are listed in
+firestore.indexes.json, which is generated from the same declarations:
+
+    python admin_queries.py indexes > firestore.indexes.json
+    firebase deploy --only firestore:indexes
+"""
+
+import sys
+import json
+import base64
+import hashlib
+import datetime
+import argparse
+from itertools import combinations
+
+from firebase_admin import firestore
+
+from repositories import LEDGER_COLLECTIONS, require_firestore_ledger
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Most equality filters one query may combine; each combination needs its
+# own composite index
+MAX_COMBINED_FILTERS = 2
+
+
+class QueryError(ValueError):
+    """Raised for filters, orderings or cursors a collection does not accept"""
+
+
+class AdminCollection:
+    """Filters and orderings one admin listing accepts
+
+    filters maps a query parameter to (field, type); orders maps an order
+    name to a field. The first ordering is the default, newest first.
+    """
+
+    def __init__(self, name, filters, orders, fields):
+        self.name = name
+        self.filters = filters
+        self.orders = orders
+        # Columns of a CSV export, after the document id
+        self.fields = fields
+
+    def indexes(self):
+        """Return the composite indexes every accepted query needs"""
+        indexes = []
+        filter_fields = sorted(field for field, _ in self.filters.values())
+        for size in range(1, min(len(filter_fields), MAX_COMBINED_FILTERS) + 1):
+            for subset in combinations(filter_fields, size):
+                for field in self.orders.values():
+                    if field in subset:
+                        continue
+                    for direction in ("ASCENDING", "DESCENDING"):
+                        indexes.append({
+                            "collectionGroup": self.name,
+                            "queryScope": "COLLECTION",
+                            "fields": [{"fieldPath": f, "order": "ASCENDING"} for f in subset]
+                                      + [{"fieldPath": field, "order": direction}],
+                        })
+        return indexes
+
+
+COLLECTIONS = {
+    "signups": AdminCollection(
+        "signups",
+        filters={"status": ("status", str), "email": ("email", str)},
+        orders={"createdAt": "createdAt"},
+        fields=["name", "email", "phone", "location", "status", "createdAt"],
+    ),
+    "votes": AdminCollection(
+        "votes",
+        filters={"day": ("day", int), "contestantId": ("contestantId", str), "email": ("email", str)},
+        orders={"timestamp": "timestamp"},
+        fields=["contestantId", "count", "email", "day", "paymentMethod", "transactionId", "timestamp"],
+    ),
+    "payments": AdminCollection(
+        "payments",
+        filters={
+            "day": ("day", int),
+            "contestantId": ("contestantId", str),
+            "status": ("status", str),
+            "email": ("email", str),
+        },
+        orders={"timestamp": "timestamp", "amount": "amount"},
+        fields=["contestantId", "voteCount", "amount", "email", "method", "transactionId", "day", "status", "timestamp"],
+    ),
+}
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {"t": value.isoformat()}
+    return {"v": value}
+
+
+def _decode_value(encoded):
+    if "t" in encoded:
+        return datetime.datetime.fromisoformat(encoded["t"])
+    return encoded.get("v")
+
+
+def _query_fingerprint(collection, filters, order, descending):
+    key = json.dumps([collection, sorted(filters.items()), order, descending], default=str)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
+
+def encode_cursor(fingerprint, value, doc_id):
+    data = json.dumps({"q": fingerprint, "id": doc_id, **_encode_value(value)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token, fingerprint):
+    """Return (value, doc_id) from a cursor issued for the same query"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if data["q"] != fingerprint:
+            raise QueryError("cursor belongs to a different query")
+        return _decode_value(data), data["id"]
+    except QueryError:
+        raise
+    except Exception:
+        raise QueryError("invalid cursor")
+
+
+def _serialize(doc_id, data):
+    item = {"id": doc_id}
+    for key, value in data.items():
+        if isinstance(value, datetime.datetime):
+            value = value.isoformat()
+        item[key] = value
+    return item
+
+
+def parse_args(collection, args, newest_first=True, default_page_size=DEFAULT_PAGE_SIZE, max_page_size=MAX_PAGE_SIZE):
+    """Validate request arguments into (filters, order, descending, page_size, cursor)
+
+    Without an order argument the default ordering is used, newest first
+    unless newest_first is False. Raises repositories.LedgerElsewhere for
+    votes and payments while VOTE_LEDGER keeps them outside Firestore.
+    """
+    if collection in LEDGER_COLLECTIONS:
+        require_firestore_ledger(f"The {collection} listing")
+    spec = COLLECTIONS[collection]
+    filters = {}
+    for param, (field, kind) in spec.filters.items():
+        value = args.get(param)
+        if value in (None, ""):
+            continue
+        try:
+            filters[field] = kind(value)
+        except ValueError:
+            raise QueryError(f"{param} must be {kind.__name__}")
+    if len(filters) > MAX_COMBINED_FILTERS:
+        raise QueryError(f"at most {MAX_COMBINED_FILTERS} filters can be combined")
+
+    order = args.get("order") or next(iter(spec.orders))
+    descending = newest_first
+    if order.startswith("-"):
+        order = order[1:]
+        descending = True
+    elif args.get("order"):
+        descending = False
+    if order not in spec.orders:
+        raise QueryError(f"order must be one of {', '.join(spec.orders)}")
+
+    try:
+        page_size = min(max(int(args.get("pageSize", default_page_size)), 1), max_page_size)
+    except ValueError:
+        raise QueryError("pageSize must be an integer")
+    return filters, spec.orders[order], descending, page_size, args.get("cursor") or None
+
+
+def fetch_page(db, collection, filters, order_field, descending=True, page_size=DEFAULT_PAGE_SIZE, cursor=None):
+    """Return one page of a collection as {"items", "nextCursor", "pageSize"}
+
+    Ordering ties are broken by document id so the keyset is unique.
+    """
+    direction = firestore.Query.DESCENDING if descending else firestore.Query.ASCENDING
+    query = db.collection(collection)
+    for field, value in sorted(filters.items()):
+        query = query.where(field, "==", value)
+    query = query.order_by(order_field, direction=direction).order_by("__name__", direction=direction)
+
+    fingerprint = _query_fingerprint(collection, filters, order_field, descending)
+    if cursor:
+        value, doc_id = decode_cursor(cursor, fingerprint)
+        query = query.start_after({order_field: value, "__name__": db.collection(collection).document(doc_id)})
+
+    # One extra document tells whether another page exists
+    docs = list(query.limit(page_size + 1).stream())
+    has_more = len(docs) > page_size
+    docs = docs[:page_size]
+
+    items = [_serialize(doc.id, doc.to_dict() or {}) for doc in docs]
+    next_cursor = None
+    if has_more and docs:
+        last = docs[-1]
+        next_cursor = encode_cursor(fingerprint, (last.to_dict() or {}).get(order_field), last.id)
+    return {"items": items, "nextCursor": next_cursor, "pageSize": page_size}
+
+
+def iter_pages(db, collection, filters, order_field, descending=True, page_size=DEFAULT_PAGE_SIZE, cursor=None):
+    """Yield successive pages from fetch_page until the collection is exhausted
+
+    Only one page is held at a time, so memory does not grow with the
+    collection.
+    """
+    while True:
+        page = fetch_page(db, collection, filters, order_field, descending, page_size, cursor)
+        yield page
+        cursor = page["nextCursor"]
+        if not cursor:
+            return
+
+
+def index_config():
+    """Return the firestore.indexes.json document for every admin listing"""
+    indexes = []
+    for spec in COLLECTIONS.values():
+        indexes.extend(spec.indexes())
+    return {"indexes": indexes, "fieldOverrides": []}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Admin query helpers")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("indexes", help="Print the composite indexes as firestore.indexes.json")
+    args = parser.parse_args(argv)
+
+    if args.command == "indexes":
+        print(json.dumps(index_config(), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
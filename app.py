@@ -1,10 +1,40 @@
 import os
-import json
+import hmac
+import time
 import logging
 import datetime
-import firebase_admin
-from firebase_admin import credentials, firestore
-from flask import Flask, render_template
+import functools
+
+# Measured here so the log shows how long importing the app took
+_import_started = time.perf_counter()
+
+from flask import Flask, Response, render_template, request, jsonify, make_response, redirect, stream_with_context, url_for
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+import firebase_client
+from firebase_client import get_db
+from contestant_cache import ContestantCache
+from vote_counters import ShardedVoteCounter
+from vote_ingest import VoteIngestor, parse_vote
+from repositories import vote_ledger, LedgerElsewhere
+from vote_rollups import VoteRollups
+from elimination import EliminationEngine, competition_day
+from competition_calendar import CompetitionCalendar, builtin_task
+from contestant_data import DEFAULT_CONTESTANTS
+from vote_stream import VoteBroadcastHub, HubFull, FULL_RETRY_AFTER_SECONDS
+from static_assets import StaticAssets, IMMUTABLE_CACHE_CONTROL
+from admin_queries import COLLECTIONS as ADMIN_COLLECTIONS, QueryError, MAX_PAGE_SIZE as ADMIN_MAX_PAGE_SIZE, parse_args as parse_admin_query, fetch_page as fetch_admin_page
+from payment_webhooks import PaymentWebhooks, PaymentIdempotency, RecentKeys
+from exports import FORMATS as EXPORT_FORMATS, export as export_collection, export_filename
+from page_cache import RenderedPageCache, RenderedPage
+from rate_limits import VoteGuard
+from request_fetch import Fetcher
+from circuit_breaker import SnapshotStore, Unavailable, STATES as CIRCUIT_STATES
+from metrics import Registry, FlaskMetrics, FirestoreMetrics
+import firestore_budget
+from firestore_budget import FirestoreBudget
+from leaderboard import Leaderboard, DEFAULT_LIMIT as LEADERBOARD_DEFAULT_LIMIT, MAX_LIMIT as LEADERBOARD_MAX_LIMIT
+from thumbnails import Thumbnailer, FORMATS as THUMBNAIL_FORMATS
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -13,392 +43,158 @@ logging.basicConfig(level=logging.DEBUG)
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET")
 
-# Initialize Firebase
-try:
-    # Get Firebase credentials from environment variable
-    firebase_creds_json = os.environ.get("FIREBASE_CREDENTIALS")
-    if firebase_creds_json:
-        try:
-            # Try to decode base64 (for Vercel deployment)
-            import base64
-            try:
-                decoded_creds = base64.b64decode(firebase_creds_json).decode('utf-8')
-                cred_dict = json.loads(decoded_creds)
-                logging.info("Successfully decoded base64 Firebase credentials")
-            except Exception as base64_err:
-                # If not base64, try direct JSON parsing
-                try:
-                    # For a JSON-formatted string
-                    cred_dict = json.loads(firebase_creds_json)
-                    logging.info("Successfully parsed Firebase credentials as JSON string")
-                except json.JSONDecodeError:
-                    # If it's not a valid JSON string, it might be the path to a JSON file
-                    if os.path.exists(firebase_creds_json):
-                        try:
-                            with open(firebase_creds_json, 'r') as f:
-                                cred_dict = json.load(f)
-                                logging.info("Successfully loaded Firebase credentials from file")
-                        except Exception as file_err:
-                            logging.error(f"Error loading credentials file: {file_err}")
-                            cred_dict = None
-                    else:
-                        logging.error(f"Firebase credentials file not found: {firebase_creds_json}")
-                        cred_dict = None
-        except Exception as parse_err:
-            logging.error(f"Error parsing Firebase credentials: {parse_err}")
-            cred_dict = None
-        
-        if cred_dict:
-            cred = credentials.Certificate(cred_dict)
-            firebase_admin.initialize_app(cred)
-            db = firestore.client()
-            logging.info("Firebase initialized successfully")
-        else:
-            logging.warning("Could not parse Firebase credentials")
-            db = None
-    else:
-        logging.warning("FIREBASE_CREDENTIALS not found in environment variables")
-        db = None
-except Exception as e:
-    logging.error(f"Error initializing Firebase: {e}")
-    db = None
+# Deployments sit behind PROXY_HOPS reverse proxies; take the client address
+# from X-Forwarded-For so rate limits apply per voter, not per proxy
+PROXY_HOPS = int(os.environ.get("PROXY_HOPS", "1"))
+if PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS, x_proto=PROXY_HOPS)
+
+# Prometheus metrics at /metrics, summed over every worker
+metrics = Registry()
+FlaskMetrics(app, metrics)
+firebase_client.add_observer(FirestoreMetrics(metrics).observe)
+
+# Firestore documents read and written by each request, in Server-Timing and
+# logged when over FIRESTORE_READ_BUDGET / FIRESTORE_WRITE_BUDGET
+firestore_costs = FirestoreBudget(app)
+firebase_client.add_observer(firestore_budget.observe)
+
+# Fingerprinted, precompressed static files from `python build_assets.py`
+static_assets = StaticAssets(app, enabled=os.environ.get("STATIC_MANIFEST", "1") == "1")
+
+# Firebase is initialized lazily by firebase_client.get_db(); start it now in
+# the background so the first request rarely has to wait for it
+if os.environ.get("FIREBASE_WARMUP", "1") == "1":
+    firebase_client.warm_up()
     
 # Log Firebase environment variables (without revealing sensitive data)
 logging.info(f"Firebase Project ID: {os.environ.get('FIREBASE_PROJECT_ID', 'Not Set')}")
 logging.info(f"Firebase App ID available: {'Yes' if os.environ.get('FIREBASE_APP_ID') else 'No'}")
 logging.info(f"Firebase API Key available: {'Yes' if os.environ.get('FIREBASE_API_KEY') else 'No'}")
 
-# Function to initialize the daily tasks in Firebase if they don't exist
-def init_daily_tasks():
-    if db is None:
-        return
-    
-    # Check if tasks collection exists
-    tasks_ref = db.collection('tasks')
-    tasks = tasks_ref.get()
-    
-    # If there are no tasks, add the initial ones
-    if len(list(tasks)) == 0:
-        logging.info("Initializing daily tasks in Firebase")
-        
-        daily_tasks = [
-            {
-                "day": 1,
-                "date": "2025-04-15",
-                "title": "Naija Throwback Dance Challenge",
-                "description": "60-second dance to a classic hit (e.g., P-Square)",
-                "release_time": "09:00 WAT",
-                "voting_close_time": "21:00 WAT"
-            },
-            {
-                "day": 2,
-                "date": "2025-04-16",
-                "title": "Jollof Wars: Cook-Off Edition",
-                "description": "Cook jollof with ₦500 in 10 minutes, taste it",
-                "release_time": "09:00 WAT",
-                "voting_close_time": "21:00 WAT"
-            },
-            {
-                "day": 3,
-                "date": "2025-04-17",
-                "title": "Nollywood Skit Showdown",
-                "description": "2-minute Nollywood skit (e.g., Cheating Husband)",
-                "release_time": "09:00 WAT",
-                "voting_close_time": "21:00 WAT"
-            },
-            {
-                "day": 4,
-                "date": "2025-04-18",
-                "title": "Afrobeat Freestyle Face-Off",
-                "description": "1-minute freestyle on a trending beat (e.g., Burna Boy)",
-                "release_time": "09:00 WAT",
-                "voting_close_time": "21:00 WAT"
-            },
-            {
-                "day": 5,
-                "date": "2025-04-19",
-                "title": "Owambe Fashion Flex",
-                "description": "Style an owambe outfit from home, 90-second catwalk",
-                "release_time": "09:00 WAT",
-                "voting_close_time": "21:00 WAT"
-            },
-            {
-                "day": 6,
-                "date": "2025-04-20",
-                "title": "Pidgin Proverbs Remix",
-                "description": "60-second pidgin skit/song from a proverb (e.g., Monkey no fine...)",
-                "release_time": "09:00 WAT",
-                "voting_close_time": "21:00 WAT"
-            },
-            {
-                "day": 7,
-                "date": "2025-04-21",
-                "title": "Lagos Hustle Pitch",
-                "description": "3-minute pitch as Smallie winner",
-                "release_time": "09:00 WAT",
-                "voting_close_time": "21:00 WAT"
-            }
-        ]
-        
-        # Add tasks to Firestore
-        for task in daily_tasks:
-            tasks_ref.document(f"day_{task['day']}").set(task)
-            
-        logging.info("Daily tasks initialized in Firebase")
-
-# Try to initialize daily tasks
-try:
-    init_daily_tasks()
-except Exception as e:
-    logging.error(f"Error initializing daily tasks: {e}")
+# Per-worker contestant cache, kept in sync by a Firestore snapshot listener
+contestant_cache = ContestantCache(get_db)
+
+# Sharded vote counters; totals are published back onto contestants.votes
+vote_counter = ShardedVoteCounter(get_db)
+
+# Write-ahead logged vote ingestion, group-committed to Firestore in batches;
+# VOTE_LEDGER=postgres keeps the votes and payments in PostgreSQL instead
+vote_ingestor = VoteIngestor(get_db, vote_counter, day_resolver=competition_day, ledger=vote_ledger(get_db))
+
+# Aggregate vote statistics, updated inside each ingestion batch
+vote_rollups = VoteRollups(get_db)
+vote_ingestor.add_hook(vote_rollups)
+
+# Per-day tallies and the daily elimination at voting close
+elimination_engine = EliminationEngine(get_db, ledger=vote_ingestor.ledger)
+vote_ingestor.add_hook(elimination_engine)
+elimination_engine.add_listener(lambda day, result: contestant_cache.invalidate())
+elimination_engine.add_drain(vote_ingestor.drain)
+if os.environ.get("ELIMINATION_SCHEDULER") == "1":
+    elimination_engine.start_scheduler()
+
+# Paid votes are counted once per payment, however often it is reported
+recent_payments = RecentKeys()
+vote_ingestor.add_hook(PaymentIdempotency(get_db, recent=recent_payments))
+payment_webhooks = PaymentWebhooks(vote_ingestor, recent=recent_payments, get_db=get_db)
+
+# Vote rate limits and burst detection, shared by every worker on the machine
+vote_guard = VoteGuard()
+
+# The competition schedule, resolved in WAT and cached until the next day boundary
+competition_calendar = CompetitionCalendar(get_db)
+
+# Day shown on the homepage regardless of the date, for demonstrations; set
+# COMPETITION_DEMO_DAY to an empty string to follow the real calendar
+DEMO_DAY = os.environ.get("COMPETITION_DEMO_DAY", "3")
+
+# The built-in schedule, for pages that cannot wait for the stored one
+builtin_calendar = CompetitionCalendar()
 
 # Function to get the current day's task
 def get_current_task():
-    # For demo purposes, calculate the competition day based on current date
-    # Competition runs from April 15 to April 21, 2025
-    today = datetime.datetime.now()
-    
-    # For development/testing, using a fixed date in the competition period
-    # Uncomment the line below to use the real date
-    # today = datetime.datetime(2025, 4, 17)  # Day 3
-    
-    start_date = datetime.datetime(2025, 4, 15)
-    end_date = datetime.datetime(2025, 4, 21)
-    
-    # Calculate current day (1-7)
-    if today < start_date:
-        # Before competition
-        current_day = 0
-        task = {"title": "Competition starts soon", "description": "Stay tuned for Day 1!", "day": 0}
-    elif today > end_date:
-        # After competition
-        current_day = 8
-        task = {"title": "Competition has ended", "description": "Thanks for participating!", "day": 8}
+    return competition_calendar.current()
+
+def get_homepage_task(calendar):
+    """Return the (day, task) shown on the homepage"""
+    # For demonstration purposes a fixed day can be shown (override)
+    if DEMO_DAY:
+        day = int(DEMO_DAY)
+        day_task = day, calendar.task(day)
     else:
-        # During competition
-        delta = today - start_date
-        current_day = delta.days + 1
-        
-        # Try to get task from Firebase
-        if db is not None:
-            try:
-                task_doc = db.collection('tasks').document(f"day_{current_day}").get()
-                if task_doc.exists:
-                    task = task_doc.to_dict()
-                else:
-                    # Fallback to hardcoded task if document doesn't exist
-                    task = get_hardcoded_task(current_day)
-            except Exception as e:
-                logging.error(f"Error fetching task from Firebase: {e}")
-                task = get_hardcoded_task(current_day)
-        else:
-            # Fallback to hardcoded task if Firebase is not available
-            task = get_hardcoded_task(current_day)
-    
-    return current_day, task
+        day_task = calendar.current()
+    if calendar is competition_calendar and not calendar.stats()["from_firestore"]:
+        # Fell back to the built-in schedule; a saved one is better
+        raise Unavailable("the stored schedule could not be loaded")
+    return day_task
 
-# Fallback function to get hardcoded tasks if Firebase is not available
+# Fallback function to get the built-in task if Firebase is not available
 def get_hardcoded_task(day):
-    tasks = [
-        {
-            "day": 1,
-            "title": "Naija Throwback Dance Challenge",
-            "description": "60-second dance to a classic hit (e.g., P-Square)",
-            "release_time": "09:00 WAT",
-            "voting_close_time": "21:00 WAT"
-        },
-        {
-            "day": 2,
-            "title": "Jollof Wars: Cook-Off Edition",
-            "description": "Cook jollof with ₦500 in 10 minutes, taste it",
-            "release_time": "09:00 WAT",
-            "voting_close_time": "21:00 WAT"
-        },
-        {
-            "day": 3,
-            "title": "Nollywood Skit Showdown",
-            "description": "2-minute Nollywood skit (e.g., Cheating Husband)",
-            "release_time": "09:00 WAT",
-            "voting_close_time": "21:00 WAT"
-        },
-        {
-            "day": 4,
-            "title": "Afrobeat Freestyle Face-Off",
-            "description": "1-minute freestyle on a trending beat (e.g., Burna Boy)",
-            "release_time": "09:00 WAT",
-            "voting_close_time": "21:00 WAT"
-        },
-        {
-            "day": 5,
-            "title": "Owambe Fashion Flex",
-            "description": "Style an owambe outfit from home, 90-second catwalk",
-            "release_time": "09:00 WAT",
-            "voting_close_time": "21:00 WAT"
-        },
-        {
-            "day": 6,
-            "title": "Pidgin Proverbs Remix",
-            "description": "60-second pidgin skit/song from a proverb (e.g., Monkey no fine...)",
-            "release_time": "09:00 WAT",
-            "voting_close_time": "21:00 WAT"
-        },
-        {
-            "day": 7,
-            "title": "Lagos Hustle Pitch",
-            "description": "3-minute pitch as Smallie winner",
-            "release_time": "09:00 WAT",
-            "voting_close_time": "21:00 WAT"
-        }
-    ]
-    
-    return tasks[day-1] if 1 <= day <= 7 else {"title": "No task available", "description": "Check back later"}
+    return builtin_task(day)
 
-@app.route('/')
-def index():
-    """Render the homepage"""
-    # Mock data for contestants
-    contestants = [
-        {
-            "id": 1,
-            "name": "Adebola Johnson", 
-            "age": 25,
-            "location": "Lagos",
-            "bio": "Content creator and aspiring actor with a passion for storytelling.",
-            "votes": 245,
-            "image_url": "https://images.unsplash.com/photo-1522327646852-4e28586a40dd",
-            "stream_url": "https://www.youtube.com/watch?v=example1",
-            "eliminated": False
-        },
-        {
-            "id": 2,
-            "name": "Chioma Okafor",
-            "age": 23,
-            "location": "Abuja",
-            "bio": "Fashion designer and lifestyle vlogger sharing Nigerian culture.",
-            "votes": 312,
-            "image_url": "https://images.unsplash.com/photo-1659540517934-cba43fc64ded",
-            "stream_url": "https://www.youtube.com/watch?v=example2",
-            "eliminated": False
-        },
-        {
-            "id": 3,
-            "name": "Emeka Nwosu",
-            "age": 28,
-            "location": "Port Harcourt",
-            "bio": "Music producer who loves to create fusion of afrobeats and jazz.",
-            "votes": 189,
-            "image_url": "https://images.unsplash.com/photo-1589707181684-24a34853641d",
-            "stream_url": "",
-            "eliminated": False
-        },
-        {
-            "id": 4,
-            "name": "Folake Ade",
-            "age": 24,
-            "location": "Ibadan",
-            "bio": "Dancer and choreographer with unique Afro-contemporary moves.",
-            "votes": 278,
-            "image_url": "https://images.unsplash.com/photo-1659540517163-e9a29f4d1251",
-            "stream_url": "https://www.youtube.com/watch?v=example4",
-            "eliminated": False
-        },
-        {
-            "id": 5,
-            "name": "Tunde Bakare",
-            "age": 26,
-            "location": "Kano",
-            "bio": "Tech enthusiast and gaming streamer building a Nigerian gaming community.",
-            "votes": 201,
-            "image_url": "https://images.unsplash.com/photo-1495434942214-9b525bba74e9",
-            "stream_url": "https://www.twitch.tv/example5",
-            "eliminated": False
-        },
-        {
-            "id": 6,
-            "name": "Ngozi Eze",
-            "age": 22,
-            "location": "Enugu",
-            "bio": "Makeup artist and beauty influencer creating unique Nigerian looks.",
-            "votes": 267,
-            "image_url": "https://images.unsplash.com/photo-1523365280197-f1783db9fe62",
-            "stream_url": "",
-            "eliminated": False
-        },
-        {
-            "id": 7,
-            "name": "Ibrahim Yusuf",
-            "age": 27,
-            "location": "Kaduna",
-            "bio": "Stand-up comedian bringing laughter and social commentary.",
-            "votes": 234,
-            "image_url": "https://images.unsplash.com/photo-1528820184586-dd0d858b7254",
-            "stream_url": "https://www.youtube.com/watch?v=example7",
-            "eliminated": False
-        },
-        {
-            "id": 8,
-            "name": "Amara Obi",
-            "age": 25,
-            "location": "Owerri",
-            "bio": "Culinary enthusiast showcasing modern Nigerian cuisine.",
-            "votes": 156,
-            "image_url": "https://images.unsplash.com/photo-1632215861513-130b66fe97f4",
-            "stream_url": "",
-            "eliminated": True
-        },
-        {
-            "id": 9,
-            "name": "Dayo Adeleke",
-            "age": 29,
-            "location": "Abeokuta",
-            "bio": "Fitness trainer promoting healthy living with African exercises.",
-            "votes": 198,
-            "image_url": "https://images.unsplash.com/photo-1543234723-b70b104d8e25",
-            "stream_url": "https://www.youtube.com/watch?v=example9",
-            "eliminated": True
-        },
-        {
-            "id": 10,
-            "name": "Fatima Bello",
-            "age": 24,
-            "location": "Sokoto",
-            "bio": "Traditional storyteller bringing Nigerian folklore to modern audiences.",
-            "votes": 222,
-            "image_url": "https://images.unsplash.com/photo-1539414785349-55cfff23f5b9",
-            "stream_url": "https://www.youtube.com/watch?v=example10",
-            "eliminated": False
-        }
-    ]
-
-    # Try to get contestants from Firebase if available
-    if db is not None:
-        try:
-            contestants_ref = db.collection('contestants')
-            contestants_docs = contestants_ref.get()
-            
-            # If we have contestants in Firebase, use them instead
-            if len(list(contestants_docs)) > 0:
-                firestore_contestants = [doc.to_dict() for doc in contestants_docs]
-                # Only replace if we got valid data
-                if len(firestore_contestants) > 0:
-                    contestants = firestore_contestants
-                    logging.info(f"Loaded {len(contestants)} contestants from Firestore")
-            else:
-                # Initialize Firebase with our mock data if empty
-                for contestant in contestants:
-                    contestants_ref.document(str(contestant['id'])).set(contestant)
-                logging.info("Initialized contestants in Firestore")
-        except Exception as e:
-            logging.error(f"Error loading contestants from Firebase: {e}")
-    
-    # Get current day and task
-    current_day, daily_task = get_current_task()
-    
-    # For demonstration purposes, we'll use day 3 (override)
-    # Remove this in production to use the actual competition day
-    current_day = 3
-    daily_task = get_hardcoded_task(current_day)
-    
+# Ranking served by /api/leaderboard, refreshed whenever the contestant cache changes
+leaderboard = Leaderboard()
+leaderboard.update(DEFAULT_CONTESTANTS)
+contestant_cache.subscribe(leaderboard.update)
+
+# Fans live vote counts out to /api/stream/votes clients from the one listener
+vote_hub = VoteBroadcastHub()
+vote_hub.publish(DEFAULT_CONTESTANTS)
+contestant_cache.subscribe(vote_hub.publish)
+
+# Rendered homepages, precompressed, keyed by what their content depends on
+page_cache = RenderedPageCache()
+
+# Shared pool running each request's independent Firestore reads under one
+# deadline, behind circuit breakers, with last good values kept on disk
+fetcher = Fetcher(snapshots=SnapshotStore())
+
+# Contestant photos resized for the homepage cards, kept on local disk
+thumbnailer = Thumbnailer()
+
+INDEX_TEMPLATE_PATH = os.path.join(app.root_path, app.template_folder, 'index.html')
+
+cache_hits = metrics.counter("smallie_cache_hits_total", "Cache lookups served from memory", ["cache"])
+cache_misses = metrics.counter("smallie_cache_misses_total", "Cache lookups that had to load or render", ["cache"])
+metrics.ratio("smallie_cache_hit_ratio", "Share of cache lookups served from memory", cache_hits, cache_misses)
+template_render = metrics.histogram("smallie_template_render_seconds", "Time to render a template", ["template"])
+votes_pending = metrics.gauge("smallie_votes_pending", "Votes accepted but not yet committed to Firestore")
+fetch_fallbacks = metrics.counter("smallie_fetch_fallbacks_total", "Request reads answered with last-known or built-in data", ["fetch", "reason"])
+circuit_state = metrics.gauge("smallie_circuit_state", "Workers whose breaker for a read is in each state", ["fetch", "state"])
+fetch_staleness = metrics.gauge("smallie_fetch_staleness_seconds", "Age of the newest good value of a read, in the stalest worker", ["fetch"], aggregate="max")
+thumbnail_results = metrics.counter("smallie_thumbnails_total", "Contestant photo renders and requests answered with the original", ["result"])
+
+def collect_metrics():
+    for name, cache in (("contestants", contestant_cache), ("pages", page_cache), ("thumbnails", thumbnailer.cache)):
+        stats = cache.stats()
+        cache_hits.set_total(stats["hits"], cache=name)
+        cache_misses.set_total(stats["misses"], cache=name)
+    votes_pending.set(vote_ingestor.stats()["pending"])
+    fetch_stats = fetcher.stats()
+    for reason in ("missed", "failed", "open"):
+        for name, count in fetch_stats[reason].items():
+            fetch_fallbacks.set_total(count, fetch=name, reason=reason)
+    for name, breaker in fetch_stats["breakers"].items():
+        for state in CIRCUIT_STATES:
+            circuit_state.set(1 if breaker["state"] == state else 0, fetch=name, state=state)
+    for name, age in fetch_stats["staleness_seconds"].items():
+        fetch_staleness.set(age, fetch=name)
+    thumbnail_stats = thumbnailer.stats()
+    for result in ("rendered", "failed", "fallbacks"):
+        thumbnail_results.set_total(thumbnail_stats[result], result=result)
+
+metrics.add_collector(collect_metrics)
+
+def get_cached_contestants():
+    """Return (contestants, version) from the contestant cache"""
+    contestants, version = contestant_cache.get_versioned()
+    if contestants is None:
+        raise Unavailable("Firestore is not available")
+    return contestants, version
+
+def render_index(contestants, current_day, daily_task):
+    """Render the homepage template"""
     # Get Firebase credentials from environment
     firebase_api_key = os.environ.get("FIREBASE_API_KEY", "")
     firebase_project_id = os.environ.get("FIREBASE_PROJECT_ID", "")
@@ -408,17 +204,100 @@ def index():
     flutterwave_public_key = os.environ.get("FLUTTERWAVE_PUBLIC_KEY", "")
     solana_project_id = os.environ.get("SOLANA_PROJECT_ID", "")
 
-    return render_template(
-        'index.html', 
-        contestants=contestants, 
-        daily_task=daily_task, 
-        current_day=current_day,
-        firebase_api_key=firebase_api_key,
-        firebase_project_id=firebase_project_id,
-        firebase_app_id=firebase_app_id,
-        flutterwave_public_key=flutterwave_public_key,
-        solana_project_id=solana_project_id
-    )
+    with template_render.time(template='index.html'):
+        return render_template(
+            'index.html', 
+            contestants=contestants, 
+            daily_task=daily_task, 
+            current_day=current_day,
+            firebase_api_key=firebase_api_key,
+            firebase_project_id=firebase_project_id,
+            firebase_app_id=firebase_app_id,
+            flutterwave_public_key=flutterwave_public_key,
+            solana_project_id=solana_project_id
+        )
+
+@app.template_global()
+def contestant_image_url(contestant, width=None):
+    """URL of a contestant's photo resized to `width`, by default the middle width, versioned by its source"""
+    image_url = contestant.get('image_url')
+    if not image_url or contestant.get('id') is None or not thumbnailer.renders(image_url):
+        # Without Pillow or an allowed host /img would only redirect to the original
+        return image_url or ''
+    if width is None:
+        width = thumbnailer.widths[len(thumbnailer.widths) // 2]
+    return url_for('contestant_image', contestant_id=contestant['id'], size=width, v=thumbnailer.version(image_url))
+
+@app.template_global()
+def contestant_image_srcset(contestant):
+    """srcset offering a contestant's photo at every thumbnail width"""
+    image_url = contestant.get('image_url')
+    if not image_url or contestant.get('id') is None or not thumbnailer.renders(image_url):
+        return ''
+    return ', '.join(f"{contestant_image_url(contestant, width)} {width}w" for width in thumbnailer.widths)
+
+def find_contestant_image(contestant_id):
+    """Return the photo URL of a contestant, or None"""
+    contestants = None
+    try:
+        contestants = contestant_cache.get()
+    except Exception as e:
+        logging.error(f"Error loading contestants for photo: {e}")
+    for contestant in contestants or DEFAULT_CONTESTANTS:
+        if str(contestant.get('id')) == contestant_id:
+            return contestant.get('image_url')
+    return None
+
+@app.route('/')
+def index():
+    """Render the homepage"""
+    # Contestants and the day's task are read in parallel; a read that misses
+    # the deadline, or whose circuit is open, is answered with its last good
+    # value, or the built-in data
+    fetch = fetcher.start()
+    fetch.submit("contestants", get_cached_contestants, default=(None, "default"), persist=True)
+    fetch.submit("homepage-task", lambda: get_homepage_task(competition_calendar),
+                 default=lambda: get_homepage_task(builtin_calendar), persist=True)
+
+    contestants = DEFAULT_CONTESTANTS
+    contestants_version = "default"
+
+    # If we have contestants in Firebase, use them instead; an empty
+    # collection is filled by running `python seed.py`
+    cached_contestants, version = fetch.result("contestants")
+    if cached_contestants:
+        contestants = cached_contestants
+        contestants_version = version
+        if "contestants" in fetch.stale:
+            # Versions are per process; a snapshot is keyed by when it was taken
+            contestants_version = ("snapshot", fetch.stale["contestants"])
+
+    # Get current day and task
+    current_day, daily_task = fetch.result("homepage-task")
+
+    def render():
+        return render_index(contestants, current_day, daily_task)
+
+    if contestants_version is None:
+        # The contestants changed while being read; render without caching
+        page = RenderedPage(render())
+    else:
+        key = (current_day, contestants_version, page_cache.template_version(INDEX_TEMPLATE_PATH))
+        page = page_cache.get(key, render)
+
+    encoding, body, etag = page.variant(request.headers.get('Accept-Encoding'))
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(body)
+        response.mimetype = 'text/html'
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    # Contestant data changes often; browsers revalidate on every visit
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/admin')
 def admin():
@@ -441,5 +320,241 @@ def admin():
         solana_project_id=solana_project_id
     )
 
+@app.route('/api/votes', methods=['POST'])
+def submit_vote():
+    """Accept a vote and queue it for a batched Firestore write"""
+    if get_db() is None:
+        return jsonify({"error": "Voting is temporarily unavailable"}), 503
+
+    data = request.get_json(silent=True)
+    try:
+        paid = isinstance(data, dict) and (data.get("paymentMethod") or data.get("transactionId"))
+        if isinstance(data, dict):
+            # A payment report credits no votes; a free submission is charged per vote
+            count = 1 if paid else parse_vote(data)["count"]
+            retry_after = vote_guard.check(request.remote_addr, data.get("email"), data.get("contestantId"), count=count)
+            if retry_after:
+                response = jsonify({"error": "Too many votes, please try again shortly"})
+                response.headers["Retry-After"] = str(max(1, int(retry_after + 0.999)))
+                return response, 429
+        if paid:
+            # Unsigned, so only noted; the provider's webhook credits the votes
+            status, body = payment_webhooks.report(data)
+            return jsonify(body), status
+        vote = vote_ingestor.submit(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error accepting vote: {e}")
+        return jsonify({"error": "Could not record vote"}), 500
+
+    return jsonify({"status": "accepted", "voteId": vote["id"]}), 202
+
+@app.route('/api/webhooks/<provider>', methods=['POST'])
+def payment_webhook(provider):
+    """Accept a signed payment confirmation from Flutterwave or a Solana relay"""
+    if get_db() is None:
+        # Providers retry failed deliveries, so ask them to come back later
+        return jsonify({"error": "Payments are temporarily unavailable"}), 503
+
+    try:
+        status, body = payment_webhooks.receive(provider, request.get_data(), request.headers)
+    except Exception as e:
+        logging.error(f"Error accepting {provider} webhook: {e}")
+        return jsonify({"error": "Could not record payment"}), 500
+    return jsonify(body), status
+
+# Bearer token the admin dashboard and scripts send to /api/admin/*; unset, those routes refuse everyone
+ADMIN_API_TOKEN = os.environ.get("ADMIN_API_TOKEN", "")
+
+def require_admin(view):
+    """Answer 401 unless the request carries ADMIN_API_TOKEN, before the view reads anything"""
+    @functools.wraps(view)
+    def wrapped(*args, **kwargs):
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if not (ADMIN_API_TOKEN and scheme.lower() == 'bearer'
+                and hmac.compare_digest(token.strip().encode(), ADMIN_API_TOKEN.encode())):
+            response = jsonify({"error": "Admin credentials required"})
+            response.headers['WWW-Authenticate'] = 'Bearer'
+            return response, 401
+        return view(*args, **kwargs)
+    return wrapped
+
+@app.route('/api/admin/stats')
+@require_admin
+def admin_stats():
+    """Return rolled-up vote totals, one day's breakdown and recent daily totals"""
+    if get_db() is None:
+        return jsonify({"error": "Statistics are temporarily unavailable"}), 503
+
+    try:
+        date = request.args.get('date')
+        date = datetime.date.fromisoformat(date) if date else None
+        days = int(request.args.get('days', 7))
+    except ValueError:
+        return jsonify({"error": "date must be YYYY-MM-DD and days an integer"}), 400
+
+    try:
+        return jsonify(vote_rollups.stats(date=date, days=days))
+    except Exception as e:
+        logging.error(f"Error loading vote statistics: {e}")
+        return jsonify({"error": "Could not load statistics"}), 500
+
+@app.route('/api/admin/<collection>')
+@require_admin
+@firestore_costs.limit(reads=ADMIN_MAX_PAGE_SIZE + 2)
+def admin_listing(collection):
+    """Return one page of signups, votes or payments
+
+    Filters are passed as query parameters (day, contestantId, status,
+    email, depending on the collection), order=<field> sorts ascending and
+    order=-<field> descending (the default, newest first), and the
+    nextCursor of a response fetches the following page.
+    """
+    if collection not in ADMIN_COLLECTIONS:
+        return jsonify({"error": "Unknown collection"}), 404
+    db = get_db()
+    if db is None:
+        return jsonify({"error": "Admin data is temporarily unavailable"}), 503
+
+    try:
+        filters, order, descending, page_size, cursor = parse_admin_query(collection, request.args)
+        return jsonify(fetch_admin_page(db, collection, filters, order, descending, page_size, cursor))
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except LedgerElsewhere as e:
+        return jsonify({"error": str(e)}), 501
+    except Exception as e:
+        logging.error(f"Error loading admin {collection}: {e}")
+        return jsonify({"error": f"Could not load {collection}"}), 500
+
+@app.route('/api/admin/<collection>/export')
+@require_admin
+@firestore_costs.exempt
+def admin_export(collection):
+    """Stream a whole collection as CSV or NDJSON
+
+    Accepts the listing's filters and order, format=csv|ndjson, and cursor
+    to resume from the _cursor value of the last complete page received.
+    """
+    if collection not in ADMIN_COLLECTIONS:
+        return jsonify({"error": "Unknown collection"}), 404
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+    db = get_db()
+    if db is None:
+        return jsonify({"error": "Admin data is temporarily unavailable"}), 503
+
+    try:
+        body = export_collection(db, collection, request.args, export_format)
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except LedgerElsewhere as e:
+        return jsonify({"error": str(e)}), 501
+
+    return Response(
+        stream_with_context(body),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={
+            'Content-Disposition': f'attachment; filename="{export_filename(collection, export_format)}"',
+            'Cache-Control': 'no-store',
+            # Stop reverse proxies from buffering the whole export
+            'X-Accel-Buffering': 'no',
+        }
+    )
+
+@app.route('/img/<contestant_id>/<int:size>')
+def contestant_image(contestant_id, size):
+    """Serve a contestant's photo resized to one of the thumbnail widths"""
+    if size not in thumbnailer.widths:
+        return jsonify({"error": f"size must be one of {', '.join(map(str, thumbnailer.widths))}"}), 404
+    image_url = find_contestant_image(contestant_id)
+    if not image_url:
+        return jsonify({"error": "Unknown contestant"}), 404
+
+    # Only an explicit image/webp counts; older browsers accept image/* without decoding WebP
+    webp = any(mimetype == 'image/webp' and quality > 0 for mimetype, quality in request.accept_mimetypes)
+    image_format = 'webp' if webp else 'jpeg'
+    body = thumbnailer.get(image_url, size, image_format)
+    if body is None:
+        # Not rendered yet, or cannot be; briefly send browsers to the original
+        response = redirect(image_url)
+        response.headers['Cache-Control'] = 'public, max-age=60'
+        response.vary.add('Accept')
+        return response
+
+    etag = thumbnailer.key(image_url, size, image_format)
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(body)
+        response.mimetype = THUMBNAIL_FORMATS[image_format]
+    response.set_etag(etag)
+    response.vary.add('Accept')
+    if request.args.get('v') == thumbnailer.version(image_url):
+        # The URL changes with the photo, so this response never does
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    else:
+        response.headers['Cache-Control'] = 'public, max-age=86400'
+    return response
+
+@app.route('/api/leaderboard')
+def leaderboard_api():
+    """Return the top contestants by votes, as a full list or a delta"""
+    try:
+        limit = min(max(int(request.args.get('limit', LEADERBOARD_DEFAULT_LIMIT)), 1), LEADERBOARD_MAX_LIMIT)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    since = request.args.get('since') or None
+
+    # Refreshes the ranking if the cached contestants have gone stale
+    try:
+        contestant_cache.get()
+    except Exception as e:
+        logging.error(f"Error refreshing leaderboard: {e}")
+
+    etag = leaderboard.etag(limit, since)
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        etag, body = leaderboard.payload(limit, since)
+        response = make_response(body)
+        response.mimetype = 'application/json'
+    response.set_etag(etag)
+    # Let browsers keep the body but revalidate it on every poll
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/stream/votes')
+def stream_votes():
+    """Stream live vote counts as Server-Sent Events"""
+    # Make sure this worker's contestant listener is running
+    try:
+        contestant_cache.get()
+    except Exception as e:
+        logging.error(f"Error starting vote stream feed: {e}")
+
+    try:
+        client = vote_hub.connect()
+    except HubFull:
+        # Browsers poll /api/leaderboard until Retry-After, keeping this worker's threads free
+        response = jsonify({"error": "Too many live connections, please retry"})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(FULL_RETRY_AFTER_SECONDS)
+        return response
+
+    return Response(
+        vote_hub.stream(client),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            # Stop reverse proxies from buffering the stream
+            'X-Accel-Buffering': 'no',
+        }
+    )
+
+logging.info(f"App module imported in {(time.perf_counter() - _import_started) * 1000:.0f} ms")
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
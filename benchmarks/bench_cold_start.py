@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Cold-start profile of the Smallie app
+
+Imports app.py in fresh interpreters with `python -X importtime`, reports the
+total import time and the slowest modules, and appends the result to a JSON
+lines history so regressions in start-up time show up between runs.
+
+Firebase warm-up is disabled in the child so only the import is measured.
+
+Usage:
+    python benchmarks/bench_cold_start.py [--runs 5] [--top 15] [--history benchmarks/cold_start.jsonl]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+# Add the parent directory to the path
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_path)
+
+DEFAULT_HISTORY = os.path.join(root_path, "benchmarks", "cold_start.jsonl")
+
+
+def profile_import(module="app"):
+    """Import `module` in a fresh interpreter
+
+    Returns (wall_ms, {module: cumulative_us}) from the -X importtime report.
+    """
+    env = dict(os.environ, FIREBASE_WARMUP="0", PYTHONDONTWRITEBYTECODE="1")
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=root_path, env=env, capture_output=True, text=True,
+    )
+    wall_ms = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        # Lines look like "import time:   self [us] | cumulative | imported package"
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].strip()
+        cumulative[name] = max(cumulative.get(name, 0), int(parts[1]))
+    return wall_ms, cumulative
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile how long importing the app takes")
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--history", default=DEFAULT_HISTORY,
+                        help="JSON lines file the result is appended to ('' to skip)")
+    args = parser.parse_args(argv)
+
+    walls = []
+    imports = []
+    slowest = {}
+    for _ in range(args.runs):
+        wall_ms, cumulative = profile_import(args.module)
+        walls.append(wall_ms)
+        imports.append(cumulative.get(args.module, 0) / 1000)
+        for name, us in cumulative.items():
+            slowest.setdefault(name, []).append(us)
+
+    # Medians over runs smooth out disk cache effects on the first run
+    median_import = statistics.median(imports)
+    median_wall = statistics.median(walls)
+    print(f"import {args.module}: {median_import:.1f} ms  (process wall {median_wall:.1f} ms, {args.runs} runs)")
+    top_level = sorted(
+        ((statistics.median(values) / 1000, name) for name, values in slowest.items()
+         if "." not in name and name != args.module),
+        reverse=True,
+    )[:args.top]
+    for ms, name in top_level:
+        print(f"  {ms:8.1f} ms  {name}")
+
+    if args.history:
+        record = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "module": args.module,
+            "import_ms": round(median_import, 1),
+            "wall_ms": round(median_wall, 1),
+            "top": {name: round(ms, 1) for ms, name in top_level},
+        }
+        with open(args.history, "a") as f:
+            f.write(json.dumps(record) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+Load benchmark of the Smallie app against an in-memory Firestore
+
+Builds a synthetic competition in FakeFirestore (contestants, tasks, signups,
+votes with their payments, and the counters, tallies and rollups those votes
+imply), installs it as the app's Firestore client and drives the Flask app
+from concurrent clients. Each scenario reports latency percentiles,
+throughput and Firestore operations per request:
+
+  index        GET /
+  leaderboard  GET /api/leaderboard
+  vote         POST /api/votes, including the batched commits they cause
+  admin        GET /api/admin/votes for one day, following cursors a few pages
+               deep, and /api/admin/stats
+
+Results are compared with a saved baseline; a p95 latency, throughput or
+Firestore ops figure worse than the baseline by more than --tolerance is
+reported as a regression and makes the run exit with status 1. With --url the
+requests go to a running server instead, and Firestore ops are not known.
+
+Usage:
+    python benchmarks/bench_load.py [--votes 1000000] [--clients 16] [--requests 2000] [--latency-ms 5]
+    python benchmarks/bench_load.py --scenario index --scenario vote --save-baseline
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import tempfile
+import argparse
+import datetime
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Add the parent directory to the path
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_path)
+
+from benchmarks.fake_firestore import FakeFirestore
+
+DEFAULT_BASELINE = os.path.join(root_path, "benchmarks", "load_baseline.json")
+
+SCENARIOS = ["index", "leaderboard", "vote", "admin"]
+
+# Share of synthetic votes that were paid for
+PAID_SHARE = 0.2
+
+
+def build_competition(db, votes, contestants=7, signups=2000, seed=1):
+    """Fill db with a synthetic competition of `votes` vote documents"""
+    from contestant_data import DEFAULT_CONTESTANTS
+    from competition_calendar import COMPETITION_START, COMPETITION_DAYS, DAILY_TASKS, TASKS_COLLECTION
+    from vote_ingest import VOTE_PRICE_USD
+    from vote_rollups import GLOBAL_DOC, day_doc_id, to_wat
+
+    rng = random.Random(seed)
+    people = [dict(DEFAULT_CONTESTANTS[i % len(DEFAULT_CONTESTANTS)], id=i + 1) for i in range(contestants)]
+    emails = [f"voter{n}@example.com" for n in range(max(1, votes // 20))]
+    start = datetime.datetime.combine(COMPETITION_START, datetime.time(9), datetime.timezone(datetime.timedelta(hours=1)))
+    span = COMPETITION_DAYS * 86400 - 12 * 3600
+
+    vote_docs, payment_docs = {}, {}
+    totals = {str(person["id"]): 0 for person in people}
+    tallies = {}
+    rollups = {}
+    for n in range(votes):
+        contestant_id = str(rng.randint(1, contestants))
+        count = 1 if rng.random() > PAID_SHARE else rng.randint(1, 20)
+        moment = start + datetime.timedelta(seconds=span * n / votes)
+        day = min(COMPETITION_DAYS, (moment.date() - COMPETITION_START).days + 1)
+        paid = count > 1
+        vote_id = f"{n:012d}"
+        vote_docs[vote_id] = {
+            "contestantId": contestant_id,
+            "count": count,
+            "email": emails[n % len(emails)],
+            "day": day,
+            "timestamp": moment,
+            "paymentMethod": "flutterwave" if paid else None,
+            "transactionId": str(10_000_000 + n) if paid else None,
+            "rolled_up": True,
+        }
+        if paid:
+            payment_docs[vote_id] = {
+                "contestantId": contestant_id,
+                "voteCount": count,
+                "amount": count * VOTE_PRICE_USD,
+                "email": emails[n % len(emails)],
+                "method": "flutterwave",
+                "transactionId": str(10_000_000 + n),
+                "day": day,
+                "timestamp": moment,
+                "status": "completed",
+            }
+        totals[contestant_id] += count
+        tally = tallies.setdefault(day, {})
+        tally[contestant_id] = tally.get(contestant_id, 0) + count
+        local = to_wat(moment)
+        rollup = rollups.setdefault(local.date(), {"votes": 0, "contestants": {}, "hours": {}})
+        rollup["votes"] += count
+        rollup["contestants"][contestant_id] = rollup["contestants"].get(contestant_id, 0) + count
+        hour = f"{local.hour:02d}"
+        rollup["hours"][hour] = rollup["hours"].get(hour, 0) + count
+
+    db.load("votes", vote_docs)
+    db.load("payments", payment_docs)
+    db.load("contestants", {
+        str(person["id"]): dict(person, votes=totals[str(person["id"])], eliminated=False) for person in people
+    })
+    for contestant_id, total in totals.items():
+        db.load(f"contestants/{contestant_id}/vote_shards", {"0": {"count": total}})
+    db.load(TASKS_COLLECTION, {f"day_{task['day']}": dict(task) for task in DAILY_TASKS})
+    db.load("tallies", {f"day_{day}": {"day": day, "contestants": tally} for day, tally in tallies.items()})
+    grand_total = sum(totals.values())
+    stats = {GLOBAL_DOC: {"votes": grand_total, "revenue": grand_total * VOTE_PRICE_USD}}
+    for date, rollup in rollups.items():
+        stats[day_doc_id(date)] = dict(rollup, date=date.isoformat(), revenue=rollup["votes"] * VOTE_PRICE_USD)
+    db.load("stats", stats)
+    db.load("signups", {
+        f"signup{n}": {
+            "name": f"Applicant {n}",
+            "email": f"applicant{n}@example.com",
+            "phone": "+2348000000000",
+            "location": "Lagos",
+            "status": rng.choice(["pending", "approved", "rejected"]),
+            "createdAt": start - datetime.timedelta(minutes=n),
+        }
+        for n in range(signups)
+    })
+
+
+class LocalClient:
+    """Sends requests to the Flask app in-process, one test client per thread"""
+
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self._local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body, headers=headers or {})
+        data = response.get_data()
+        return response.status_code, data
+
+
+class HttpClient:
+    """Sends requests to a running server"""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+
+    def request(self, method, path, body=None, headers=None):
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        request = urllib.request.Request(self.url + path, data=data, method=method,
+                                         headers=dict(headers or {}, **({"Content-Type": "application/json"} if data else {})))
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+def _client_ip(rng):
+    return f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+
+
+def scenario_requests(scenario, contestants, days):
+    """Return a function performing one request of a scenario, given (client, rng)"""
+    if scenario == "index":
+        def run(client, rng):
+            status, _ = client.request("GET", "/", headers={"Accept-Encoding": "gzip, br"})
+            return status
+    elif scenario == "leaderboard":
+        def run(client, rng):
+            status, _ = client.request("GET", "/api/leaderboard")
+            return status
+    elif scenario == "vote":
+        def run(client, rng):
+            status, _ = client.request("POST", "/api/votes", body={
+                "contestantId": str(rng.randint(1, contestants)),
+                "count": 1,
+                "email": f"bench{rng.getrandbits(40)}@example.com",
+            }, headers={"X-Forwarded-For": _client_ip(rng)})
+            return status
+    elif scenario == "admin":
+        # With --url, ADMIN_API_TOKEN must match the server's
+        auth = {"Authorization": f"Bearer {os.environ.get('ADMIN_API_TOKEN', '')}"}
+
+        def run(client, rng):
+            if rng.random() < 0.2:
+                status, _ = client.request("GET", "/api/admin/stats", headers=auth)
+                return status
+            path = f"/api/admin/votes?day={rng.randint(1, days)}&pageSize=50"
+            cursor = None
+            for _ in range(rng.randint(1, 5)):
+                status, data = client.request("GET", path + (f"&cursor={cursor}" if cursor else ""), headers=auth)
+                if status != 200:
+                    return status
+                cursor = json.loads(data).get("nextCursor")
+                if not cursor:
+                    break
+            return status
+    else:
+        raise ValueError(f"Unknown scenario {scenario}")
+    return run
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_scenario(client, scenario, requests, clients, contestants, days, db=None, settle=None, warmup=20):
+    run = scenario_requests(scenario, contestants, days)
+    rng = random.Random(scenario)
+    for _ in range(warmup):
+        run(client, rng)
+    if settle is not None:
+        settle()
+    if db is not None:
+        db.reset_counts()
+
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def one(seed):
+        request_rng = random.Random(seed)
+        started = time.perf_counter()
+        status = run(client, request_rng)
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(one, range(requests)))
+    # Writes the requests caused but left to background threads count too
+    if settle is not None:
+        settle()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    result = {
+        "requests": requests,
+        "statuses": {str(status): n for status, n in sorted(statuses.items())},
+        "p50_ms": round(_percentile(latencies, 0.50), 3),
+        "p95_ms": round(_percentile(latencies, 0.95), 3),
+        "p99_ms": round(_percentile(latencies, 0.99), 3),
+        "throughput_rps": round(requests / wall, 1),
+    }
+    if db is not None:
+        counts = db.counts()
+        result["firestore_reads_per_request"] = round(counts["reads"] / requests, 3)
+        result["firestore_writes_per_request"] = round(counts["writes"] / requests, 3)
+        result["firestore_rpcs_per_request"] = round(counts["rpcs"] / requests, 3)
+    return result
+
+
+def compare(result, baseline, tolerance):
+    """Return descriptions of figures in result worse than baseline by more than tolerance"""
+    regressions = []
+    checks = [("p95_ms", True), ("p99_ms", True), ("throughput_rps", False),
+              ("firestore_reads_per_request", True), ("firestore_writes_per_request", True)]
+    for key, lower_is_better in checks:
+        if key not in result or key not in baseline:
+            continue
+        old, new = baseline[key], result[key]
+        if lower_is_better and new > old * (1 + tolerance) + 1e-9:
+            regressions.append(f"{key} {old} -> {new}")
+        elif not lower_is_better and new < old * (1 - tolerance):
+            regressions.append(f"{key} {old} -> {new}")
+    return regressions
+
+
+def _configure_environment(work_dir):
+    # Keep the app's local state out of the way and its rate limits out of the measurement
+    os.environ.setdefault("FIREBASE_WARMUP", "0")
+    os.environ.setdefault("VOTE_WAL_DIR", os.path.join(work_dir, "wal"))
+    os.environ.setdefault("RATE_LIMIT_FILE", os.path.join(work_dir, "rate-limits.bin"))
+    os.environ.setdefault("ADMIN_API_TOKEN", "bench")
+    for name in ("VOTE_LIMIT_PER_IP", "VOTE_LIMIT_PER_EMAIL", "VOTE_LIMIT_PER_CONTESTANT"):
+        os.environ.setdefault(name, "1000000000/1")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the app against an in-memory Firestore")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS,
+                        help="Scenario to run, repeatable; defaults to all")
+    parser.add_argument("--votes", type=int, default=1_000_000, help="Votes in the synthetic competition")
+    parser.add_argument("--contestants", type=int, default=7)
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per scenario")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Simulated Firestore round-trip time")
+    parser.add_argument("--url", default=None, help="Drive a running server instead of the app in-process")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Record this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed fractional regression")
+    args = parser.parse_args(argv)
+    scenarios = args.scenario or SCENARIOS
+
+    from competition_calendar import COMPETITION_DAYS
+
+    db = None
+    if args.url:
+        client = HttpClient(args.url)
+        settle = None
+    else:
+        _configure_environment(tempfile.mkdtemp(prefix="smallie-bench-"))
+        db = FakeFirestore(latency=args.latency_ms / 1000)
+        import firebase_client
+        firebase_client.install(db)
+        import app as smallie
+        # The app logs every request at DEBUG, which would dominate the timings
+        logging.getLogger().setLevel(logging.WARNING)
+
+        started = time.perf_counter()
+        build_competition(db, args.votes, args.contestants)
+        print(f"Built a competition of {args.votes} votes in {time.perf_counter() - started:.1f}s")
+        client = LocalClient(smallie.app)
+
+        def flush_votes():
+            smallie.vote_ingestor.flush()
+            smallie.vote_counter.publish_dirty()
+        settle = flush_votes
+
+    config = {"votes": args.votes, "clients": args.clients, "latency_ms": args.latency_ms,
+              "mode": "http" if args.url else "in-process"}
+    results = {}
+    for scenario in scenarios:
+        result = run_scenario(client, scenario, args.requests, args.clients, args.contestants,
+                              COMPETITION_DAYS, db=db, settle=settle)
+        results[scenario] = result
+        ops = ""
+        if "firestore_reads_per_request" in result:
+            ops = (f"  reads/req {result['firestore_reads_per_request']:.2f}"
+                   f"  writes/req {result['firestore_writes_per_request']:.2f}")
+        print(f"{scenario:12s} p50 {result['p50_ms']:8.2f} ms  p95 {result['p95_ms']:8.2f} ms  "
+              f"p99 {result['p99_ms']:8.2f} ms  {result['throughput_rps']:8.1f} req/s{ops}  {result['statuses']}")
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    status = 0
+    if baseline is not None and not args.save_baseline:
+        if baseline.get("config") != config:
+            print(f"Baseline was recorded with {baseline.get('config')}; comparing anyway")
+        for scenario, result in results.items():
+            regressions = compare(result, baseline.get("scenarios", {}).get(scenario, {}), args.tolerance)
+            if regressions:
+                status = 1
+                print(f"REGRESSION in {scenario}: " + ", ".join(regressions))
+        if status == 0:
+            print(f"No regressions against {args.baseline}")
+
+    if args.save_baseline:
+        saved = baseline if baseline is not None and baseline.get("config") == config else {"scenarios": {}}
+        saved["config"] = config
+        saved["recorded_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        saved["scenarios"].update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(saved, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Saved baseline to {args.baseline}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the Vercel WSGI bridge against the previous handler
+
+Renders templates/index.html once through the Flask app, then serves those
+bytes through both handlers, as one chunk and as many small chunks the way
+a streamed response arrives.
+
+Usage:
+    python benchmarks/bench_wsgi_bridge.py [--iterations 2000] [--chunk-size 1024]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+# Add the parent directory to the path
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_path)
+
+from wsgi_bridge import handle
+
+
+class FakeRequest:
+    """Minimal stand-in for the serverless request object"""
+
+    def __init__(self, path="/"):
+        self.url = f"https://smallie.example{path}"
+        self.body = b""
+        self.method = "GET"
+        self.path = path
+        self.query_string = b""
+        self.headers = {
+            "host": "smallie.example",
+            "accept": "text/html",
+            "accept-encoding": "gzip, br",
+            "user-agent": "bench",
+        }
+
+
+def legacy_handler(flask_app, request):
+    """The handler index.py shipped before the bridge, kept for comparison"""
+    environ = {
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": request.url.split("://")[0],
+        "wsgi.input": request.body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": False,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+        "REQUEST_METHOD": request.method,
+        "PATH_INFO": request.path,
+        "QUERY_STRING": request.query_string.decode("utf-8"),
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "HTTP_HOST": request.headers.get("host", "localhost"),
+    }
+    for key, value in request.headers.items():
+        key = key.upper().replace("-", "_")
+        environ[f"HTTP_{key}"] = value
+    if request.body:
+        environ["CONTENT_LENGTH"] = str(len(request.body))
+    if request.headers.get("content-type"):
+        environ["CONTENT_TYPE"] = request.headers.get("content-type")
+
+    response_data = {}
+
+    def start_response(status, response_headers, exc_info=None):
+        response_data["status"] = status
+        response_data["headers"] = response_headers
+
+    body_iter = flask_app(environ, start_response)
+    body = b""
+    for chunk in body_iter:
+        if chunk:
+            body += chunk if isinstance(chunk, bytes) else chunk.encode("utf-8")
+
+    return {
+        "statusCode": int(response_data["status"].split(" ")[0]),
+        "headers": dict(response_data["headers"]),
+        "body": body.decode("utf-8"),
+    }
+
+
+def render_homepage():
+    """Render the homepage once through the real Flask app"""
+    from app import app
+    with app.test_client() as client:
+        response = client.get("/")
+        return response.data
+
+
+def static_app(body, chunk_size):
+    """WSGI app that replays a rendered page, optionally in small chunks"""
+    if chunk_size:
+        chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+    else:
+        chunks = [body]
+    headers = [("Content-Type", "text/html; charset=utf-8"), ("Content-Length", str(len(body)))]
+
+    def app(environ, start_response):
+        start_response("200 OK", headers)
+        return iter(chunks)
+
+    return app
+
+
+def measure(handler, app, iterations):
+    request = FakeRequest()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        handler(app, request)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the WSGI bridge with the previous Vercel handler")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--chunk-size", type=int, default=1024,
+                        help="Chunk size for the streamed case, in bytes")
+    args = parser.parse_args(argv)
+
+    body = render_homepage()
+    print(f"Rendered index.html: {len(body)} bytes")
+
+    for label, chunk_size in (("single chunk", 0), (f"{args.chunk_size}-byte chunks", args.chunk_size)):
+        app = static_app(body, chunk_size)
+        legacy = measure(legacy_handler, app, args.iterations)
+        bridge = measure(handle, app, args.iterations)
+        print(f"{label:>20}: legacy {legacy:8.1f} us  bridge {bridge:8.1f} us  speedup {legacy / bridge:5.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,577 @@
+"""
+In-memory stand-in for the Firestore client, for benchmarks
+
+Implements the part of the google-cloud-firestore surface Smallie uses:
+collections and documents (get, set with merge, update, create, delete,
+add), write batches, get_all, queries (where, order_by, start_after, limit)
+and collection snapshot listeners. Increment, SERVER_TIMESTAMP and
+DELETE_FIELD values from firebase_admin.firestore are applied as Firestore
+would. Transactions are not implemented.
+
+Every round trip sleeps for the injectable latency, so the app sees
+Firestore-like delays, and is counted. Reads are counted the way Firestore
+bills them, one per document returned and at least one per query; writes
+are counted per document written. Both are broken down by collection:
+
+    db = FakeFirestore(latency=0.005)
+    ...
+    db.counts()   # {"rpcs": ..., "reads": ..., "writes": ..., "by_collection": {...}}
+
+Queries keep a sorted index per (collection, filters, ordering) that is
+rebuilt after the collection changes, so paging through a large, quiet
+collection costs a binary search per page.
+"""
+
+import time
+import uuid
+import bisect
+import datetime
+import threading
+from collections import Counter
+
+ASCENDING = "ASCENDING"
+DESCENDING = "DESCENDING"
+
+
+try:
+    # The errors the real client raises, so code catching them works here too
+    from google.api_core.exceptions import AlreadyExists, NotFound
+except ImportError:
+    class AlreadyExists(Exception):
+        """Raised by create() for a document that exists"""
+
+    class NotFound(Exception):
+        """Raised by update() for a document that does not exist"""
+
+
+def _is_increment(value):
+    return type(value).__name__ == "Increment" and hasattr(value, "value")
+
+
+def _sentinel(value):
+    # firestore.SERVER_TIMESTAMP and DELETE_FIELD are Sentinel instances
+    if type(value).__name__ != "Sentinel":
+        return None
+    description = getattr(value, "description", "").lower()
+    if "timestamp" in description:
+        return "timestamp"
+    if "delete" in description:
+        return "delete"
+    return None
+
+
+def _resolve(value, current):
+    # Returns the stored value for a written value, or _DELETE
+    if _is_increment(value):
+        return (current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0) + value.value
+    kind = _sentinel(value)
+    if kind == "timestamp":
+        return datetime.datetime.now(datetime.timezone.utc)
+    if kind == "delete":
+        return _DELETE
+    if isinstance(value, dict):
+        resolved = {}
+        _merge(resolved, value)
+        return resolved
+    return value
+
+
+_DELETE = object()
+
+
+def _merge(target, data):
+    # set(merge=True): nested maps are merged field by field
+    for key, value in data.items():
+        if isinstance(value, dict) and not _is_increment(value):
+            child = target.get(key)
+            if not isinstance(child, dict):
+                child = target[key] = {}
+            _merge(child, value)
+            continue
+        resolved = _resolve(value, target.get(key))
+        if resolved is _DELETE:
+            target.pop(key, None)
+        else:
+            target[key] = resolved
+
+
+def _update(target, data):
+    # update(): dotted keys address nested fields; maps replace what was there
+    for path, value in data.items():
+        parts = path.split(".")
+        node = target
+        for part in parts[:-1]:
+            child = node.get(part)
+            if not isinstance(child, dict):
+                child = node[part] = {}
+            node = child
+        resolved = _resolve(value, node.get(parts[-1]))
+        if resolved is _DELETE:
+            node.pop(parts[-1], None)
+        else:
+            node[parts[-1]] = resolved
+
+
+def _copy(data):
+    return {key: _copy(value) if isinstance(value, dict) else value for key, value in data.items()}
+
+
+def _rank(value):
+    # Firestore orders values of different types by type first
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, datetime.datetime):
+        return (3, value.timestamp())
+    if isinstance(value, str):
+        return (4, value)
+    return (5, str(value))
+
+
+class _Descending:
+    """Inverts the ordering of a sort key component, for mixed-direction orderings"""
+
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+_MISSING = object()
+
+
+def _field(data, path):
+    for part in path.split("."):
+        if not isinstance(data, dict) or part not in data:
+            return _MISSING
+        data = data[part]
+    return data
+
+
+_OPERATORS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: _rank(a) < _rank(b),
+    "<=": lambda a, b: _rank(a) <= _rank(b),
+    ">": lambda a, b: _rank(a) > _rank(b),
+    ">=": lambda a, b: _rank(a) >= _rank(b),
+    "in": lambda a, b: a in b,
+    "array_contains": lambda a, b: isinstance(a, list) and b in a,
+}
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self._data = data
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return _copy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        value = _field(self._data or {}, field)
+        return None if value is _MISSING else value
+
+
+class DocumentReference:
+    def __init__(self, client, collection_path, document_id):
+        self._client = client
+        self._collection_path = collection_path
+        self.id = document_id
+
+    @property
+    def path(self):
+        return f"{self._collection_path}/{self.id}"
+
+    @property
+    def parent(self):
+        return CollectionReference(self._client, self._collection_path)
+
+    def collection(self, name):
+        return CollectionReference(self._client, f"{self.path}/{name}")
+
+    def get(self, transaction=None, field_paths=None):
+        return self._client._get_all([self])[0]
+
+    def set(self, data, merge=False):
+        self._client._commit([("set", self, data, merge)])
+
+    def update(self, data):
+        self._client._commit([("update", self, data, None)])
+
+    def create(self, data):
+        self._client._commit([("create", self, data, None)])
+
+    def delete(self):
+        self._client._commit([("delete", self, None, None)])
+
+    def __eq__(self, other):
+        return isinstance(other, DocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+
+class Query:
+    def __init__(self, client, collection_path, filters=(), orders=(), limit=None, cursor=None):
+        self._client = client
+        self._collection_path = collection_path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._cursor = cursor
+
+    def _with(self, **changes):
+        options = {"filters": self._filters, "orders": self._orders, "limit": self._limit, "cursor": self._cursor}
+        options.update(changes)
+        return Query(self._client, self._collection_path, **options)
+
+    def where(self, field, op, value):
+        if op not in _OPERATORS:
+            raise ValueError(f"Unsupported operator {op!r}")
+        return self._with(filters=self._filters + ((field, op, value),))
+
+    def order_by(self, field, direction=ASCENDING):
+        return self._with(orders=self._orders + ((field, str(direction).upper()),))
+
+    def limit(self, count):
+        return self._with(limit=count)
+
+    def start_after(self, values):
+        return self._with(cursor=values)
+
+    def stream(self, transaction=None):
+        return iter(self._client._run_query(self))
+
+    def get(self, transaction=None):
+        return self._client._run_query(self)
+
+    def on_snapshot(self, callback):
+        if self._filters or self._orders or self._limit is not None:
+            raise NotImplementedError("Only whole-collection listeners are supported")
+        return self._client._watch(self._collection_path, callback)
+
+
+class CollectionReference(Query):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+
+    @property
+    def id(self):
+        return self._collection_path.rsplit("/", 1)[-1]
+
+    def document(self, document_id=None):
+        return DocumentReference(self._client, self._collection_path, document_id or uuid.uuid4().hex[:20])
+
+    def add(self, data, document_id=None):
+        ref = self.document(document_id)
+        ref.create(data)
+        return datetime.datetime.now(datetime.timezone.utc), ref
+
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(("set", reference, data, merge))
+
+    def update(self, reference, data):
+        self._writes.append(("update", reference, data, None))
+
+    def create(self, reference, data):
+        self._writes.append(("create", reference, data, None))
+
+    def delete(self, reference):
+        self._writes.append(("delete", reference, None, None))
+
+    def commit(self):
+        self._client._commit(self._writes)
+        return []
+
+    def __len__(self):
+        return len(self._writes)
+
+
+class _Watch:
+    """Collection listener delivering coalesced snapshots from its own thread"""
+
+    def __init__(self, client, collection_path, callback):
+        self._client = client
+        self._collection_path = collection_path
+        self._callback = callback
+        self._changed = threading.Event()
+        self._changed_lock = threading.Lock()
+        self._changed_ids = set()
+        self._initial = True
+        self.is_active = True
+        self._thread = threading.Thread(target=self._run, name="fake-firestore-watch", daemon=True)
+        self._thread.start()
+
+    def notify(self, document_ids):
+        with self._changed_lock:
+            self._changed_ids.update(document_ids)
+        self._changed.set()
+
+    def unsubscribe(self):
+        self.is_active = False
+        self._changed.set()
+
+    def _run(self):
+        while self.is_active:
+            if not self._initial:
+                self._changed.wait()
+                self._changed.clear()
+                if not self.is_active:
+                    return
+            with self._changed_lock:
+                changed_ids, self._changed_ids = self._changed_ids, set()
+            docs, changes = self._client._snapshot(self._collection_path, changed_ids, self._initial)
+            self._initial = False
+            # A listener is billed for the initial documents, then for each change
+            self._client._count(self._collection_path, reads=len(changes))
+            try:
+                self._callback(docs, changes, datetime.datetime.now(datetime.timezone.utc))
+            except Exception:
+                pass
+
+
+class FakeFirestore:
+    """In-memory Firestore client with injectable latency and operation counts
+
+    latency is seconds per round trip, or a callable taking the operation
+    name ("get", "query", "commit") and returning seconds.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._lock = threading.RLock()
+        self._collections = {}
+        self._versions = Counter()
+        self._indexes = {}
+        self._watches = {}
+        self._counts = Counter()
+        self._by_collection = {}
+
+    # Client surface
+
+    def collection(self, path):
+        return CollectionReference(self, path)
+
+    def document(self, path):
+        collection_path, _, document_id = path.rpartition("/")
+        return DocumentReference(self, collection_path, document_id)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        return iter(self._get_all(list(references)))
+
+    def transaction(self, **kwargs):
+        raise NotImplementedError("FakeFirestore does not implement transactions")
+
+    # Bulk loading and accounting
+
+    def load(self, collection_path, documents):
+        """Insert {document_id: data} directly, without latency or counting"""
+        with self._lock:
+            collection = self._collections.setdefault(collection_path, {})
+            collection.update(documents)
+            self._versions[collection_path] += 1
+
+    def counts(self):
+        """Return round trips, document reads and writes, in total and by collection"""
+        with self._lock:
+            return {
+                "rpcs": self._counts["rpcs"],
+                "reads": self._counts["reads"],
+                "writes": self._counts["writes"],
+                "by_collection": {name: dict(counts) for name, counts in self._by_collection.items()},
+            }
+
+    def reset_counts(self):
+        with self._lock:
+            self._counts.clear()
+            self._by_collection.clear()
+
+    # Internals
+
+    def _delay(self, op):
+        latency = self.latency(op) if callable(self.latency) else self.latency
+        if latency:
+            time.sleep(latency)
+
+    def _count(self, collection_path, reads=0, writes=0, rpcs=0):
+        with self._lock:
+            self._counts.update(reads=reads, writes=writes, rpcs=rpcs)
+            if collection_path and (reads or writes):
+                counts = self._by_collection.setdefault(collection_path.rsplit("/", 1)[-1], Counter())
+                counts.update(reads=reads, writes=writes)
+
+    def _get_all(self, references):
+        self._delay("get")
+        with self._lock:
+            snapshots = [
+                DocumentSnapshot(ref, self._collections.get(ref._collection_path, {}).get(ref.id))
+                for ref in references
+            ]
+        for ref in references:
+            self._count(ref._collection_path, reads=1)
+        self._count("", rpcs=1)
+        return snapshots
+
+    def _commit(self, writes):
+        self._delay("commit")
+        changed = {}
+        with self._lock:
+            # Check everything first so a failing batch writes nothing
+            staged = {}
+            for op, ref, data, merge in writes:
+                collection = self._collections.get(ref._collection_path, {})
+                key = (ref._collection_path, ref.id)
+                current = staged[key] if key in staged else collection.get(ref.id)
+                if op == "create":
+                    if current is not None:
+                        raise AlreadyExists(f"Document already exists: {ref.path}")
+                    current = {}
+                    _merge(current, data)
+                elif op == "update":
+                    if current is None:
+                        raise NotFound(f"No document to update: {ref.path}")
+                    current = _copy(current)
+                    _update(current, data)
+                elif op == "set":
+                    current = _copy(current) if merge and current is not None else {}
+                    _merge(current, data)
+                else:
+                    current = None
+                staged[key] = current
+
+            for (collection_path, document_id), data in staged.items():
+                collection = self._collections.setdefault(collection_path, {})
+                if data is None:
+                    collection.pop(document_id, None)
+                else:
+                    collection[document_id] = data
+                self._versions[collection_path] += 1
+                changed.setdefault(collection_path, set()).add(document_id)
+            watches = {path: list(self._watches.get(path, ())) for path in changed}
+
+        for op, ref, _, _ in writes:
+            self._count(ref._collection_path, writes=1)
+        self._count("", rpcs=1)
+        for path, document_ids in changed.items():
+            for watch in watches[path]:
+                watch.notify(document_ids)
+
+    def _watch(self, collection_path, callback):
+        watch = _Watch(self, collection_path, callback)
+        with self._lock:
+            self._watches.setdefault(collection_path, []).append(watch)
+        return watch
+
+    def _snapshot(self, collection_path, changed_ids, initial):
+        with self._lock:
+            collection = self._collections.get(collection_path, {})
+            docs = [
+                DocumentSnapshot(DocumentReference(self, collection_path, document_id), data)
+                for document_id, data in collection.items()
+            ]
+            # Changes are the documents themselves; real listeners wrap them in DocumentChange
+            changes = docs if initial else [
+                DocumentSnapshot(DocumentReference(self, collection_path, document_id), collection.get(document_id))
+                for document_id in changed_ids
+            ]
+        return docs, changes
+
+    def _run_query(self, query):
+        self._delay("query")
+        with self._lock:
+            entries, keys, descending = self._index(query)
+            collection = self._collections.get(query._collection_path, {})
+            if descending:
+                end = len(entries) if query._cursor is None else bisect.bisect_left(keys, self._cursor_key(query))
+                positions = range(end - 1, -1, -1)
+            else:
+                start = 0 if query._cursor is None else bisect.bisect_right(keys, self._cursor_key(query))
+                positions = range(start, len(entries))
+            if query._limit is not None:
+                positions = positions[:query._limit]
+            snapshots = [
+                DocumentSnapshot(DocumentReference(self, query._collection_path, entries[i]),
+                                 collection.get(entries[i]))
+                for i in positions
+            ]
+        self._count(query._collection_path, reads=max(1, len(snapshots)), rpcs=1)
+        return snapshots
+
+    def _orders(self, query):
+        orders = list(query._orders)
+        if not orders or orders[-1][0] != "__name__":
+            orders.append(("__name__", orders[-1][1] if orders else ASCENDING))
+        return orders
+
+    def _sort_key(self, orders, data, document_id, uniform):
+        key = []
+        for field, direction in orders:
+            value = _rank(document_id if field == "__name__" else _field(data, field))
+            key.append(value if uniform or direction == ASCENDING else _Descending(value))
+        return tuple(key)
+
+    def _index(self, query):
+        # Sorted (document id, key) list for the query, cached until the collection changes
+        orders = self._orders(query)
+        directions = {direction for _, direction in orders}
+        uniform = len(directions) == 1
+        descending = uniform and DESCENDING in directions
+        cache_key = (query._collection_path, repr(query._filters), tuple(orders))
+        version = self._versions[query._collection_path]
+        cached = self._indexes.get(cache_key)
+        if cached is not None and cached[0] == version:
+            return cached[1], cached[2], descending
+
+        rows = []
+        for document_id, data in self._collections.get(query._collection_path, {}).items():
+            if any(_field(data, field) is _MISSING for field, _ in orders if field != "__name__"):
+                continue
+            if not all(
+                (value := _field(data, field)) is not _MISSING and _OPERATORS[op](value, expected)
+                for field, op, expected in query._filters
+            ):
+                continue
+            rows.append((self._sort_key(orders, data, document_id, uniform), document_id))
+        rows.sort(key=lambda row: row[0])
+        entries = [document_id for _, document_id in rows]
+        keys = [key for key, _ in rows]
+        self._indexes[cache_key] = (version, entries, keys)
+        return entries, keys, descending
+
+    def _cursor_key(self, query):
+        orders = self._orders(query)
+        uniform = len({direction for _, direction in orders}) == 1
+        cursor = query._cursor
+        if isinstance(cursor, DocumentSnapshot):
+            return self._sort_key(orders, cursor._data or {}, cursor.id, uniform)
+        values = dict(cursor)
+        name = values.get("__name__")
+        document_id = name.id if isinstance(name, DocumentReference) else name
+        return self._sort_key(orders, values, document_id, uniform)
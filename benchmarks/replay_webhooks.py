@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Local stand-in payment provider for the Smallie webhooks
+
+Generates signed Flutterwave and Solana payment confirmations and delivers
+each of them several times from concurrent threads, the way providers retry
+and duplicate callbacks. Every payment must be accepted exactly once.
+
+By default deliveries go in-process to PaymentWebhooks backed by a
+recording ingestor, which needs no Firebase and checks the per-worker
+deduplication. With --url they are POSTed to a running server instead; set
+the same secrets there and check payment_events and the vote totals after
+the ingestor has flushed.
+
+Usage:
+    python benchmarks/replay_webhooks.py [--payments 200] [--duplicates 5] [--threads 16]
+    python benchmarks/replay_webhooks.py --url http://localhost:5000
+"""
+
+import os
+import sys
+import json
+import hmac
+import time
+import uuid
+import base64
+import random
+import hashlib
+import argparse
+import threading
+import statistics
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Add the parent directory to the path
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_path)
+
+from payment_webhooks import VOTE_PRICE_LAMPORTS, VOTE_PRICE_NGN, PaymentWebhooks, idempotency_key
+
+SECRETS = {
+    "FLUTTERWAVE_SECRET_HASH": os.environ.get("FLUTTERWAVE_SECRET_HASH", "local-flutterwave-secret"),
+    "SOLANA_WEBHOOK_SECRET": os.environ.get("SOLANA_WEBHOOK_SECRET", "local-solana-secret"),
+}
+
+
+class RecordingIngestor:
+    """Counts the votes PaymentWebhooks hands over, per idempotency key"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.submitted = {}
+
+    def submit(self, data, idempotency_key=None):
+        with self._lock:
+            self.submitted[idempotency_key] = self.submitted.get(idempotency_key, 0) + 1
+        return {"id": uuid.uuid4().hex}
+
+
+def flutterwave_event(transaction_id, contestant_id, votes):
+    body = json.dumps({
+        "event": "charge.completed",
+        "data": {
+            "id": transaction_id,
+            "tx_ref": f"vote-{transaction_id}",
+            "amount": votes * VOTE_PRICE_NGN,
+            "currency": "NGN",
+            "status": "successful",
+            "customer": {"email": f"voter{transaction_id}@example.com"},
+            "meta": {"contestantId": contestant_id, "voteCount": votes},
+        },
+    }).encode("utf-8")
+    secret = SECRETS["FLUTTERWAVE_SECRET_HASH"].encode("utf-8")
+    if random.random() < 0.5:
+        headers = {"verif-hash": SECRETS["FLUTTERWAVE_SECRET_HASH"]}
+    else:
+        headers = {"flutterwave-signature": base64.b64encode(hmac.new(secret, body, hashlib.sha256).digest()).decode("ascii")}
+    return "flutterwave", str(transaction_id), body, headers
+
+
+def solana_event(signature, contestant_id, votes):
+    body = json.dumps({
+        "signature": signature,
+        "status": random.choice(["confirmed", "finalized"]),
+        "contestantId": contestant_id,
+        "voteCount": votes,
+        "email": "",
+        "lamports": votes * VOTE_PRICE_LAMPORTS,
+    }).encode("utf-8")
+    secret = SECRETS["SOLANA_WEBHOOK_SECRET"].encode("utf-8")
+    headers = {"x-smallie-signature": hmac.new(secret, body, hashlib.sha256).hexdigest()}
+    return "solana", signature, body, headers
+
+
+def make_payments(count, contestants):
+    payments = []
+    for n in range(count):
+        contestant_id = str(random.randint(1, contestants))
+        votes = random.randint(1, 20)
+        if n % 2:
+            payments.append(solana_event(uuid.uuid4().hex + uuid.uuid4().hex, contestant_id, votes))
+        else:
+            payments.append(flutterwave_event(1_000_000 + n, contestant_id, votes))
+    return payments
+
+
+def deliver_local(webhooks):
+    def deliver(provider, body, headers):
+        return webhooks.receive(provider, body, headers)
+    return deliver
+
+
+def deliver_http(url):
+    def deliver(provider, body, headers):
+        request = urllib.request.Request(
+            f"{url.rstrip('/')}/api/webhooks/{provider}", data=body, method="POST",
+            headers=dict(headers, **{"Content-Type": "application/json"}),
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return response.status, json.loads(response.read() or b"{}")
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read() or b"{}")
+    return deliver
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay bursts of duplicate payment webhooks")
+    parser.add_argument("--payments", type=int, default=200)
+    parser.add_argument("--duplicates", type=int, default=5, help="Deliveries of each payment")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--contestants", type=int, default=7)
+    parser.add_argument("--url", default=None, help="POST to a running server instead of in-process")
+    args = parser.parse_args(argv)
+
+    payments = make_payments(args.payments, args.contestants)
+    deliveries = [payment for payment in payments for _ in range(args.duplicates)]
+    # Bursts: the copies of a payment arrive close together but not in order
+    random.shuffle(deliveries)
+
+    ingestor = None
+    if args.url:
+        deliver = deliver_http(args.url)
+    else:
+        ingestor = RecordingIngestor()
+        deliver = deliver_local(PaymentWebhooks(ingestor, secrets=SECRETS))
+
+    latencies = []
+    outcomes = {}
+    lock = threading.Lock()
+
+    def send(delivery):
+        provider, transaction_id, body, headers = delivery
+        started = time.perf_counter()
+        status, response = deliver(provider, body, headers)
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.append(elapsed)
+            outcome = f"{status} {response.get('status') or response.get('error')}"
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(send, deliveries))
+
+    latencies.sort()
+    print(f"{len(deliveries)} deliveries of {len(payments)} payments")
+    for outcome, count in sorted(outcomes.items()):
+        print(f"  {outcome}: {count}")
+    print(f"latency ms: p50 {statistics.median(latencies):.2f}  "
+          f"p99 {latencies[int(len(latencies) * 0.99) - 1]:.2f}  max {latencies[-1]:.2f}")
+
+    if ingestor is not None:
+        expected = {idempotency_key(provider, transaction_id) for provider, transaction_id, _, _ in payments}
+        repeated = {key: n for key, n in ingestor.submitted.items() if n > 1}
+        missing = expected - set(ingestor.submitted)
+        print(f"queued once: {len(expected) - len(missing) - len(repeated)}  "
+              f"queued more than once: {len(repeated)}  never queued: {len(missing)}")
+        return 0 if not repeated and not missing else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
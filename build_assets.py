@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""
+Static asset build for Smallie
+
+Minifies the JavaScript and CSS under static/, writes each file to
+static/dist/ under a content-hashed name with .gz and .br siblings, and
+records the mapping in static/dist/manifest.json. At runtime static_assets.py
+reads the manifest, points url_for('static', ...) at the hashed names and
+serves them with far-future immutable caching, so repeat visits download
+nothing and make no revalidation requests until a file actually changes.
+
+Relative ES module imports (import ... from './payments.js') are rewritten
+to the hashed name of the imported file, which is built first so its hash
+is known.
+
+The minifiers here are deliberately conservative: comments and redundant
+whitespace are removed, line breaks that may end a JavaScript statement are
+kept, and string, template and regular expression literals are copied
+unchanged, including the code inside a template's ${...}. When the rjsmin and rcssmin packages are installed they are used
+instead. brotli siblings need the brotli package.
+
+Usage:
+    python build_assets.py [--no-minify]
+"""
+
+import os
+import re
+import sys
+import json
+import gzip
+import shutil
+import hashlib
+import argparse
+import tempfile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+ROOT_PATH = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(ROOT_PATH, "static")
+DIST_NAME = "dist"
+MANIFEST_NAME = "manifest.json"
+# Builds are written next to dist/ under this prefix, then swapped in
+BUILD_PREFIX = ".dist-"
+
+# File types that are built; everything else under static/ is served as is
+ASSET_EXTENSIONS = (".js", ".css")
+
+HASH_LENGTH = 10
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+# Relative module specifiers in import/export statements and dynamic imports
+_IMPORT_RE = re.compile(r"""(\bfrom\s*|\bimport\s*\(?\s*)(['"])(\.{1,2}/[^'"]+)\2""")
+
+# Punctuators a space next to can always be dropped in JavaScript. + and -
+# are left out because "a + +b" must not become "a++b", and / because it may
+# start a comment or regular expression
+_JS_TIGHT = set("{}()[];,:=!?&|<>*%^~")
+# Line breaks after these characters never end a statement
+_JS_CONTINUES = set("{(,;[=:&|?+-*%<>!~^")
+# Keywords after which a / starts a regular expression, not a division
+_REGEX_KEYWORDS = {"return", "typeof", "case", "do", "else", "in", "of", "new",
+                   "delete", "void", "throw", "instanceof", "yield", "await"}
+_REGEX_AFTER = set("(,=:[!&|?{};+-*%<>~^")
+
+
+def _skip_string(source, index, quote):
+    # Returns the index just past the closing quote
+    length = len(source)
+    index += 1
+    while index < length:
+        char = source[index]
+        if char == "\\":
+            index += 2
+            continue
+        index += 1
+        if char == quote:
+            break
+    return index
+
+
+def _skip_template(source, index):
+    # Returns the index just past the closing backtick
+    length = len(source)
+    index += 1
+    while index < length:
+        char = source[index]
+        if char == "\\":
+            index += 2
+            continue
+        if char == "`":
+            return index + 1
+        if source.startswith("${", index):
+            index = _skip_substitution(source, index + 2)
+            continue
+        index += 1
+    return index
+
+
+def _skip_substitution(source, index):
+    # Returns the index just past the "}" closing a template's ${, which may
+    # hold braces, comments, strings and templates of its own
+    length = len(source)
+    depth = 0
+    while index < length:
+        char = source[index]
+        if char in "'\"":
+            index = _skip_string(source, index, char)
+        elif char == "`":
+            index = _skip_template(source, index)
+        elif source.startswith("//", index):
+            end = source.find("\n", index)
+            index = length if end == -1 else end
+        elif source.startswith("/*", index):
+            end = source.find("*/", index + 2)
+            index = length if end == -1 else end + 2
+        elif char == "}" and depth == 0:
+            return index + 1
+        else:
+            if char == "{":
+                depth += 1
+            elif char == "}":
+                depth -= 1
+            index += 1
+    return index
+
+
+def _skip_regex(source, index):
+    length = len(source)
+    index += 1
+    in_class = False
+    while index < length:
+        char = source[index]
+        if char == "\\":
+            index += 2
+            continue
+        if char == "\n":
+            break
+        index += 1
+        if char == "[":
+            in_class = True
+        elif char == "]":
+            in_class = False
+        elif char == "/" and not in_class:
+            break
+    while index < length and (source[index].isalnum() or source[index] == "_"):
+        index += 1
+    return index
+
+
+def _last_word(out):
+    match = re.search(r"[A-Za-z_$][\w$]*$", "".join(out[-3:]))
+    return match.group(0) if match else ""
+
+
+def minify_js(source):
+    """Remove comments and redundant whitespace from JavaScript source"""
+    if rjsmin is not None:
+        return rjsmin.jsmin(source)
+
+    out = []
+    index = 0
+    length = len(source)
+    pending = ""
+    while index < length:
+        char = source[index]
+        nxt = source[index + 1] if index + 1 < length else ""
+
+        if char in " \t\r\n":
+            if char == "\n" or pending == "\n":
+                pending = "\n"
+            else:
+                pending = " "
+            index += 1
+            continue
+        if char == "/" and nxt == "/":
+            end = source.find("\n", index)
+            index = length if end == -1 else end
+            continue
+        if char == "/" and nxt == "*":
+            end = source.find("*/", index + 2)
+            index = length if end == -1 else end + 2
+            if pending != "\n":
+                pending = pending or " "
+            continue
+
+        # Emit the whitespace that preceded this token, if it is needed
+        if pending and out:
+            last = out[-1][-1]
+            if pending == "\n" and last not in _JS_CONTINUES and char not in "}),;.]":
+                out.append("\n")
+            elif last not in _JS_TIGHT and char not in _JS_TIGHT:
+                out.append(" ")
+        pending = ""
+
+        if char in "'\"`":
+            end = _skip_template(source, index) if char == "`" else _skip_string(source, index, char)
+            out.append(source[index:end])
+            index = end
+        elif char == "/":
+            last = out[-1][-1] if out else ""
+            if not out or last in _REGEX_AFTER or _last_word(out) in _REGEX_KEYWORDS:
+                end = _skip_regex(source, index)
+                out.append(source[index:end])
+                index = end
+            else:
+                out.append(char)
+                index += 1
+        else:
+            out.append(char)
+            index += 1
+    return "".join(out).strip() + "\n"
+
+
+def minify_css(source):
+    """Remove comments and redundant whitespace from a stylesheet"""
+    if rcssmin is not None:
+        return rcssmin.cssmin(source)
+
+    out = []
+    index = 0
+    length = len(source)
+    pending = False
+    while index < length:
+        char = source[index]
+        if char == "/" and source.startswith("/*", index):
+            end = source.find("*/", index + 2)
+            index = length if end == -1 else end + 2
+            continue
+        if char in " \t\r\n":
+            pending = True
+            index += 1
+            continue
+        if pending and out:
+            # A space before ":" can be a descendant selector ("a :hover"), so
+            # only the space after it is dropped
+            if out[-1][-1] not in "{};,>:(" and char not in "{};,>)!":
+                out.append(" ")
+        pending = False
+        if char in "'\"":
+            end = _skip_string(source, index, char)
+            out.append(source[index:end])
+            index = end
+            continue
+        if char == "}" and out and out[-1] == ";":
+            out.pop()
+        out.append(char)
+        index += 1
+    return "".join(out).strip() + "\n"
+
+
+def _source_files(static_dir):
+    for directory, subdirectories, filenames in os.walk(static_dir):
+        if directory == static_dir:
+            # Neither the output nor an unfinished build is a source
+            subdirectories[:] = [name for name in subdirectories
+                                 if name != DIST_NAME and not name.startswith(BUILD_PREFIX)]
+        for filename in sorted(filenames):
+            if filename.endswith(ASSET_EXTENSIONS):
+                path = os.path.join(directory, filename)
+                yield os.path.relpath(path, static_dir).replace(os.sep, "/")
+
+
+def _relative_imports(name, source):
+    base = os.path.dirname(name)
+    return [
+        os.path.normpath(os.path.join(base, match.group(3))).replace(os.sep, "/")
+        for match in _IMPORT_RE.finditer(source)
+    ]
+
+
+def _build_order(sources):
+    # Imported modules first, so their hashed names exist when importers are built
+    order = []
+    state = {}
+
+    def visit(name):
+        if state.get(name) == "done":
+            return
+        if state.get(name) == "visiting":
+            raise ValueError(f"Import cycle through {name}; hashed names cannot be resolved")
+        state[name] = "visiting"
+        if name.endswith(".js"):
+            for dependency in _relative_imports(name, sources[name]):
+                if dependency in sources:
+                    visit(dependency)
+        state[name] = "done"
+        order.append(name)
+
+    for name in sorted(sources):
+        visit(name)
+    return order
+
+
+def _rewrite_imports(name, source, manifest):
+    base = os.path.dirname(name)
+
+    def replace(match):
+        target = os.path.normpath(os.path.join(base, match.group(3))).replace(os.sep, "/")
+        hashed = manifest.get(target)
+        if hashed is None:
+            return match.group(0)
+        relative = os.path.relpath(hashed, os.path.join(DIST_NAME, base)).replace(os.sep, "/")
+        if not relative.startswith("."):
+            relative = "./" + relative
+        return f"{match.group(1)}{match.group(2)}{relative}{match.group(2)}"
+
+    return _IMPORT_RE.sub(replace, source)
+
+
+def _write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def build(static_dir=STATIC_DIR, minify=True):
+    """Build every asset under static_dir and return the manifest
+
+    The manifest maps each source name (as passed to url_for, e.g.
+    "js/admin.js") to its hashed name relative to static_dir.
+    """
+    dist_dir = os.path.join(static_dir, DIST_NAME)
+    sources = {}
+    for name in _source_files(static_dir):
+        with open(os.path.join(static_dir, name), encoding="utf-8") as f:
+            sources[name] = f.read()
+
+    # Pages rendered before a deploy keep working until the new build replaces
+    # them entirely, so it is written apart and swapped in once complete
+    build_dir = tempfile.mkdtemp(prefix=BUILD_PREFIX, dir=static_dir)
+    os.chmod(build_dir, 0o755)
+    previous = None
+    try:
+        manifest, report = _build_into(build_dir, sources, minify)
+        if os.path.isdir(dist_dir):
+            # Renaming onto the empty directory makes room for the new build
+            previous = tempfile.mkdtemp(prefix=BUILD_PREFIX, dir=static_dir)
+            os.replace(dist_dir, previous)
+        os.replace(build_dir, dist_dir)
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+    if previous is not None:
+        shutil.rmtree(previous, ignore_errors=True)
+
+    for name, sizes in report:
+        print(f"{name:28} " + "  ".join(f"{label} {size:7d}" for label, size in zip(("raw", "min", "gz", "br"), sizes)))
+    return manifest
+
+
+def _build_into(build_dir, sources, minify):
+    # Writes what build() publishes as dist/ into build_dir
+    manifest = {}
+    report = []
+    for name in _build_order(sources):
+        source = sources[name]
+        if name.endswith(".js"):
+            source = _rewrite_imports(name, source, manifest)
+            if minify:
+                source = minify_js(source)
+        elif minify:
+            source = minify_css(source)
+
+        data = source.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+        stem, extension = os.path.splitext(name)
+        hashed = f"{DIST_NAME}/{stem}.{digest}{extension}"
+        output = os.path.join(build_dir, f"{stem}.{digest}{extension}")
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+
+        _write(output, data)
+        compressed = gzip.compress(data, GZIP_LEVEL, mtime=0)
+        _write(output + ".gz", compressed)
+        sizes = [len(sources[name].encode("utf-8")), len(data), len(compressed)]
+        if brotli is not None:
+            compressed = brotli.compress(data, quality=BROTLI_QUALITY)
+            _write(output + ".br", compressed)
+            sizes.append(len(compressed))
+        manifest[name] = hashed
+        report.append((name, sizes))
+
+    with open(os.path.join(build_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest, report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build fingerprinted, precompressed static assets")
+    parser.add_argument("--no-minify", action="store_true", help="Hash and compress without minifying")
+    args = parser.parse_args(argv)
+
+    manifest = build(minify=not args.no_minify)
+    print(f"Wrote {len(manifest)} assets to static/{DIST_NAME}/")
+    if brotli is None:
+        print("brotli is not installed; no .br files were written")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""
+Circuit breaker and last-good snapshots for Smallie's Firestore reads
+
+CircuitBreaker counts consecutive failures of one read. After
+CIRCUIT_FAILURE_THRESHOLD of them it opens: callers stop trying Firestore and
+answer from the last good value at once. After CIRCUIT_RESET_SECONDS the next
+caller is let through as the single probe; its success closes the breaker and
+its failure keeps it open for another period:
+
+    closed --failures--> open --reset timeout--> half-open --probe ok--> closed
+                          ^                          |
+                          +-------probe failed-------+
+
+SnapshotStore keeps the last good value of each read on local disk, so a
+worker started while Firestore is down still has real data to serve instead
+of the built-in mock contestants. Values are written as JSON; anything JSON
+cannot represent, such as Firestore timestamps, is stored as its string.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+
+DEFAULT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "3"))
+DEFAULT_RESET_SECONDS = float(os.environ.get("CIRCUIT_RESET_SECONDS", "15"))
+DEFAULT_SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", "/tmp/smallie-snapshots")
+
+# Minimum delay between writes of one snapshot that keeps changing
+SNAPSHOT_WRITE_INTERVAL_SECONDS = 10.0
+
+
+class Unavailable(Exception):
+    """Raised by a read that got no data because its source is down, so it counts as a failure"""
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATES = (CLOSED, OPEN, HALF_OPEN)
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker letting one probe through after each reset timeout"""
+
+    def __init__(self, name, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+
+        # Counters exposed through stats()
+        self.trips = 0
+        self.rejected = 0
+
+    def allow(self):
+        """Return "call" or "probe" when the caller may try the read, else None"""
+        with self._lock:
+            if self.state == CLOSED:
+                return "call"
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                return "probe"
+            self.rejected += 1
+            return None
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logging.info(f"Circuit {self.name} closed after {time.monotonic() - self.opened_at:.0f} s")
+            self.state = CLOSED
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                if self.state == CLOSED:
+                    self.trips += 1
+                    logging.warning(f"Circuit {self.name} opened after {self.failures} consecutive failures")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "open_seconds": (time.monotonic() - self.opened_at) if self.opened_at is not None else None,
+                "trips": self.trips,
+                "rejected": self.rejected,
+            }
+
+    def _reset_lock(self):
+        self._lock = threading.Lock()
+
+
+class SnapshotStore:
+    """Last good values by name, on local disk"""
+
+    def __init__(self, directory=DEFAULT_SNAPSHOT_DIR):
+        self.directory = directory
+        self._written_at = {}
+
+    def load(self, name):
+        """Return (value, saved_at) or None when no snapshot was saved"""
+        try:
+            with open(self._path(name)) as f:
+                snapshot = json.load(f)
+            return snapshot["value"], snapshot["saved_at"]
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError) as e:
+            logging.error(f"Ignoring unreadable snapshot {name}: {e}")
+            return None
+
+    def save(self, name, value, saved_at, force=False):
+        """Write a value, at most once every SNAPSHOT_WRITE_INTERVAL_SECONDS unless forced"""
+        now = time.monotonic()
+        if not force and now - self._written_at.get(name, float("-inf")) < SNAPSHOT_WRITE_INTERVAL_SECONDS:
+            return False
+        self._written_at[name] = now
+        path = self._path(name)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temporary, "w") as f:
+                json.dump({"value": value, "saved_at": saved_at}, f, default=str, separators=(",", ":"))
+            os.replace(temporary, path)
+            return True
+        except (OSError, TypeError, ValueError) as e:
+            logging.error(f"Error saving snapshot {name}: {e}")
+            return False
+
+    def _path(self, name):
+        return os.path.join(self.directory, f"{name}.json")
@@ -0,0 +1,248 @@
+"""
+Competition calendar for Smallie
+
+Resolves the current competition day and its task from a schedule that is
+loaded once per process. Each day's task is released at its release_time and
+voting closes at its voting_close_time, both in West Africa Time (the
+Africa/Lagos zone, which has a fixed UTC+1 offset). The schedule is turned
+into a sorted index of boundaries:
+
+    before day 1's release        day 0, "Competition starts soon"
+    day N release -> day N+1      day N and its task
+    after the last voting close   day COMPETITION_DAYS + 1, "Competition has ended"
+
+The period containing the current moment is cached together with its end,
+so resolving the task is a single comparison per request until the next
+boundary, where it rolls over exactly at release time (09:00 WAT).
+
+The schedule is read from the tasks collection when Firebase is available
+and falls back to the built-in DAILY_TASKS; a fallback schedule is reloaded
+by the first lookup once CIRCUIT_RESET_SECONDS have passed, and at the next
+boundary.
+"""
+
+import time
+import bisect
+import logging
+import datetime
+import threading
+
+from vote_rollups import WAT
+from circuit_breaker import DEFAULT_RESET_SECONDS
+
+COMPETITION_START = datetime.date(2025, 4, 15)
+COMPETITION_DAYS = 7
+RELEASE_HOUR = 9
+VOTING_CLOSE_HOUR = 21
+
+TASKS_COLLECTION = "tasks"
+
+DAILY_TASKS = [
+    {
+        "day": 1,
+        "date": "2025-04-15",
+        "title": "Naija Throwback Dance Challenge",
+        "description": "60-second dance to a classic hit (e.g., P-Square)",
+        "release_time": "09:00 WAT",
+        "voting_close_time": "21:00 WAT"
+    },
+    {
+        "day": 2,
+        "date": "2025-04-16",
+        "title": "Jollof Wars: Cook-Off Edition",
+        "description": "Cook jollof with ₦500 in 10 minutes, taste it",
+        "release_time": "09:00 WAT",
+        "voting_close_time": "21:00 WAT"
+    },
+    {
+        "day": 3,
+        "date": "2025-04-17",
+        "title": "Nollywood Skit Showdown",
+        "description": "2-minute Nollywood skit (e.g., Cheating Husband)",
+        "release_time": "09:00 WAT",
+        "voting_close_time": "21:00 WAT"
+    },
+    {
+        "day": 4,
+        "date": "2025-04-18",
+        "title": "Afrobeat Freestyle Face-Off",
+        "description": "1-minute freestyle on a trending beat (e.g., Burna Boy)",
+        "release_time": "09:00 WAT",
+        "voting_close_time": "21:00 WAT"
+    },
+    {
+        "day": 5,
+        "date": "2025-04-19",
+        "title": "Owambe Fashion Flex",
+        "description": "Style an owambe outfit from home, 90-second catwalk",
+        "release_time": "09:00 WAT",
+        "voting_close_time": "21:00 WAT"
+    },
+    {
+        "day": 6,
+        "date": "2025-04-20",
+        "title": "Pidgin Proverbs Remix",
+        "description": "60-second pidgin skit/song from a proverb (e.g., Monkey no fine...)",
+        "release_time": "09:00 WAT",
+        "voting_close_time": "21:00 WAT"
+    },
+    {
+        "day": 7,
+        "date": "2025-04-21",
+        "title": "Lagos Hustle Pitch",
+        "description": "3-minute pitch as Smallie winner",
+        "release_time": "09:00 WAT",
+        "voting_close_time": "21:00 WAT"
+    }
+]
+
+BEFORE_TASK = {"title": "Competition starts soon", "description": "Stay tuned for Day 1!", "day": 0}
+AFTER_TASK = {"title": "Competition has ended", "description": "Thanks for participating!", "day": COMPETITION_DAYS + 1}
+MISSING_TASK = {"title": "No task available", "description": "Check back later"}
+
+_BUILTIN_TASKS = {task["day"]: task for task in DAILY_TASKS}
+
+
+def builtin_task(day):
+    """Return the built-in task for a day, without touching Firestore"""
+    return _BUILTIN_TASKS.get(day, MISSING_TASK)
+
+
+def _parse_time(value, default_hour):
+    # Schedule times are stored as "HH:MM WAT"
+    try:
+        hours, minutes = str(value).split()[0].split(":")
+        return datetime.time(int(hours), int(minutes))
+    except (ValueError, IndexError):
+        return datetime.time(default_hour)
+
+
+def _task_moment(task, field, default_hour):
+    day = task["day"]
+    try:
+        date = datetime.date.fromisoformat(task.get("date", ""))
+    except (TypeError, ValueError):
+        date = COMPETITION_START + datetime.timedelta(days=day - 1)
+    moment = datetime.datetime.combine(date, _parse_time(task.get(field), default_hour), WAT)
+    return moment.timestamp()
+
+
+def build_index(tasks):
+    """Build the sorted boundary index for a schedule
+
+    Returns (starts, periods): starts is a sorted list of UNIX timestamps and
+    periods[i] the (day, task) in effect from starts[i] until starts[i + 1].
+    Moments before starts[0] belong to day 0.
+    """
+    tasks = sorted(tasks, key=lambda task: task["day"])
+    starts = [_task_moment(task, "release_time", RELEASE_HOUR) for task in tasks]
+    periods = [(task["day"], task) for task in tasks]
+    if tasks:
+        starts.append(_task_moment(tasks[-1], "voting_close_time", VOTING_CLOSE_HOUR))
+        periods.append((AFTER_TASK["day"], AFTER_TASK))
+    return starts, periods
+
+
+class CompetitionCalendar:
+    """Per-process resolver of the current competition day and task"""
+
+    def __init__(self, get_db=None, collection=TASKS_COLLECTION, tasks=DAILY_TASKS, retry=DEFAULT_RESET_SECONDS):
+        self._get_db = get_db
+        self.collection = collection
+        self.builtin_tasks = tasks
+        # Seconds before a fallback schedule is replaced by another attempt at the stored one
+        self.retry = retry
+
+        self._lock = threading.Lock()
+        self._starts = None
+        self._periods = None
+        self._from_firestore = False
+        self._loaded_at = 0.0
+        # (start, end, day, task) of the period containing the last lookup
+        self._active = None
+
+        # Counters exposed through stats()
+        self.schedule_loads = 0
+        self.rollovers = 0
+
+    def current(self, now=None):
+        """Return (day, task) in effect at `now` (a UNIX timestamp, default now)"""
+        if now is None:
+            now = time.time()
+        active = self._active
+        if active is not None and active[0] <= now < active[1] and not self._retry_due():
+            return active[2], active[3]
+        return self._resolve(now)
+
+    def task(self, day):
+        """Return the scheduled task for a day"""
+        with self._lock:
+            self._ensure_schedule()
+            for period_day, task in self._periods:
+                if period_day == day:
+                    return task
+        return builtin_task(day)
+
+    def reload(self):
+        """Drop the schedule so the next lookup loads it again"""
+        with self._lock:
+            self._starts = None
+            self._periods = None
+            self._active = None
+
+    def stats(self):
+        active = self._active
+        return {
+            "day": active[2] if active else None,
+            "next_boundary": active[1] if active else None,
+            "from_firestore": self._from_firestore,
+            "schedule_loads": self.schedule_loads,
+            "rollovers": self.rollovers,
+        }
+
+    def _resolve(self, now):
+        with self._lock:
+            if self._active is not None and not self._active[0] <= now < self._active[1]:
+                # Crossing a boundary is also the moment to retry a fallback schedule
+                self.rollovers += 1
+                if not self._from_firestore:
+                    self._starts = None
+            self._ensure_schedule()
+
+            index = bisect.bisect_right(self._starts, now) - 1
+            start = self._starts[index] if index >= 0 else float("-inf")
+            end = self._starts[index + 1] if index + 1 < len(self._starts) else float("inf")
+            day, task = self._periods[index] if index >= 0 else (BEFORE_TASK["day"], BEFORE_TASK)
+            self._active = (start, end, day, task)
+            return day, task
+
+    def _retry_due(self):
+        # Only a schedule that fell back while Firestore was configured is retried
+        return (not self._from_firestore and self._get_db is not None
+                and time.monotonic() - self._loaded_at >= self.retry)
+
+    def _ensure_schedule(self):
+        if self._starts is not None and not self._retry_due():
+            return
+        tasks, self._from_firestore = self._load_tasks()
+        self._starts, self._periods = build_index(tasks)
+        self._loaded_at = time.monotonic()
+        self.schedule_loads += 1
+
+    def _load_tasks(self):
+        db = self._get_db() if self._get_db is not None else None
+        if db is None:
+            return self.builtin_tasks, False
+        try:
+            stored = {}
+            for doc in db.collection(self.collection).stream():
+                task = doc.to_dict() or {}
+                if isinstance(task.get("day"), int):
+                    stored[task["day"]] = task
+        except Exception as e:
+            logging.error(f"Error loading the competition schedule from Firebase: {e}")
+            return self.builtin_tasks, False
+        # Days missing from Firestore keep their built-in task
+        merged = {task["day"]: task for task in self.builtin_tasks}
+        merged.update(stored)
+        return list(merged.values()), True
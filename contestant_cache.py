@@ -0,0 +1,193 @@
+"""
+In-process contestant cache for Smallie
+
+Keeps the contestants collection in memory for each worker so the homepage
+can render without reading Firestore on every request. The cache is fed by a
+Firestore snapshot listener and falls back to a TTL-bounded reload whenever
+the listener is not running.
+"""
+
+import os
+import time
+import logging
+import threading
+
+# How long a snapshot loaded with get() is trusted when no listener is active
+DEFAULT_TTL_SECONDS = float(os.environ.get("CONTESTANT_CACHE_TTL", "30"))
+
+# Minimum delay between attempts to (re)start a failed snapshot listener
+LISTENER_RETRY_SECONDS = 60
+
+
+class ContestantCache:
+    """Per-worker cache of the contestants collection"""
+
+    def __init__(self, get_db, collection="contestants", ttl=DEFAULT_TTL_SECONDS, listen=True):
+        self._get_db = get_db
+        self.collection = collection
+        self.ttl = ttl
+        self.listen = listen
+
+        self._lock = threading.Lock()
+        self._contestants = None
+        self._loaded_at = 0.0
+        self._watch = None
+        self._listener_synced = False
+        self._listener_retry_at = 0.0
+        self._subscribers = []
+
+        # Counters exposed through stats()
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.listener_updates = 0
+        self.invalidations = 0
+
+        # Incremented whenever a new snapshot is stored, for caches derived from it
+        self.version = 0
+
+    @property
+    def db(self):
+        """This process's Firestore client, or None while it is unavailable"""
+        return self._get_db()
+
+    def get(self):
+        """Return the cached contestants, reloading from Firestore if stale
+
+        The returned list is shared between requests and must not be mutated.
+        Returns None when Firestore is not available.
+        """
+        if self.db is None:
+            return None
+
+        self._ensure_listener()
+
+        with self._lock:
+            if self._contestants is not None and self._is_fresh():
+                self.hits += 1
+                return self._contestants
+            self.misses += 1
+
+        contestants = self._load()
+        with self._lock:
+            # A listener update may have landed while we were loading
+            stored = not (self._listener_synced and self._contestants is not None)
+            if stored:
+                self._store(contestants)
+            current = self._contestants
+        if stored:
+            self._notify(current)
+        return current
+
+    def get_versioned(self):
+        """Return (contestants, version) like get(), with the version of that snapshot
+
+        The version is None when the snapshot changed while it was read.
+        """
+        contestants = self.get()
+        with self._lock:
+            if contestants is not None and contestants is self._contestants:
+                return contestants, self.version
+        return contestants, None
+
+    def subscribe(self, callback):
+        """Register a callable invoked with the contestant list after each refresh"""
+        self._subscribers.append(callback)
+
+    def invalidate(self):
+        """Drop the cached snapshot so the next get() reloads from Firestore
+
+        A synced listener stays synced: the reloaded snapshot is kept until
+        the listener's next update rather than expiring after the TTL.
+        """
+        with self._lock:
+            self._contestants = None
+            self._loaded_at = 0.0
+            self.invalidations += 1
+
+    def stop(self):
+        """Detach the snapshot listener, if one is running"""
+        with self._lock:
+            watch, self._watch = self._watch, None
+            self._listener_synced = False
+        if watch is not None:
+            try:
+                watch.unsubscribe()
+            except Exception as e:
+                logging.error(f"Error stopping contestant listener: {e}")
+
+    def stats(self):
+        """Return counters describing cache effectiveness"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+                "reloads": self.reloads,
+                "listener_updates": self.listener_updates,
+                "invalidations": self.invalidations,
+                "version": self.version,
+                "listener_active": self._listener_active(),
+                "size": len(self._contestants) if self._contestants is not None else 0,
+                "age_seconds": (time.monotonic() - self._loaded_at) if self._loaded_at else None,
+            }
+
+    def _is_fresh(self):
+        # A synced listener pushes every change, so its snapshot never expires
+        if self._listener_synced and self._listener_active():
+            return True
+        return (time.monotonic() - self._loaded_at) < self.ttl
+
+    def _listener_active(self):
+        if self._watch is None:
+            return False
+        return getattr(self._watch, "is_active", True)
+
+    def _store(self, contestants):
+        self._contestants = contestants
+        self.version += 1
+        self._loaded_at = time.monotonic()
+
+    def _notify(self, contestants):
+        for callback in self._subscribers:
+            try:
+                callback(contestants)
+            except Exception as e:
+                logging.error(f"Error in contestant cache subscriber: {e}")
+
+    def _load(self):
+        docs = self.db.collection(self.collection).get()
+        contestants = [doc.to_dict() for doc in docs]
+        with self._lock:
+            self.reloads += 1
+        logging.info(f"Loaded {len(contestants)} contestants from Firestore")
+        return contestants
+
+    def _ensure_listener(self):
+        # Started lazily so that the listener thread is created in the worker
+        # process that serves requests, not in a parent that later forks
+        if not self.listen:
+            return
+        with self._lock:
+            if self._listener_active() or time.monotonic() < self._listener_retry_at:
+                return
+            if self._watch is not None:
+                logging.warning("Contestant listener stopped, restarting")
+                self._watch = None
+                self._listener_synced = False
+            try:
+                self._watch = self.db.collection(self.collection).on_snapshot(self._on_snapshot)
+            except Exception as e:
+                logging.error(f"Error starting contestant listener: {e}")
+                self._watch = None
+                self._listener_retry_at = time.monotonic() + LISTENER_RETRY_SECONDS
+
+    def _on_snapshot(self, docs, changes, read_time):
+        contestants = [doc.to_dict() for doc in docs]
+        with self._lock:
+            self._store(contestants)
+            self._listener_synced = True
+            self.listener_updates += 1
+        self._notify(contestants)
+        logging.debug(f"Contestant listener delivered {len(contestants)} contestants")
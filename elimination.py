@@ -0,0 +1,299 @@
+"""
+Daily elimination engine for Smallie
+
+The lowest-voted active contestant is eliminated each day when voting closes
+at 21:00 WAT. Per-day tallies are kept in tallies/day_N documents, keyed by
+the vote's competition day and updated inside the vote ingestion batch, so
+deciding an elimination reads one tally document and the contestants rather
+than every vote.
+
+Ties on the day's votes are broken by lower cumulative votes, then by the
+lower contestant id, so every run over the same data picks the same
+contestant. The elimination is written in a transaction together with an
+eliminations/day_N record, which makes repeated runs from several workers
+safe.
+
+Votes are acknowledged before they are committed, so the scheduled run does
+not start at the close itself: it first drains the registered vote
+ingestors, waits ELIMINATION_GRACE_SECONDS for other workers to commit their
+queued votes, and drains again.
+
+Usage:
+    python elimination.py run --day 3 [--dry-run] [--replay]
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+import datetime
+import threading
+
+from firebase_admin import firestore
+
+from vote_rollups import WAT, to_wat
+from repositories import FirestoreRepository, vote_ledger
+from competition_calendar import COMPETITION_START, COMPETITION_DAYS, VOTING_CLOSE_HOUR
+
+TALLY_COLLECTION = "tallies"
+ELIMINATION_COLLECTION = "eliminations"
+
+# Time after voting closes for queued votes to be committed before the run
+DEFAULT_GRACE_SECONDS = float(os.environ.get("ELIMINATION_GRACE_SECONDS", "120"))
+
+
+def competition_day(moment):
+    """Return the competition day a vote cast at this moment counts towards
+
+    Votes cast after voting closes count towards the following day. Returns
+    None outside the competition.
+    """
+    moment = to_wat(moment)
+    date = moment.date()
+    if moment.hour >= VOTING_CLOSE_HOUR:
+        date += datetime.timedelta(days=1)
+    day = (date - COMPETITION_START).days + 1
+    return day if 1 <= day <= COMPETITION_DAYS else None
+
+
+def voting_close(day):
+    """Return the aware datetime at which voting closes for a competition day"""
+    date = COMPETITION_START + datetime.timedelta(days=day - 1)
+    return datetime.datetime.combine(date, datetime.time(VOTING_CLOSE_HOUR), WAT)
+
+
+def _id_sort_key(contestant_id):
+    # Numeric ids sort numerically, anything else after them as text
+    contestant_id = str(contestant_id)
+    return (0, int(contestant_id), "") if contestant_id.isdigit() else (1, 0, contestant_id)
+
+
+def select_bottom(tally, contestants):
+    """Pick the contestant to eliminate from a day's tally
+
+    tally maps contestant id to that day's votes; contestants maps contestant
+    id to the contestant document. Only contestants that are not eliminated
+    are considered, including those with no votes that day. Runs in
+    O(contestants).
+    """
+    bottom = None
+    for contestant_id, contestant in contestants.items():
+        if contestant.get("eliminated"):
+            continue
+        key = (
+            tally.get(str(contestant_id), 0),
+            contestant.get("votes", 0),
+            _id_sort_key(contestant_id),
+        )
+        if bottom is None or key < bottom[0]:
+            bottom = (key, str(contestant_id))
+    if bottom is None:
+        return None
+    return {"contestantId": bottom[1], "dayVotes": bottom[0][0], "totalVotes": bottom[0][1]}
+
+
+class EliminationEngine:
+    """Keeps per-day tallies and applies the daily elimination"""
+
+    def __init__(self, get_db, tally_collection=TALLY_COLLECTION, elimination_collection=ELIMINATION_COLLECTION,
+                 grace=DEFAULT_GRACE_SECONDS, ledger=None):
+        self._get_db = get_db
+        # Repository the votes are read back from for replays; Firestore by default
+        self.ledger = ledger if ledger is not None else FirestoreRepository(get_db)
+        self.tally_collection = tally_collection
+        self.elimination_collection = elimination_collection
+        self.grace = grace
+
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._drains = []
+        self._scheduler = None
+
+        # Votes committed by this worker, by day; a local view for inspection
+        self.local_tallies = {}
+
+    @property
+    def db(self):
+        """This process's Firestore client, or None while it is unavailable"""
+        return self._get_db()
+
+    def add_listener(self, callback):
+        """Register a callable invoked with each applied elimination"""
+        self._listeners.append(callback)
+
+    def add_drain(self, callback):
+        """Register a callable committing queued votes, called before each scheduled run"""
+        self._drains.append(callback)
+
+    def batch_keys(self, vote):
+        """Tally document a live vote contributes to"""
+        return {("tally", vote["day"])} if vote.get("day") is not None else set()
+
+    def extend_batch(self, batch, votes):
+        """Add per-day tally increments for freshly ingested votes to a write batch"""
+        per_day = {}
+        for vote in votes:
+            if vote.get("day") is None:
+                continue
+            day = per_day.setdefault(vote["day"], {})
+            day[vote["contestantId"]] = day.get(vote["contestantId"], 0) + vote["count"]
+
+        for day, counts in per_day.items():
+            batch.set(self._tally_ref(day), {
+                "day": day,
+                "contestants": {cid: firestore.Increment(n) for cid, n in counts.items()},
+            }, merge=True)
+
+    def on_commit(self, votes):
+        with self._lock:
+            for vote in votes:
+                if vote.get("day") is None:
+                    continue
+                day = self.local_tallies.setdefault(vote["day"], {})
+                day[vote["contestantId"]] = day.get(vote["contestantId"], 0) + vote["count"]
+
+    def tally(self, day):
+        """Return a day's votes per contestant from the tally index"""
+        doc = self._tally_ref(day).get()
+        return dict((doc.to_dict() or {}).get("contestants", {})) if doc.exists else {}
+
+    def replay_tally(self, day):
+        """Rebuild a day's tally from the votes ledger
+
+        O(votes for the day); used to check the tally index in dry runs.
+        """
+        tally = {}
+        for vote in self.ledger.iter_votes(day=day):
+            contestant_id = str(vote.get("contestantId", ""))
+            tally[contestant_id] = tally.get(contestant_id, 0) + (vote.get("count") or 1)
+        return tally
+
+    def run(self, day, dry_run=False, replay=False):
+        """Decide and, unless dry_run is set, apply the elimination for a day
+
+        Returns a result dict describing the decision. With replay=True the
+        tally is rebuilt from the votes ledger and compared with the index.
+        """
+        contestants = {doc.id: doc.to_dict() or {} for doc in self.db.collection("contestants").stream()}
+        tally = self.tally(day)
+        result = {"day": day, "dryRun": dry_run, "tally": tally}
+
+        if replay:
+            replayed = self.replay_tally(day)
+            result["replayTally"] = replayed
+            result["tallyMatchesReplay"] = (
+                {cid: n for cid, n in replayed.items() if n} == {cid: n for cid, n in tally.items() if n}
+            )
+
+        active = [cid for cid, contestant in contestants.items() if not contestant.get("eliminated")]
+        if len(active) <= 1:
+            result["eliminated"] = None
+            result["reason"] = "Fewer than two active contestants"
+            return result
+
+        bottom = select_bottom(tally, contestants)
+        result["eliminated"] = bottom
+        if dry_run:
+            return result
+
+        applied = self._apply(day, bottom, tally)
+        result["applied"] = applied
+        if applied:
+            logging.info(f"Day {day}: eliminated contestant {bottom['contestantId']} with {bottom['dayVotes']} votes")
+            for callback in self._listeners:
+                try:
+                    callback(day, bottom)
+                except Exception as e:
+                    logging.error(f"Error publishing elimination for day {day}: {e}")
+        else:
+            existing = self.db.collection(self.elimination_collection).document(f"day_{day}").get()
+            if existing.exists:
+                result["eliminated"] = existing.to_dict()
+            logging.info(f"Day {day}: elimination was already applied")
+        return result
+
+    def start_scheduler(self):
+        """Run the elimination at every voting close in a background thread"""
+        if self._scheduler is not None and self._scheduler.is_alive():
+            return
+        self._scheduler = threading.Thread(target=self._schedule_loop, name="elimination-scheduler", daemon=True)
+        self._scheduler.start()
+
+    def _apply(self, day, bottom, tally):
+        record_ref = self.db.collection(self.elimination_collection).document(f"day_{day}")
+        contestant_ref = self.db.collection("contestants").document(bottom["contestantId"])
+
+        @firestore.transactional
+        def apply_in_transaction(transaction):
+            if record_ref.get(transaction=transaction).exists:
+                return False
+            transaction.update(contestant_ref, {"eliminated": True, "eliminated_day": day})
+            transaction.set(record_ref, {
+                "day": day,
+                "contestantId": bottom["contestantId"],
+                "dayVotes": bottom["dayVotes"],
+                "totalVotes": bottom["totalVotes"],
+                "tally": tally,
+                "decided_at": firestore.SERVER_TIMESTAMP,
+            })
+            return True
+
+        return apply_in_transaction(self.db.transaction())
+
+    def _tally_ref(self, day):
+        return self.db.collection(self.tally_collection).document(f"day_{day}")
+
+    def _drain(self, day):
+        for callback in self._drains:
+            try:
+                callback()
+            except Exception as e:
+                logging.error(f"Error committing queued votes before the day {day} elimination: {e}")
+
+    def _schedule_loop(self):
+        while True:
+            now = datetime.datetime.now(WAT)
+            upcoming = [d for d in range(1, COMPETITION_DAYS + 1) if voting_close(d) > now]
+            if not upcoming:
+                return
+            day = upcoming[0]
+            time.sleep(max(0.0, (voting_close(day) - now).total_seconds()))
+            self._drain(day)
+            time.sleep(self.grace)
+            self._drain(day)
+            try:
+                self.run(day)
+            except Exception as e:
+                logging.error(f"Error running elimination for day {day}: {e}")
+                # Retry shortly; the transaction keeps a late rerun safe
+                time.sleep(60)
+                try:
+                    self.run(day)
+                except Exception as retry_err:
+                    logging.error(f"Retry of elimination for day {day} failed: {retry_err}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run Smallie's daily elimination")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="Eliminate the lowest-voted contestant for a day")
+    run_parser.add_argument("--day", type=int, required=True)
+    run_parser.add_argument("--dry-run", action="store_true", help="Report the decision without applying it")
+    run_parser.add_argument("--replay", action="store_true", help="Check the tally index against the votes ledger")
+    args = parser.parse_args(argv)
+
+    from firebase_client import get_db
+    db = get_db()
+    if db is None:
+        print("Error: Firebase is not configured")
+        return 1
+
+    engine = EliminationEngine(get_db, ledger=vote_ledger(get_db))
+    result = engine.run(args.day, dry_run=args.dry_run, replay=args.replay)
+    print(result)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Streaming exports of signups, votes and payments for Smallie
+
+Full dumps for payouts and audits, as CSV or NDJSON, served by
+/api/admin/<collection>/export and by the command line below. Documents are
+read a page at a time with the admin listing's keyset cursors and written
+out row by row through generators, so memory stays flat however large the
+collection is.
+
+The last row of every page carries a resume token in its _cursor column
+(empty on other rows). An interrupted export continues from the last token
+received with cursor=<token>; rows after that token are sent again, so a
+client should drop anything it kept past the last token before resuming.
+The command line does this itself: it records the token and the file
+offset after each page in <output>.cursor, and --resume truncates the file
+back to that point and carries on.
+
+Usage:
+    python exports.py votes --output votes.csv [--format csv] [--day 3] [--resume]
+"""
+
+import io
+import os
+import sys
+import csv
+import json
+import datetime
+import argparse
+
+from admin_queries import COLLECTIONS, iter_pages, parse_args
+from repositories import LEDGER_COLLECTIONS, LedgerElsewhere, require_firestore_ledger
+
+# Documents read per Firestore query while exporting
+EXPORT_PAGE_SIZE = 500
+MAX_EXPORT_PAGE_SIZE = 1000
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+CURSOR_COLUMN = "_cursor"
+
+
+def _cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(",", ":"))
+    return value
+
+
+def _rows(pages):
+    # Yields (item, cursor) with the page's resume token on its last row
+    for page in pages:
+        items = page["items"]
+        for index, item in enumerate(items):
+            last = index == len(items) - 1
+            yield item, page["nextCursor"] if last else None
+
+
+def _csv_chunks(collection, pages, header=True):
+    columns = ["id"] + COLLECTIONS[collection].fields
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(columns + [CURSOR_COLUMN])
+    for item, cursor in _rows(pages):
+        writer.writerow([_cell(item.get(column)) for column in columns] + [cursor or ""])
+        if cursor is not None or buffer.tell() > 64 * 1024:
+            yield buffer.getvalue(), cursor
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue(), None
+
+
+def _ndjson_chunks(collection, pages, header=True):
+    chunk = []
+    for item, cursor in _rows(pages):
+        row = dict(item)
+        row[CURSOR_COLUMN] = cursor
+        chunk.append(json.dumps(row, separators=(",", ":"), default=str))
+        if cursor is not None or len(chunk) >= 1000:
+            yield "\n".join(chunk) + "\n", cursor
+            chunk = []
+    if chunk:
+        yield "\n".join(chunk) + "\n", None
+
+
+CHUNKERS = {"csv": _csv_chunks, "ndjson": _ndjson_chunks}
+
+
+def export_chunks(db, collection, args, export_format="csv"):
+    """Return a generator of (text, cursor) for request-style arguments
+
+    cursor is the resume token when the text ends a page, else None. Raises
+    admin_queries.QueryError for invalid arguments, and LedgerElsewhere for
+    a ledger kept outside Firestore, before anything is read, so a request
+    can still be answered with an error.
+    """
+    filters, order, descending, page_size, cursor = parse_args(
+        collection, args, newest_first=False,
+        default_page_size=EXPORT_PAGE_SIZE, max_page_size=MAX_EXPORT_PAGE_SIZE,
+    )
+    pages = iter_pages(db, collection, filters, order, descending, page_size, cursor)
+    # A resumed export appends to one that already has its header
+    return CHUNKERS[export_format](collection, pages, header=cursor is None)
+
+
+def export(db, collection, args, export_format="csv"):
+    """Return a generator of export text, for streaming as a response body"""
+    chunks = export_chunks(db, collection, args, export_format)
+    return (text for text, _ in chunks)
+
+
+def export_filename(collection, export_format):
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    return f"smallie-{collection}-{stamp}.{export_format}"
+
+
+def _read_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_checkpoint(path, checkpoint):
+    temporary = path + ".tmp"
+    with open(temporary, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(temporary, path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a Smallie collection as CSV or NDJSON")
+    parser.add_argument("collection", choices=sorted(COLLECTIONS))
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--format", choices=sorted(FORMATS), default=None,
+                        help="Defaults to the output file's extension, else csv")
+    parser.add_argument("--page-size", type=int, default=EXPORT_PAGE_SIZE)
+    parser.add_argument("--order", default=None)
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted export")
+    for param in sorted({param for spec in COLLECTIONS.values() for param in spec.filters}):
+        parser.add_argument(f"--{param}", default=None)
+    args = parser.parse_args(argv)
+
+    export_format = args.format or ("ndjson" if args.output.endswith((".ndjson", ".jsonl")) else "csv")
+    checkpoint_path = args.output + ".cursor"
+    query_args = {param: getattr(args, param) for param in COLLECTIONS[args.collection].filters}
+    query_args.update(order=args.order, pageSize=args.page_size)
+
+    offset = 0
+    if args.resume:
+        checkpoint = _read_checkpoint(checkpoint_path)
+        if checkpoint is None:
+            print(f"Error: no checkpoint at {checkpoint_path}")
+            return 1
+        if checkpoint.get("done"):
+            print(f"Export to {args.output} already finished")
+            return 0
+        query_args["cursor"] = checkpoint["cursor"]
+        offset = checkpoint["offset"]
+
+    if args.collection in LEDGER_COLLECTIONS:
+        try:
+            require_firestore_ledger(f"Exporting {args.collection}")
+        except LedgerElsewhere as e:
+            print(f"Error: {e}")
+            return 1
+
+    from firebase_client import get_db
+    db = get_db()
+    if db is None:
+        print("Error: Firebase is not configured")
+        return 1
+
+    with open(args.output, "r+b" if args.resume else "wb") as out:
+        # Anything written after the last checkpoint is sent again
+        out.seek(offset)
+        out.truncate()
+        for text, cursor in export_chunks(db, args.collection, query_args, export_format):
+            data = text.encode("utf-8")
+            out.write(data)
+            offset += len(data)
+            if cursor:
+                out.flush()
+                os.fsync(out.fileno())
+                _write_checkpoint(checkpoint_path, {"cursor": cursor, "offset": offset})
+                print(f"\r{offset / 1e6:8.1f} MB written", end="", file=sys.stderr)
+    _write_checkpoint(checkpoint_path, {"done": True, "offset": offset})
+    print(f"\nExported {args.collection} to {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+"""
+Lazy Firebase client factory for Smallie
+
+Firebase is initialized on first use rather than at import, once per
+process, so importing the app (and every serverless cold start) does not wait
+on credential parsing or gRPC channel setup. warm_up() starts the
+initialization in a background thread so it overlaps with the rest of
+start-up. A client created before fork() is never reused in the child.
+"""
+
+import os
+import json
+import time
+import base64
+import logging
+import threading
+
+import firebase_admin
+from firebase_admin import credentials, firestore
+
+from firestore_instrumentation import InstrumentedClient
+
+# Delay before retrying after initialization failed
+RETRY_SECONDS = 30.0
+
+_lock = threading.Lock()
+_db = None
+_pid = None
+_failed_at = None
+_init_ms = None
+_observers = []
+
+
+def load_credentials():
+    """Parse FIREBASE_CREDENTIALS as base64 JSON, plain JSON or a file path
+
+    Returns the credentials dict, or None if they are missing or invalid.
+    """
+    firebase_creds_json = os.environ.get("FIREBASE_CREDENTIALS")
+    if not firebase_creds_json:
+        logging.warning("FIREBASE_CREDENTIALS not found in environment variables")
+        return None
+
+    try:
+        # Try to decode base64 (for Vercel deployment)
+        decoded_creds = base64.b64decode(firebase_creds_json).decode('utf-8')
+        cred_dict = json.loads(decoded_creds)
+        logging.info("Successfully decoded base64 Firebase credentials")
+        return cred_dict
+    except Exception:
+        pass
+
+    try:
+        # For a JSON-formatted string
+        cred_dict = json.loads(firebase_creds_json)
+        logging.info("Successfully parsed Firebase credentials as JSON string")
+        return cred_dict
+    except json.JSONDecodeError:
+        pass
+
+    # If it's not a valid JSON string, it might be the path to a JSON file
+    if not os.path.exists(firebase_creds_json):
+        logging.error(f"Firebase credentials file not found: {firebase_creds_json}")
+        return None
+    try:
+        with open(firebase_creds_json, 'r') as f:
+            cred_dict = json.load(f)
+            logging.info("Successfully loaded Firebase credentials from file")
+            return cred_dict
+    except Exception as file_err:
+        logging.error(f"Error loading credentials file: {file_err}")
+        return None
+
+
+def get_db():
+    """Return this process's Firestore client, initializing it on first use
+
+    Returns None when Firebase is not configured or failed to initialize;
+    a failed initialization is retried after RETRY_SECONDS.
+    """
+    if _pid == os.getpid() and _db is not None:
+        return _db
+    with _lock:
+        return _initialize()
+
+
+def warm_up():
+    """Initialize the client in a background thread"""
+    thread = threading.Thread(target=get_db, name="firebase-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def reset():
+    """Forget the client so the next get_db() creates a new one
+
+    Used after fork() in servers that preload the app.
+    """
+    global _db, _pid, _failed_at
+    with _lock:
+        _db = None
+        _pid = None
+        _failed_at = None
+
+
+def add_observer(observe):
+    """Report every Firestore call to observe(collection, op, seconds, reads, writes)
+
+    See firestore_instrumentation for the operations reported.
+    """
+    _observers.append(observe)
+
+
+def install(db):
+    """Use the given client in this process, e.g. an in-memory fake in benchmarks"""
+    global _db, _pid, _failed_at
+    with _lock:
+        _db = InstrumentedClient(db, _notify)
+        _pid = os.getpid()
+        _failed_at = None
+
+
+def status():
+    """Describe the client's state for health checks"""
+    return {
+        "initialized": _db is not None and _pid == os.getpid(),
+        "init_ms": _init_ms,
+        "failed": _failed_at is not None,
+    }
+
+
+def _notify(collection, op, seconds, reads, writes):
+    for observe in _observers:
+        observe(collection, op, seconds, reads, writes)
+
+
+def _after_fork_in_child():
+    # The parent may have held the lock while forking
+    global _lock
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def _initialize():
+    global _db, _pid, _failed_at, _init_ms
+    if _pid == os.getpid() and _db is not None:
+        return _db
+    if _failed_at is not None and _pid == os.getpid() and time.monotonic() - _failed_at < RETRY_SECONDS:
+        return None
+
+    started = time.perf_counter()
+    _db = None
+    _pid = os.getpid()
+    try:
+        cred_dict = load_credentials()
+        if not cred_dict:
+            logging.warning("Could not parse Firebase credentials")
+            _failed_at = time.monotonic()
+            return None
+
+        # One firebase_admin app per process: an app created before fork()
+        # holds gRPC channels that must not be used from the child
+        app_name = f"smallie-{os.getpid()}"
+        try:
+            app = firebase_admin.get_app(app_name)
+        except ValueError:
+            app = firebase_admin.initialize_app(credentials.Certificate(cred_dict), name=app_name)
+        _db = InstrumentedClient(firestore.client(app), _notify)
+        _failed_at = None
+        _init_ms = (time.perf_counter() - started) * 1000
+        logging.info(f"Firebase initialized successfully in {_init_ms:.0f} ms")
+        return _db
+    except Exception as e:
+        logging.error(f"Error initializing Firebase: {e}")
+        _failed_at = time.monotonic()
+        return None
@@ -0,0 +1,168 @@
+"""
+Per-request Firestore cost accounting for Smallie
+
+Firestore bills per document read and written. FirestoreBudget counts the
+documents each request reads and writes, through a firebase_client observer,
+and reports them in a Server-Timing header:
+
+  Server-Timing: firestore;dur=12.4;desc="reads=31 writes=0 calls=2"
+
+Requests over FIRESTORE_READ_BUDGET reads or FIRESTORE_WRITE_BUDGET writes
+are logged with their route; FirestoreBudget.limit() sets a tighter or looser
+budget for one route.
+
+Costs are tracked in a context variable, so calls made by background threads
+(listeners, batched vote commits) are not charged to whichever request
+happens to be running. Work a request hands to a thread pool is charged to it
+when submitted with contextvars.copy_context().run.
+
+track() measures any block of code, which lets a test pin a route's cost:
+
+    with track() as cost:
+        client.get("/")
+    assert cost.reads <= 5
+"""
+
+import os
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+DEFAULT_READ_BUDGET = int(os.environ.get("FIRESTORE_READ_BUDGET", "100"))
+DEFAULT_WRITE_BUDGET = int(os.environ.get("FIRESTORE_WRITE_BUDGET", "20"))
+SERVER_TIMING_ENABLED = os.environ.get("FIRESTORE_SERVER_TIMING", "1") == "1"
+
+_current = contextvars.ContextVar("firestore_cost", default=None)
+
+
+class FirestoreCost:
+    """Documents read and written, calls made and time spent in Firestore"""
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.reads = 0
+        self.writes = 0
+        self.calls = 0
+        self.seconds = 0.0
+        self.by_collection = {}
+        # Calls made from a request's worker threads are charged concurrently
+        self._lock = threading.Lock()
+
+    def add(self, collection, op, seconds, reads, writes):
+        cost = self
+        while cost is not None:
+            with cost._lock:
+                cost.reads += reads
+                cost.writes += writes
+                cost.calls += 1
+                cost.seconds += seconds
+                counts = cost.by_collection.setdefault(collection, [0, 0])
+                counts[0] += reads
+                counts[1] += writes
+            cost = cost.parent
+
+    def to_dict(self):
+        return {
+            "reads": self.reads,
+            "writes": self.writes,
+            "calls": self.calls,
+            "ms": round(self.seconds * 1000, 1),
+            "collections": {name: {"reads": r, "writes": w} for name, (r, w) in self.by_collection.items()},
+        }
+
+    def server_timing(self):
+        return f'firestore;dur={self.seconds * 1000:.1f};desc="reads={self.reads} writes={self.writes} calls={self.calls}"'
+
+
+def observe(collection, op, seconds, reads, writes):
+    """firebase_client observer charging each call to the cost being tracked"""
+    cost = _current.get()
+    if cost is not None:
+        cost.add(collection, op, seconds, reads, writes)
+
+
+def current():
+    """The cost being tracked in this context, or None"""
+    return _current.get()
+
+
+@contextmanager
+def track():
+    """Count the Firestore documents read and written inside the block
+
+    Tracking nests: calls are charged to every enclosing block as well.
+    """
+    cost = FirestoreCost(parent=_current.get())
+    token = _current.set(cost)
+    try:
+        yield cost
+    finally:
+        _current.reset(token)
+
+
+class FirestoreBudget:
+    """Server-Timing headers and over-budget logging for a Flask app's Firestore use"""
+
+    def __init__(self, app, reads=DEFAULT_READ_BUDGET, writes=DEFAULT_WRITE_BUDGET,
+                 server_timing=SERVER_TIMING_ENABLED):
+        self.reads = reads
+        self.writes = writes
+        self.server_timing = server_timing
+        self.over_budget = 0
+        self._limits = {}
+
+        from flask import g, request
+
+        @app.before_request
+        def start_tracking():
+            cost = FirestoreCost(parent=_current.get())
+            g._firestore_cost = cost
+            g._firestore_token = _current.set(cost)
+
+        @app.after_request
+        def add_server_timing(response):
+            cost = g.get("_firestore_cost")
+            if cost is not None and self.server_timing:
+                # Streamed bodies are read after this point and only show up in the log
+                response.headers.add("Server-Timing", cost.server_timing())
+            return response
+
+        @app.teardown_request
+        def stop_tracking(error=None):
+            cost = g.pop("_firestore_cost", None)
+            token = g.pop("_firestore_token", None)
+            if cost is None:
+                return
+            try:
+                _current.reset(token)
+            except ValueError:
+                # Torn down from another context, e.g. after a streamed response
+                _current.set(cost.parent)
+            self._check(cost, request.endpoint, request.url_rule.rule if request.url_rule is not None else request.path)
+
+    def limit(self, reads=None, writes=None):
+        """Decorator giving one view its own budget"""
+        def decorator(view):
+            self._limits[view.__name__] = (reads, writes)
+            return view
+        return decorator
+
+    def exempt(self, view):
+        """Decorator for views whose cost grows with the data by design, like exports"""
+        return self.limit(reads=float("inf"), writes=float("inf"))(view)
+
+    def budget_for(self, endpoint):
+        reads, writes = self._limits.get(endpoint, (None, None))
+        return (self.reads if reads is None else reads, self.writes if writes is None else writes)
+
+    def _check(self, cost, endpoint, route):
+        reads, writes = self.budget_for(endpoint)
+        if cost.reads <= reads and cost.writes <= writes:
+            return
+        self.over_budget += 1
+        collections = ", ".join(f"{name} {r}r/{w}w" for name, (r, w) in sorted(cost.by_collection.items()))
+        logging.warning(
+            f"Request to {route} over Firestore budget: {cost.reads} reads (budget {reads}), "
+            f"{cost.writes} writes (budget {writes}) in {cost.calls} calls; {collections}"
+        )
@@ -0,0 +1,223 @@
+"""
+Instrumented Firestore client for Smallie
+
+InstrumentedClient wraps a Firestore client and reports every round trip to
+an observer as observe(collection, op, seconds, reads, writes):
+
+  get, set, update, create, delete   one document
+  add                                 a new document in a collection
+  query                               get() or stream() of a query; seconds
+                                      covers only the time spent fetching,
+                                      not the caller's work between documents
+  get_all                             several documents in one call
+  commit                              a write batch, reported once for each
+                                      collection it writes to
+  listen                              a snapshot delivered to a listener
+
+reads and writes are the documents billed: one read per document returned
+(at least one per query) and one write per document written. Documents,
+queries and batches returned by the wrapper are wrapped in turn; everything
+else, including snapshots and transactions, is the client's own.
+"""
+
+import time
+import logging
+
+
+def _unwrap(value):
+    return value._target if isinstance(value, _Wrapper) else value
+
+
+class _Wrapper:
+    """Delegates everything it does not instrument to the wrapped object"""
+
+    def __init__(self, owner, target):
+        self._owner = owner
+        self._target = target
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+
+class InstrumentedClient(_Wrapper):
+    """Firestore client reporting each call to observe(collection, op, seconds, reads, writes)"""
+
+    def __init__(self, client, observe):
+        super().__init__(self, client)
+        self._observe = observe
+
+    @property
+    def client(self):
+        """The wrapped client"""
+        return self._target
+
+    def collection(self, *path):
+        return _Collection(self, self._target.collection(*path))
+
+    def document(self, *path):
+        return _Document(self, self._target.document(*path))
+
+    def batch(self):
+        return _Batch(self, self._target.batch())
+
+    def transaction(self, **kwargs):
+        return self._target.transaction(**kwargs)
+
+    def get_all(self, references, **kwargs):
+        references = [_unwrap(reference) for reference in references]
+        started = time.perf_counter()
+        docs = list(self._target.get_all(references, **kwargs))
+        collection = references[0].parent.id if references else ""
+        self._report(collection, "get_all", time.perf_counter() - started, reads=len(references))
+        return docs
+
+    def _report(self, collection, op, seconds, reads=0, writes=0):
+        try:
+            self._observe(collection, op, seconds, reads, writes)
+        except Exception as e:
+            logging.error(f"Error in Firestore observer: {e}")
+
+    def _timed(self, collection, op, call, reads=0, writes=0):
+        started = time.perf_counter()
+        try:
+            return call()
+        finally:
+            self._report(collection, op, time.perf_counter() - started, reads, writes)
+
+
+class _Document(_Wrapper):
+    @property
+    def _collection(self):
+        return self._target.parent.id
+
+    @property
+    def parent(self):
+        return _Collection(self._owner, self._target.parent)
+
+    def collection(self, name):
+        return _Collection(self._owner, self._target.collection(name))
+
+    def get(self, *args, **kwargs):
+        return self._owner._timed(self._collection, "get", lambda: self._target.get(*args, **kwargs), reads=1)
+
+    def set(self, *args, **kwargs):
+        return self._owner._timed(self._collection, "set", lambda: self._target.set(*args, **kwargs), writes=1)
+
+    def update(self, *args, **kwargs):
+        return self._owner._timed(self._collection, "update", lambda: self._target.update(*args, **kwargs), writes=1)
+
+    def create(self, *args, **kwargs):
+        return self._owner._timed(self._collection, "create", lambda: self._target.create(*args, **kwargs), writes=1)
+
+    def delete(self, *args, **kwargs):
+        return self._owner._timed(self._collection, "delete", lambda: self._target.delete(*args, **kwargs), writes=1)
+
+
+class _Query(_Wrapper):
+    def __init__(self, owner, target, collection):
+        super().__init__(owner, target)
+        self._collection = collection
+
+    def _wrap(self, query):
+        return _Query(self._owner, query, self._collection)
+
+    def where(self, *args, **kwargs):
+        return self._wrap(self._target.where(*args, **kwargs))
+
+    def order_by(self, *args, **kwargs):
+        return self._wrap(self._target.order_by(*args, **kwargs))
+
+    def limit(self, *args, **kwargs):
+        return self._wrap(self._target.limit(*args, **kwargs))
+
+    def offset(self, *args, **kwargs):
+        return self._wrap(self._target.offset(*args, **kwargs))
+
+    def select(self, *args, **kwargs):
+        return self._wrap(self._target.select(*args, **kwargs))
+
+    def start_after(self, values):
+        if isinstance(values, dict):
+            values = {key: _unwrap(value) for key, value in values.items()}
+        return self._wrap(self._target.start_after(values))
+
+    def start_at(self, values):
+        if isinstance(values, dict):
+            values = {key: _unwrap(value) for key, value in values.items()}
+        return self._wrap(self._target.start_at(values))
+
+    def get(self, *args, **kwargs):
+        started = time.perf_counter()
+        docs = list(self._target.stream(*args, **kwargs))
+        self._owner._report(self._collection, "query", time.perf_counter() - started, reads=max(1, len(docs)))
+        return docs
+
+    def stream(self, *args, **kwargs):
+        # Documents arrive in pages as the caller iterates; only time spent
+        # waiting for them is counted, and the call is reported once exhausted
+        iterator = iter(self._target.stream(*args, **kwargs))
+        seconds = 0.0
+        count = 0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    doc = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += time.perf_counter() - started
+                count += 1
+                yield doc
+        finally:
+            self._owner._report(self._collection, "query", seconds, reads=max(1, count))
+
+    def on_snapshot(self, callback):
+        def observed(docs, changes, read_time):
+            # A listener is billed for each document added, changed or removed
+            self._owner._report(self._collection, "listen", 0.0, reads=len(changes))
+            return callback(docs, changes, read_time)
+        return self._target.on_snapshot(observed)
+
+
+class _Collection(_Query):
+    def __init__(self, owner, target):
+        super().__init__(owner, target, target.id)
+
+    def document(self, *args, **kwargs):
+        return _Document(self._owner, self._target.document(*args, **kwargs))
+
+    def add(self, *args, **kwargs):
+        return self._owner._timed(self._collection, "add", lambda: self._target.add(*args, **kwargs), writes=1)
+
+
+class _Batch(_Wrapper):
+    def __init__(self, owner, target):
+        super().__init__(owner, target)
+        self._writes = {}
+
+    def _track(self, reference):
+        collection = reference.parent.id
+        self._writes[collection] = self._writes.get(collection, 0) + 1
+        return _unwrap(reference)
+
+    def set(self, reference, *args, **kwargs):
+        return self._target.set(self._track(reference), *args, **kwargs)
+
+    def update(self, reference, *args, **kwargs):
+        return self._target.update(self._track(reference), *args, **kwargs)
+
+    def create(self, reference, *args, **kwargs):
+        return self._target.create(self._track(reference), *args, **kwargs)
+
+    def delete(self, reference, *args, **kwargs):
+        return self._target.delete(self._track(reference), *args, **kwargs)
+
+    def commit(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._target.commit(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - started
+            for collection, writes in self._writes.items():
+                self._owner._report(collection, "commit", seconds, writes=writes)
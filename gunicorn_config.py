@@ -0,0 +1,129 @@
+"""
+Production gunicorn profile for Smallie
+
+    gunicorn --config gunicorn_config.py main:app
+
+The app and its templates are loaded once in the master and shared with the
+workers copy-on-write; the objects that exist at that point are moved out of
+the garbage collector's reach (gc.freeze) so collections in a worker do not
+touch, and so copy, the shared pages. Nothing in the master talks to
+Firestore: gRPC channels must not cross fork(), so each worker creates its
+Firebase client in post_fork, then serves warm-up requests to itself before
+it accepts traffic.
+
+Firestore calls are I/O-bound, and every open /api/stream/votes connection
+is held for the whole visit, so workers run greenlets: a stream then costs a
+greenlet rather than one of a handful of threads.
+
+  GUNICORN_WORKER_CLASS  gevent (default) or gthread; gthread is also used
+                         when gevent is not installed
+  WEB_CONCURRENCY        worker processes, default the number of CPUs + 1
+  GUNICORN_CONNECTIONS   concurrent connections per gevent worker, default
+                         1000, of which half may be streams
+                         (VOTE_STREAM_MAX_CLIENTS)
+  GUNICORN_THREADS       threads per gthread worker, default 16; each stream
+                         holds one, so at most a quarter of them serve streams
+  GUNICORN_PRELOAD       0 to import the app in each worker instead
+  WARMUP_PATHS           comma-separated paths requested by each new worker,
+                         default "/,/api/leaderboard"; empty to skip
+
+ELIMINATION_SCHEDULER=1 starts the scheduler in each worker after fork
+rather than in the master.
+"""
+
+import gc
+import os
+import time
+import multiprocessing
+
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gevent")
+_gevent_missing = False
+
+if worker_class == "gevent":
+    try:
+        from gevent import monkey
+    except ImportError:
+        worker_class = "gthread"
+        _gevent_missing = True
+    else:
+        # Patch before the app is preloaded, so its locks and threads are cooperative
+        monkey.patch_all()
+
+wsgi_app = "main:app"
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() + 1))
+threads = int(os.environ.get("GUNICORN_THREADS", "16"))
+worker_connections = int(os.environ.get("GUNICORN_CONNECTIONS", "1000"))
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+
+# Live vote streams hold a thread or connection for the whole visit; beyond
+# this many per worker, browsers fall back to polling
+if worker_class == "gevent":
+    os.environ.setdefault("VOTE_STREAM_MAX_CLIENTS", str(max(1, worker_connections // 2)))
+else:
+    os.environ.setdefault("VOTE_STREAM_MAX_CLIENTS", str(max(1, threads // 4)))
+
+WARMUP_PATHS = [path for path in os.environ.get("WARMUP_PATHS", "/,/api/leaderboard").split(",") if path]
+
+# The master only imports the app; Firebase and background threads start per worker
+os.environ["FIREBASE_WARMUP"] = "0"
+_elimination_scheduler = os.environ.pop("ELIMINATION_SCHEDULER", "") == "1"
+
+
+def on_starting(server):
+    if _gevent_missing:
+        server.log.warning(f"gevent is not installed; using gthread workers, which serve at most "
+                           f"{os.environ['VOTE_STREAM_MAX_CLIENTS']} vote streams each")
+
+
+def when_ready(server):
+    if not server.cfg.preload_app:
+        return
+    import firebase_client
+    from app import app
+
+    # Compile every template now, so workers inherit them instead of each compiling its own
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    if firebase_client.status()["initialized"]:
+        server.log.warning("Firebase was initialized in the master; workers will create their own clients")
+
+    gc.collect()
+    gc.freeze()
+    server.log.info(f"Preloaded app and templates; {gc.get_freeze_count()} objects shared with workers")
+
+
+def post_fork(server, worker):
+    if worker_class == "gevent":
+        try:
+            from grpc.experimental import gevent as grpc_gevent
+            grpc_gevent.init_gevent()
+        except ImportError:
+            server.log.warning("grpc has no gevent support; Firestore calls will block the worker")
+
+    import firebase_client
+    started = time.perf_counter()
+    firebase_client.reset()
+    if firebase_client.get_db() is not None:
+        server.log.info(f"Worker {worker.pid} created its Firebase client in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    if _elimination_scheduler:
+        from app import elimination_engine
+        elimination_engine.start_scheduler()
+
+
+def post_worker_init(worker):
+    # Fill the caches and start the listeners before the first real request
+    from werkzeug.test import Client
+    client = Client(worker.wsgi)
+    for path in WARMUP_PATHS:
+        started = time.perf_counter()
+        try:
+            response = client.get(path, headers={"User-Agent": "smallie-warmup"})
+            response.close()
+            worker.log.info(f"Worker {worker.pid} warmed up {path}: {response.status_code} in {(time.perf_counter() - started) * 1000:.0f} ms")
+        except Exception as e:
+            worker.log.warning(f"Worker {worker.pid} warm-up of {path} failed: {e}")
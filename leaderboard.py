@@ -0,0 +1,154 @@
+"""
+Server-maintained vote leaderboard for Smallie
+
+Keeps contestants ranked by votes in memory, updated from the contestant
+cache whenever vote totals change, and serves the top K through
+/api/leaderboard. Each ranking has a version derived from its content, so
+every worker holding the same data reports the same version and ETag. Idle
+clients revalidate with If-None-Match and get a 304, and clients that pass
+since=<version> receive only the entries that changed.
+"""
+
+import json
+import bisect
+import hashlib
+import threading
+from collections import OrderedDict
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 100
+
+# Number of past rankings kept for answering delta requests
+DEFAULT_HISTORY = 64
+
+
+def _sort_key(entry):
+    # Most votes first; ties broken by contestant id so the order is stable
+    contestant_id = entry["id"]
+    id_key = (0, int(contestant_id), "") if contestant_id.isdigit() else (1, 0, contestant_id)
+    return (-entry["votes"], id_key)
+
+
+def _entry(contestant):
+    return {
+        "id": str(contestant.get("id", "")),
+        "name": contestant.get("name", ""),
+        "votes": contestant.get("votes", 0) or 0,
+        "eliminated": bool(contestant.get("eliminated", False)),
+    }
+
+
+class Leaderboard:
+    """Incrementally maintained ranking of contestants by votes"""
+
+    def __init__(self, history=DEFAULT_HISTORY):
+        self.history = history
+
+        self._lock = threading.Lock()
+        self._by_id = {}
+        self._keys = []
+        self._entries = []
+        self._total_votes = 0
+        self.version = None
+        self._history = OrderedDict()
+        self._payloads = {}
+
+    def update(self, contestants):
+        """Apply the latest contestant list, repositioning only changed entries"""
+        latest = {}
+        for contestant in contestants:
+            entry = _entry(contestant)
+            latest[entry["id"]] = entry
+
+        with self._lock:
+            changed = False
+            for contestant_id in list(self._by_id):
+                if contestant_id not in latest:
+                    self._remove(self._by_id.pop(contestant_id))
+                    changed = True
+            for contestant_id, entry in latest.items():
+                current = self._by_id.get(contestant_id)
+                if current == entry:
+                    continue
+                if current is not None:
+                    self._remove(current)
+                self._insert(entry)
+                self._by_id[contestant_id] = entry
+                changed = True
+
+            if changed or self.version is None:
+                self._total_votes = sum(entry["votes"] for entry in self._entries)
+                self._publish()
+            return self.version
+
+    def etag(self, limit=DEFAULT_LIMIT, since=None):
+        """Return the strong ETag for a response, without building it"""
+        return f"{self.version}.{limit}.{self._delta_base(since) or 'full'}"
+
+    def payload(self, limit=DEFAULT_LIMIT, since=None):
+        """Return (etag, body) for the top `limit` entries
+
+        When `since` names a ranking still in the history only changed and
+        removed entries are included; otherwise the full top K is returned,
+        as for no `since` at all.
+        """
+        with self._lock:
+            since = self._delta_base(since)
+            cache_key = (limit, since)
+            etag = self.etag(limit, since)
+            body = self._payloads.get(cache_key)
+            if body is not None:
+                return etag, body
+
+            top = self._entries[:limit]
+            data = {"version": self.version, "totalVotes": self._total_votes}
+            previous = self._history.get(since)
+            if previous is None:
+                data["full"] = True
+                data["entries"] = [dict(entry, rank=rank) for rank, entry in enumerate(top, 1)]
+            else:
+                data["full"] = False
+                data["since"] = since
+                data["changed"] = [
+                    dict(entry, rank=rank) for rank, entry in enumerate(top, 1)
+                    if previous.get(entry["id"]) != (rank, entry["votes"], entry["eliminated"], entry["name"])
+                ]
+                top_ids = {entry["id"] for entry in top}
+                data["removed"] = [
+                    contestant_id for contestant_id, state in previous.items()
+                    if state[0] <= limit and contestant_id not in top_ids
+                ]
+            body = json.dumps(data, separators=(",", ":"))
+            self._payloads[cache_key] = body
+            return etag, body
+
+    def _delta_base(self, since):
+        # Any other value, which may be anything a client sent, is answered
+        # with the full ranking, so it never reaches an ETag or the cache
+        return since if since in self._history else None
+
+    def _insert(self, entry):
+        key = _sort_key(entry)
+        index = bisect.bisect_left(self._keys, key)
+        self._keys.insert(index, key)
+        self._entries.insert(index, entry)
+
+    def _remove(self, entry):
+        index = bisect.bisect_left(self._keys, _sort_key(entry))
+        del self._keys[index]
+        del self._entries[index]
+
+    def _publish(self):
+        state = {
+            entry["id"]: (rank, entry["votes"], entry["eliminated"], entry["name"])
+            for rank, entry in enumerate(self._entries, 1)
+        }
+        digest = hashlib.sha1(json.dumps(sorted(state.items())).encode("utf-8")).hexdigest()[:16]
+        if digest == self.version:
+            return
+        self.version = digest
+        self._history[digest] = state
+        self._history.move_to_end(digest)
+        while len(self._history) > self.history:
+            self._history.popitem(last=False)
+        self._payloads.clear()
@@ -0,0 +1,433 @@
+"""
+Prometheus metrics for Smallie, aggregated across gunicorn workers
+
+Each worker records counters, gauges and histograms in memory, which costs a
+dict update under a lock, and writes them to METRICS_DIR/metrics-<pid>.json
+every few seconds. /metrics, served by whichever worker takes the scrape,
+writes its own figures, then sums every worker's file into one exposition
+in the Prometheus text format. Figures from other workers can be up to
+METRICS_FLUSH_INTERVAL seconds old.
+
+Counters and histograms of workers that have exited are folded into
+metrics-archive.json so totals never go backwards; their gauges are
+dropped.
+
+FlaskMetrics adds per-route request histograms and the /metrics endpoint to
+an app.
+"""
+
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+
+DEFAULT_METRICS_DIR = os.environ.get("METRICS_DIR", "/tmp/smallie-metrics")
+DEFAULT_FLUSH_INTERVAL_SECONDS = float(os.environ.get("METRICS_FLUSH_INTERVAL", "5"))
+
+# Upper bounds in seconds, suited to requests and Firestore calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+ARCHIVE_FILE = "metrics-archive.json"
+
+
+def _key(name, labels):
+    return json.dumps([name, sorted(labels.items())], separators=(",", ":"))
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class _Metric:
+    def __init__(self, registry, name, documentation, labelnames):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _labels(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {', '.join(self.labelnames) or 'none'}")
+        return {name: str(value) for name, value in labels.items()}
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, value=1.0, **labels):
+        self.registry._add("counters", _key(self.name, self._labels(labels)), value)
+
+    def set_total(self, value, **labels):
+        """Set this worker's running total, for counts another object already keeps"""
+        self.registry._set("counters", _key(self.name, self._labels(labels)), value)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, registry, name, documentation, labelnames, aggregate="sum"):
+        super().__init__(registry, name, documentation, labelnames)
+        if aggregate not in ("sum", "max"):
+            raise ValueError("aggregate must be sum or max")
+        self.aggregate = aggregate
+
+    def set(self, value, **labels):
+        self.registry._set("gauges", _key(self.name, self._labels(labels)), value)
+
+    def inc(self, value=1.0, **labels):
+        self.registry._add("gauges", _key(self.name, self._labels(labels)), value)
+
+    def dec(self, value=1.0, **labels):
+        self.registry._add("gauges", _key(self.name, self._labels(labels)), -value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, documentation, labelnames, buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        self.registry._observe(_key(self.name, self._labels(labels)), self.buckets, value)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+
+class Registry:
+    """Metrics of this process, shared with the other workers through files"""
+
+    def __init__(self, directory=DEFAULT_METRICS_DIR, flush_interval=DEFAULT_FLUSH_INTERVAL_SECONDS):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._metrics = {}
+        self._ratios = []
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._values = None
+        self._pid = None
+        self._flusher = None
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), aggregate="sum"):
+        """A gauge summed over workers, or with aggregate="max" the highest worker's value"""
+        return self._register(Gauge(self, name, documentation, labelnames, aggregate))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def ratio(self, name, documentation, hits, misses):
+        """Export hits / (hits + misses) per label set, computed from the summed counters"""
+        self._ratios.append((name, documentation, hits, misses))
+
+    def add_collector(self, collect):
+        """Register a callable run before each write, to copy in figures kept elsewhere"""
+        self._collectors.append(collect)
+
+    def flush(self):
+        """Write this worker's figures to its file"""
+        for collect in self._collectors:
+            try:
+                collect()
+            except Exception as e:
+                logging.error(f"Error collecting metrics: {e}")
+        with self._lock:
+            values = self._process_values()
+            snapshot = {
+                "pid": os.getpid(),
+                "counters": dict(values["counters"]),
+                "gauges": dict(values["gauges"]),
+                "histograms": {key: list(value) for key, value in values["histograms"].items()},
+            }
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"metrics-{os.getpid()}.json")
+        temporary = path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(snapshot, f, separators=(",", ":"))
+        os.replace(temporary, path)
+
+    def collect(self):
+        """Return {"counters", "gauges", "histograms"} summed over every worker"""
+        self.flush()
+        self._archive_exited()
+        totals = {"counters": {}, "gauges": {}, "histograms": {}}
+        maxed = {name for name, metric in self._metrics.items() if getattr(metric, "aggregate", "sum") == "max"}
+        for name in sorted(os.listdir(self.directory)):
+            if not name.startswith("metrics-") or not name.endswith(".json"):
+                continue
+            snapshot = self._read(os.path.join(self.directory, name))
+            if snapshot is None:
+                continue
+            _merge_snapshot(totals, snapshot, gauges=name != ARCHIVE_FILE, maxed=maxed)
+        return totals
+
+    def render(self):
+        """Return the summed metrics in the Prometheus text exposition format"""
+        totals = self.collect()
+        by_name = {}
+        for kind in ("counters", "gauges", "histograms"):
+            for key, value in totals[kind].items():
+                name, labels = json.loads(key)
+                by_name.setdefault(name, []).append((tuple(map(tuple, labels)), value))
+
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for labels, value in sorted(by_name.get(name, [])):
+                if metric.kind != "histogram":
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float("inf"),), value):
+                    cumulative += count
+                    bucket_labels = labels + (("le", _format_value(bound)),)
+                    lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {_format_value(cumulative)}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value[-1])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {_format_value(cumulative)}")
+
+        for name, documentation, hits, misses in self._ratios:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            hit_counts = dict(by_name.get(hits.name, []))
+            miss_counts = dict(by_name.get(misses.name, []))
+            for labels in sorted(set(hit_counts) | set(miss_counts)):
+                lookups = hit_counts.get(labels, 0) + miss_counts.get(labels, 0)
+                ratio = hit_counts.get(labels, 0) / lookups if lookups else 0.0
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(ratio)}")
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def _process_values(self):
+        # Called with the lock held; a forked child starts from zero
+        if self._pid != os.getpid():
+            self._values = {"counters": {}, "gauges": {}, "histograms": {}}
+            self._pid = os.getpid()
+            self._flusher = None
+        return self._values
+
+    def _add(self, kind, key, value):
+        with self._lock:
+            values = self._process_values()[kind]
+            values[key] = values.get(key, 0.0) + value
+        self._ensure_flusher()
+
+    def _set(self, kind, key, value):
+        with self._lock:
+            self._process_values()[kind][key] = value
+        self._ensure_flusher()
+
+    def _observe(self, key, buckets, value):
+        with self._lock:
+            histograms = self._process_values()["histograms"]
+            # Per-bucket (not cumulative) counts, then the +Inf bucket and the sum
+            counts = histograms.get(key)
+            if counts is None:
+                counts = histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            index = 0
+            while index < len(buckets) and value > buckets[index]:
+                index += 1
+            counts[index] += 1
+            counts[-1] += value
+        self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is not None and self._flusher.is_alive():
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name="metrics-flusher", daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Error writing metrics: {e}")
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            logging.error(f"Ignoring unreadable metrics file {path}: {e}")
+            return None
+
+    def _archive_exited(self):
+        # Fold the files of exited workers into the archive, one worker at a time
+        with open(os.path.join(self.directory, ".lock"), "a") as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            archive_path = os.path.join(self.directory, ARCHIVE_FILE)
+            archive = None
+            for name in os.listdir(self.directory):
+                if not name.startswith("metrics-") or not name.endswith(".json") or name == ARCHIVE_FILE:
+                    continue
+                try:
+                    pid = int(name[len("metrics-"):-len(".json")])
+                except ValueError:
+                    continue
+                if _pid_alive(pid):
+                    continue
+                snapshot = self._read(os.path.join(self.directory, name))
+                if archive is None:
+                    archive = self._read(archive_path) or {"counters": {}, "gauges": {}, "histograms": {}}
+                if snapshot is not None:
+                    _merge_snapshot(archive, snapshot, gauges=False)
+                temporary = archive_path + ".tmp"
+                with open(temporary, "w") as f:
+                    json.dump(archive, f, separators=(",", ":"))
+                os.replace(temporary, archive_path)
+                os.unlink(os.path.join(self.directory, name))
+
+
+def _merge_snapshot(totals, snapshot, gauges=True, maxed=()):
+    for key, value in snapshot.get("counters", {}).items():
+        totals["counters"][key] = totals["counters"].get(key, 0.0) + value
+    if gauges:
+        for key, value in snapshot.get("gauges", {}).items():
+            if key in totals["gauges"] and maxed and json.loads(key)[0] in maxed:
+                totals["gauges"][key] = max(totals["gauges"][key], value)
+            else:
+                totals["gauges"][key] = totals["gauges"].get(key, 0.0) + value
+    for key, value in snapshot.get("histograms", {}).items():
+        current = totals["histograms"].get(key)
+        if current is None or len(current) != len(value):
+            totals["histograms"][key] = list(value)
+        else:
+            totals["histograms"][key] = [a + b for a, b in zip(current, value)]
+
+
+class FirestoreMetrics:
+    """Firestore call counts, latency and documents by collection and operation
+
+    observe() has the signature firebase_client.add_observer() expects.
+    """
+
+    def __init__(self, registry):
+        self.calls = registry.histogram(
+            "smallie_firestore_call_duration_seconds", "Firestore round trips, by collection and operation",
+            ["collection", "op"],
+        )
+        self.documents = registry.counter(
+            "smallie_firestore_documents_total", "Documents read and written, as billed",
+            ["collection", "kind"],
+        )
+
+    def observe(self, collection, op, seconds, reads, writes):
+        if op != "listen":
+            self.calls.observe(seconds, collection=collection, op=op)
+        if reads:
+            self.documents.inc(reads, collection=collection, kind="read")
+        if writes:
+            self.documents.inc(writes, collection=collection, kind="write")
+
+
+class FlaskMetrics:
+    """Per-route request metrics and a /metrics endpoint for a Flask app"""
+
+    def __init__(self, app, registry, path="/metrics"):
+        self.registry = registry
+        self.requests = registry.histogram(
+            "smallie_http_request_duration_seconds", "Time to produce a response, by route",
+            ["route", "method", "status"],
+        )
+        self.in_flight = registry.gauge(
+            "smallie_http_requests_in_flight", "Requests being handled, summed over workers",
+        )
+        self.queued = registry.histogram(
+            "smallie_http_request_queue_seconds",
+            "Time between the proxy's X-Request-Start and a worker picking the request up",
+        )
+        self.workers = registry.gauge("smallie_workers", "Worker processes that have reported metrics")
+        registry.add_collector(lambda: self.workers.set(1))
+
+        from flask import g, request, Response
+
+        @app.before_request
+        def start_timer():
+            g._metrics_started = time.perf_counter()
+            self.in_flight.inc()
+            self._observe_queue(request.headers.get("X-Request-Start"))
+
+        @app.teardown_request
+        def stop_timer(error=None):
+            started = g.pop("_metrics_started", None)
+            if started is None:
+                return
+            self.in_flight.dec()
+            rule = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            status = g.pop("_metrics_status", 500 if error is not None else 200)
+            self.requests.observe(time.perf_counter() - started, route=rule, method=request.method, status=status)
+
+        @app.after_request
+        def record_status(response):
+            g._metrics_status = response.status_code
+            return response
+
+        @app.route(path)
+        def metrics_endpoint():
+            return Response(self.registry.render(), mimetype="text/plain; version=0.0.4")
+
+    def _observe_queue(self, header):
+        # "t=<seconds>" from nginx, or milliseconds or microseconds since the epoch
+        if not header:
+            return
+        try:
+            value = float(header.strip().removeprefix("t="))
+        except ValueError:
+            return
+        if value > 1e14:
+            started = value / 1e6
+        elif value > 1e11:
+            started = value / 1e3
+        else:
+            started = value
+        waited = time.time() - started
+        if 0 <= waited < 3600:
+            self.queued.observe(waited)
@@ -0,0 +1,193 @@
+"""
+Rendered page cache for Smallie
+
+Caches fully rendered pages keyed by whatever their content depends on (for
+the homepage: competition day, contestant data version and template
+modification time). Each entry is compressed once when it is rendered, with
+gzip and, when the brotli package is installed, brotli, so serving a cached
+page is a dictionary lookup and picking the variant the client accepts.
+
+Every variant has a strong ETag derived from the page content, so workers
+that render the same page agree on it and revalidation with If-None-Match
+can be answered with 304 Not Modified.
+"""
+
+import os
+import gzip
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULT_MAX_ENTRIES = 8
+
+# Template modification times are checked at most this often
+TEMPLATE_CHECK_SECONDS = 1.0
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+# Encodings in order of preference when the client accepts several equally
+PREFERRED_ENCODINGS = ("br", "gzip", "identity")
+
+
+def parse_accept_encoding(header):
+    """Return {encoding: q} for an Accept-Encoding header value"""
+    accepted = {}
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+def choose_encoding(header, available):
+    """Pick the best encoding from `available` allowed by an Accept-Encoding header"""
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get("*")
+    best = None
+    for encoding in PREFERRED_ENCODINGS:
+        if encoding not in available:
+            continue
+        q = accepted.get(encoding, wildcard)
+        if q is None:
+            # identity is acceptable unless explicitly refused
+            q = 1.0 if encoding == "identity" else 0.0
+        if q > 0 and (best is None or q > best[0]):
+            best = (q, encoding)
+    return best[1] if best else "identity"
+
+
+class RenderedPage:
+    """A rendered page and its precompressed variants"""
+
+    def __init__(self, body, render_seconds=0.0):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        digest = hashlib.sha1(body).hexdigest()[:20]
+        self.render_seconds = render_seconds
+        self.variants = {"identity": (body, digest)}
+        self.variants["gzip"] = (gzip.compress(body, GZIP_LEVEL, mtime=0), f"{digest}-gz")
+        if brotli is not None:
+            self.variants["br"] = (brotli.compress(body, quality=BROTLI_QUALITY), f"{digest}-br")
+
+    def variant(self, accept_encoding):
+        """Return (encoding, body, etag) for an Accept-Encoding header value
+
+        The ETag is returned unquoted.
+        """
+        encoding = choose_encoding(accept_encoding, self.variants)
+        body, etag = self.variants[encoding]
+        return encoding, body, etag
+
+
+class RenderedPageCache:
+    """Bounded LRU of rendered pages with single-flight rendering"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._pages = OrderedDict()
+        self._rendering = {}
+        self._template_mtimes = {}
+
+        # Counters exposed through stats()
+        self.hits = 0
+        self.misses = 0
+        self.renders = 0
+        self.render_seconds = 0.0
+
+    def get(self, key, render):
+        """Return the RenderedPage for `key`, calling render() to build it if needed
+
+        Concurrent requests for a key that is being rendered wait for that
+        render instead of starting their own.
+        """
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+                self.hits += 1
+                return page
+            self.misses += 1
+            event = self._rendering.get(key)
+            owner = event is None
+            if owner:
+                event = self._rendering[key] = threading.Event()
+
+        if not owner:
+            event.wait()
+            with self._lock:
+                page = self._pages.get(key)
+            if page is not None:
+                return page
+            # The render we waited for failed; render for this request instead
+            return self._render(key, render)
+
+        try:
+            return self._render(key, render)
+        finally:
+            with self._lock:
+                self._rendering.pop(key, None)
+            event.set()
+
+    def template_version(self, path):
+        """Return the modification time of a template file, checked at most once a second"""
+        now = time.monotonic()
+        cached = self._template_mtimes.get(path)
+        if cached is not None and now - cached[0] < TEMPLATE_CHECK_SECONDS:
+            return cached[1]
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = 0
+        self._template_mtimes[path] = (now, mtime)
+        return mtime
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+                "renders": self.renders,
+                "render_seconds": self.render_seconds,
+                "entries": len(self._pages),
+                "brotli": brotli is not None,
+            }
+
+    def _render(self, key, render):
+        started = time.perf_counter()
+        body = render()
+        elapsed = time.perf_counter() - started
+        page = RenderedPage(body, render_seconds=elapsed)
+        with self._lock:
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+            self.renders += 1
+            self.render_seconds += elapsed
+        logging.debug(f"Rendered page {key} in {elapsed * 1000:.1f} ms")
+        return page
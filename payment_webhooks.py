@@ -0,0 +1,361 @@
+"""
+Idempotent payment webhooks for Smallie
+
+Payment providers confirm payments to /api/webhooks/<provider>. A webhook is
+checked against the provider's signature, reduced to a vote, and handed to
+the vote ingestor's write-ahead log, so the response goes out after a local
+append and never waits on Firestore.
+
+Providers retry deliveries, so every payment carries an idempotency key,
+"<provider>:<transactionId>". Each worker remembers recent keys in an LRU
+and drops repeats before they are logged. Keys that get past it (another
+worker, a restart) are stopped at commit time: PaymentIdempotency, an ingestion hook, drops votes whose
+key already has a payment_events document and creates that document in the
+same batch as the vote, so a payment is counted once whichever delivery
+commits first.
+
+The browser also tells /api/votes about a payment once it completes, but
+that report is unsigned and its vote count comes from the client, so it
+never credits votes or claims the idempotency key. It is only kept in
+payment_reports under the key's document id, for support to compare with
+payment_events: a report without a payment_events document is a payment
+the provider has not confirmed (yet).
+
+Flutterwave signs with the secret hash configured in its dashboard
+(FLUTTERWAVE_SECRET_HASH), sent as verif-hash or as an HMAC-SHA256 of the
+body in flutterwave-signature. Solana confirmations come from a relay that
+watches the receiving wallet and signs the body with SOLANA_WEBHOOK_SECRET
+(hex HMAC-SHA256 in x-smallie-signature), sending
+{"signature", "status", "contestantId", "voteCount", "email", "lamports"},
+where lamports is the amount the transfer moved into the wallet.
+
+The contestant and vote count ride along in data the browser filled in, so
+they are only believed when the verified amount pays for exactly that many
+votes: a Flutterwave charge's data.amount in NGN, or a Solana transfer's
+lamports. Any other amount rejects the delivery, and the log says why.
+"""
+
+import os
+import hmac
+import math
+import json
+import base64
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from firebase_admin import firestore
+
+from vote_ingest import parse_vote
+
+IDEMPOTENCY_COLLECTION = "payment_events"
+REPORTS_COLLECTION = "payment_reports"
+
+DEFAULT_LRU_SIZE = int(os.environ.get("PAYMENT_WEBHOOK_LRU_SIZE", "10000"))
+
+# Solana confirmation levels at which a transfer is treated as paid
+SOLANA_PAID_STATUSES = {"confirmed", "finalized"}
+
+# Price of one vote in what each provider settles in, as charged by the
+# payment modal: VOTE_PRICE_USD at 480 NGN to the dollar, sent over Solana
+# as one SOL per 1000 NGN
+VOTE_PRICE_NGN = float(os.environ.get("VOTE_PRICE_NGN", "240"))
+VOTE_PRICE_LAMPORTS = int(os.environ.get("VOTE_PRICE_LAMPORTS", "240000000"))
+
+
+class WebhookError(Exception):
+    """Raised for webhooks that are rejected; carries the HTTP status to return"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def idempotency_key(provider, transaction_id):
+    """Return the key identifying one payment across every delivery of it"""
+    return f"{provider}:{transaction_id}"
+
+
+def _document_id(key):
+    # Document ids cannot contain "/"; transaction ids never need to
+    return key.replace("/", "_")
+
+
+def verify_flutterwave(body, headers, secret_hash):
+    signature = headers.get("flutterwave-signature")
+    if signature:
+        expected = base64.b64encode(hmac.new(secret_hash.encode("utf-8"), body, hashlib.sha256).digest()).decode("ascii")
+        return hmac.compare_digest(signature, expected)
+    return hmac.compare_digest(headers.get("verif-hash", ""), secret_hash)
+
+
+def verify_solana(body, headers, secret):
+    expected = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(headers.get("x-smallie-signature", ""), expected)
+
+
+def paid_vote_count(amount, claimed, price):
+    """Return the claimed vote count once the verified amount is shown to pay for it
+
+    Raises WebhookError when the amount is missing or pays for any other
+    number of votes.
+    """
+    try:
+        amount = float(amount)
+    except (TypeError, ValueError):
+        raise WebhookError("Payment amount is missing")
+    try:
+        claimed = int(claimed)
+    except (TypeError, ValueError):
+        raise WebhookError("voteCount must be an integer")
+    if not math.isclose(amount, claimed * price, rel_tol=1e-9):
+        raise WebhookError(f"Paid {amount:g} for {claimed} votes priced at {price:g}")
+    return claimed
+
+
+def parse_flutterwave(payload):
+    """Return the vote for a successful Flutterwave charge, or None to ignore the event"""
+    if payload.get("event") != "charge.completed":
+        return None
+    data = payload.get("data") or {}
+    if data.get("status") != "successful" or data.get("id") is None:
+        return None
+    if data.get("currency") != "NGN":
+        raise WebhookError(f"Unexpected currency {data.get('currency')}")
+    meta = data.get("meta") or payload.get("meta_data") or {}
+    return {
+        "contestantId": meta.get("contestantId"),
+        "count": paid_vote_count(data.get("amount"), meta.get("voteCount"), VOTE_PRICE_NGN),
+        "email": (data.get("customer") or {}).get("email", ""),
+        "paymentMethod": "flutterwave",
+        "transactionId": str(data["id"]),
+    }
+
+
+def parse_solana(payload):
+    """Return the vote for a confirmed Solana transfer, or None to ignore the event"""
+    if payload.get("status") not in SOLANA_PAID_STATUSES or not payload.get("signature"):
+        return None
+    return {
+        "contestantId": payload.get("contestantId"),
+        "count": paid_vote_count(payload.get("lamports"), payload.get("voteCount"), VOTE_PRICE_LAMPORTS),
+        "email": payload.get("email", ""),
+        "paymentMethod": "solana",
+        "transactionId": str(payload["signature"]),
+    }
+
+
+PROVIDERS = {
+    "flutterwave": ("FLUTTERWAVE_SECRET_HASH", verify_flutterwave, parse_flutterwave),
+    "solana": ("SOLANA_WEBHOOK_SECRET", verify_solana, parse_solana),
+}
+
+
+class RecentKeys:
+    """Thread-safe LRU set of recently seen idempotency keys"""
+
+    def __init__(self, size=DEFAULT_LRU_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._keys = OrderedDict()
+
+    def add(self, key):
+        """Remember a key, returning False if it was already present"""
+        with self._lock:
+            if key in self._keys:
+                self._keys.move_to_end(key)
+                return False
+            self._keys[key] = True
+            while len(self._keys) > self.size:
+                self._keys.popitem(last=False)
+            return True
+
+    def discard(self, key):
+        with self._lock:
+            self._keys.pop(key, None)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class PaymentWebhooks:
+    """Verifies payment webhooks and queues each payment's votes once"""
+
+    def __init__(self, ingestor, recent=None, secrets=None, get_db=None, reports_collection=REPORTS_COLLECTION):
+        self.ingestor = ingestor
+        self._get_db = get_db
+        self.reports_collection = reports_collection
+        self.recent = recent if recent is not None else RecentKeys()
+        # Secrets default to the environment, read per request so rotating
+        # them does not need a restart
+        self._secrets = secrets
+
+        self._lock = threading.Lock()
+        # Counters exposed through stats()
+        self.accepted = 0
+        self.duplicates = 0
+        self.ignored = 0
+        self.rejected = 0
+        self.reported = 0
+
+    @property
+    def db(self):
+        """This process's Firestore client, or None while it is unavailable"""
+        return self._get_db() if self._get_db is not None else None
+
+    def receive(self, provider, body, headers):
+        """Handle one delivery and return (status, response dict)"""
+        try:
+            vote = self._verify_and_parse(provider, body, headers)
+        except WebhookError as e:
+            self._count("rejected")
+            logging.warning(f"Rejected {provider} webhook: {e}")
+            return e.status, {"error": str(e)}
+        if vote is None:
+            self._count("ignored")
+            return 200, {"status": "ignored"}
+        return self.submit(vote)
+
+    def submit(self, vote):
+        """Queue a paid vote unless its payment was seen recently; returns (status, response)"""
+        key = idempotency_key(vote.get("paymentMethod"), vote.get("transactionId"))
+        if not self.recent.add(key):
+            self._count("duplicates")
+            return 200, {"status": "duplicate"}
+        try:
+            queued = self.ingestor.submit(vote, idempotency_key=key)
+        except ValueError as e:
+            # A corrected delivery of the same payment must not look like a repeat
+            self.recent.discard(key)
+            self._count("rejected")
+            logging.warning(f"Rejected payment {key}: {e}")
+            return 400, {"error": str(e)}
+        except Exception:
+            self.recent.discard(key)
+            raise
+        self._count("accepted")
+        return 200, {"status": "accepted", "voteId": queued["id"]}
+
+    def report(self, data):
+        """Record a payment the browser says it made; its votes wait for the provider's webhook
+
+        Returns (status, response). Raises ValueError for an invalid report.
+        """
+        vote = parse_vote(data)
+        if not vote["paymentMethod"] or not vote["transactionId"]:
+            raise ValueError("paymentMethod and transactionId are required")
+        if vote["paymentMethod"] not in PROVIDERS:
+            raise ValueError("Unknown payment provider")
+        key = idempotency_key(vote["paymentMethod"], vote["transactionId"])
+        self.db.collection(self.reports_collection).document(_document_id(key)).set({
+            "provider": vote["paymentMethod"],
+            "transactionId": vote["transactionId"],
+            "contestantId": vote["contestantId"],
+            "count": vote["count"],
+            "email": vote["email"],
+            "reportedAt": firestore.SERVER_TIMESTAMP,
+        })
+        self._count("reported")
+        return 202, {"status": "pending"}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "accepted": self.accepted,
+                "duplicates": self.duplicates,
+                "ignored": self.ignored,
+                "rejected": self.rejected,
+                "reported": self.reported,
+                "recent_keys": len(self.recent),
+            }
+
+    def _secret(self, name):
+        if self._secrets is not None:
+            return self._secrets.get(name)
+        return os.environ.get(name)
+
+    def _verify_and_parse(self, provider, body, headers):
+        if provider not in PROVIDERS:
+            raise WebhookError("Unknown payment provider", status=404)
+        secret_name, verify, parse = PROVIDERS[provider]
+        secret = self._secret(secret_name)
+        if not secret:
+            raise WebhookError(f"{secret_name} is not configured", status=503)
+        if not verify(body, headers, secret):
+            raise WebhookError("Invalid signature", status=401)
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            raise WebhookError("Body must be JSON")
+        if not isinstance(payload, dict):
+            raise WebhookError("Body must be a JSON object")
+        return parse(payload)
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+class PaymentIdempotency:
+    """Vote ingestion hook that writes each payment's votes at most once"""
+
+    def __init__(self, get_db, collection=IDEMPOTENCY_COLLECTION, recent=None):
+        self._get_db = get_db
+        self.collection = collection
+        self.recent = recent
+
+    @property
+    def db(self):
+        """This process's Firestore client, or None while it is unavailable"""
+        return self._get_db()
+
+    def filter_batch(self, votes):
+        keyed = [vote for vote in votes if vote.get("idempotencyKey")]
+        if not keyed:
+            return votes
+
+        # One read for the whole batch rather than one per payment
+        refs = {vote["idempotencyKey"]: self._ref(vote["idempotencyKey"]) for vote in keyed}
+        existing = {doc.id for doc in self.db.get_all(list(refs.values())) if doc.exists}
+
+        kept = []
+        seen = set()
+        for vote in votes:
+            key = vote.get("idempotencyKey")
+            if key:
+                if _document_id(key) in existing or key in seen:
+                    logging.info(f"Dropping replayed payment {key}")
+                    continue
+                seen.add(key)
+            kept.append(vote)
+        return kept
+
+    def batch_keys(self, vote):
+        key = vote.get("idempotencyKey")
+        return {(self.collection, _document_id(key))} if key else set()
+
+    def extend_batch(self, batch, votes):
+        for vote in votes:
+            key = vote.get("idempotencyKey")
+            if not key:
+                continue
+            # create() fails the whole batch if another worker committed this
+            # payment first; the retry then filters it out
+            batch.create(self._ref(key), {
+                "provider": vote["paymentMethod"],
+                "transactionId": vote["transactionId"],
+                "voteId": vote["id"],
+                "contestantId": vote["contestantId"],
+                "count": vote["count"],
+            })
+
+    def on_commit(self, votes):
+        if self.recent is None:
+            return
+        for vote in votes:
+            if vote.get("idempotencyKey"):
+                self.recent.add(vote["idempotencyKey"])
+
+    def _ref(self, key):
+        return self.db.collection(self.collection).document(_document_id(key))
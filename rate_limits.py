@@ -0,0 +1,293 @@
+"""
+Shared rate limiting and burst detection for Smallie votes
+
+State lives in small memory-mapped tables in a file shared by every gunicorn
+worker on the machine, so spreading requests over workers does not multiply
+the allowance. A table is a fixed array of slots found by hashing the key,
+guarded by an fcntl lock across processes and a threading lock within one.
+A vote check takes the lock once for all of its keys, so it costs a pair of
+lock syscalls plus a few hashes and struct reads and writes: microseconds.
+
+Two kinds of table are kept:
+
+  token buckets      votes per IP, per email and per contestant, each
+                     submission taking one token per vote; a request is
+                     refused with 429 when any of its buckets is short, and
+                     the buckets already charged get their tokens back
+  sliding windows    votes per contestant and per IP over the last
+                     minute, estimated from the current and previous fixed
+                     windows; crossing a threshold flags a burst before the
+                     votes reach Firestore
+
+Slots are reused when their home region is full, evicting the slot updated
+longest ago. An evicted bucket has usually refilled anyway, so eviction can
+only make a limit more lenient, never wrongly refuse a request.
+"""
+
+import os
+import mmap
+import time
+import fcntl
+import struct
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+DEFAULT_PATH = os.environ.get("RATE_LIMIT_FILE", "/tmp/smallie-rate-limits.bin")
+DEFAULT_SLOTS = int(os.environ.get("RATE_LIMIT_SLOTS", "65536"))
+
+# Slots probed for a key; a key only ever lives in its home region
+REGION_SLOTS = 64
+
+# key hash, then three floats whose meaning depends on the table
+_SLOT = struct.Struct("<Qddd")
+_HEADER = struct.Struct("<8sQ")
+_MAGIC = b"SMLRATE1"
+
+
+def _key_hash(key):
+    # Zero marks an empty slot, so it is never produced
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little") or 1
+
+
+def _env_rate(name, default):
+    # "capacity/seconds", e.g. "20/60" allows bursts of 20 refilled over a minute
+    capacity, _, seconds = os.environ.get(name, default).partition("/")
+    return float(capacity), float(seconds or 1)
+
+
+class SharedTable:
+    """Fixed-size hash table of float triples in a shared memory-mapped file"""
+
+    def __init__(self, path, slots=DEFAULT_SLOTS):
+        self.path = path
+        self.slots = max(REGION_SLOTS, slots - slots % REGION_SLOTS)
+        self.size = _HEADER.size + self.slots * _SLOT.size
+        self._pid = None
+        self._fd = None
+        self._map = None
+        self._lock = None
+        self._depth = 0
+
+    @contextmanager
+    def locked(self):
+        """Hold the table exclusively, across processes; nested uses lock once"""
+        self._ensure_open()
+        with self._lock:
+            self._depth += 1
+            if self._depth == 1:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                yield self
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def update(self, key, fn, now):
+        """Apply fn(values or None, now) -> (values, result) to a key's slot
+
+        values is a tuple of three floats. Returns result. The caller must
+        hold locked().
+        """
+        key_hash = _key_hash(key)
+        offset = self._find(key_hash)
+        stored_hash, a, b, c = _SLOT.unpack_from(self._map, offset)
+        values, result = fn((a, b, c) if stored_hash == key_hash else None, now)
+        _SLOT.pack_into(self._map, offset, key_hash, *values)
+        return result
+
+    def _find(self, key_hash):
+        # Offset of the key's slot, else of an empty or the stalest slot in its region
+        first = _HEADER.size + key_hash % (self.slots // REGION_SLOTS) * REGION_SLOTS * _SLOT.size
+        start = key_hash % REGION_SLOTS
+        oldest, oldest_time = None, None
+        for probe in range(REGION_SLOTS):
+            offset = first + (start + probe) % REGION_SLOTS * _SLOT.size
+            stored_hash, _, updated, _ = _SLOT.unpack_from(self._map, offset)
+            if stored_hash == key_hash or stored_hash == 0:
+                return offset
+            # The second value is always the last update time
+            if oldest is None or updated < oldest_time:
+                oldest, oldest_time = offset, updated
+        return oldest
+
+    def _ensure_open(self):
+        if self._pid == os.getpid():
+            return
+        # fcntl locks are per process; a forked child opens its own mapping
+        self._lock = threading.RLock()
+        self._depth = 0
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size != self.size or not self._valid_header():
+                # A new file, or one laid out differently: start empty
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, self.size)
+                os.pwrite(self._fd, _HEADER.pack(_MAGIC, self.slots), 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, self.size)
+        self._pid = os.getpid()
+
+    def _valid_header(self):
+        header = os.pread(self._fd, _HEADER.size, 0)
+        return len(header) == _HEADER.size and _HEADER.unpack(header) == (_MAGIC, self.slots)
+
+
+class TokenBucket:
+    """Token bucket limiter over a SharedTable: capacity tokens refilled over period seconds"""
+
+    def __init__(self, table, prefix, capacity, period):
+        self.table = table
+        self.prefix = prefix
+        self.capacity = capacity
+        self.rate = capacity / period
+
+    def take(self, key, cost=1.0, now=None):
+        """Take cost tokens for a key; returns 0.0 if allowed, else seconds until it would be"""
+        capacity, rate = self.capacity, self.rate
+
+        def apply(values, now):
+            tokens = capacity if values is None else min(capacity, values[0] + max(0.0, now - values[1]) * rate)
+            if tokens >= cost:
+                return (tokens - cost, now, 0.0), 0.0
+            return (tokens, now, 0.0), (cost - tokens) / rate
+
+        with self.table.locked():
+            return self.table.update(f"{self.prefix}:{key}", apply, time.time() if now is None else now)
+
+    def refund(self, key, cost=1.0, now=None):
+        """Give back tokens taken for a request that was refused elsewhere"""
+        capacity, rate = self.capacity, self.rate
+
+        def apply(values, now):
+            tokens = capacity if values is None else values[0] + max(0.0, now - values[1]) * rate
+            return (min(capacity, tokens + cost), now, 0.0), None
+
+        with self.table.locked():
+            self.table.update(f"{self.prefix}:{key}", apply, time.time() if now is None else now)
+
+
+class SlidingWindow:
+    """Approximate count of events for a key over the last `window` seconds"""
+
+    def __init__(self, table, prefix, window):
+        self.table = table
+        self.prefix = prefix
+        self.window = window
+
+    def add(self, key, count=1.0, now=None):
+        """Record events and return the estimated count over the last window"""
+        window = self.window
+
+        def apply(values, now):
+            window_start = now - now % window
+            if values is None or values[1] < window_start - window:
+                current, previous = 0.0, 0.0
+            elif values[1] < window_start:
+                current, previous = 0.0, values[0]
+            else:
+                current, previous = values[0], values[2]
+            current += count
+            # Weight the previous window by how much of it is still in range
+            estimate = current + previous * (1 - (now - window_start) / window)
+            return (current, now, previous), estimate
+
+        with self.table.locked():
+            return self.table.update(f"{self.prefix}:{key}", apply, time.time() if now is None else now)
+
+
+class VoteGuard:
+    """Rate limits and burst detection for vote submissions"""
+
+    def __init__(self, path=DEFAULT_PATH, slots=DEFAULT_SLOTS):
+        self.table = SharedTable(path, slots)
+        self.limits = {
+            "ip": TokenBucket(self.table, "ip", *_env_rate("VOTE_LIMIT_PER_IP", "30/60")),
+            "email": TokenBucket(self.table, "email", *_env_rate("VOTE_LIMIT_PER_EMAIL", "10/60")),
+            "contestant": TokenBucket(self.table, "contestant", *_env_rate("VOTE_LIMIT_PER_CONTESTANT", "600/60")),
+        }
+        # A submission of more votes than the smallest bucket holds could never be allowed
+        self.max_count = int(min(bucket.capacity for bucket in self.limits.values()))
+        window = float(os.environ.get("VOTE_BURST_WINDOW", "60"))
+        self.windows = {
+            "ip": SlidingWindow(self.table, "burst-ip", window),
+            "contestant": SlidingWindow(self.table, "burst-contestant", window),
+        }
+        self.thresholds = {
+            "ip": float(os.environ.get("VOTE_BURST_PER_IP", "60")),
+            "contestant": float(os.environ.get("VOTE_BURST_PER_CONTESTANT", "300")),
+        }
+
+        self._lock = threading.Lock()
+        self._flagged = {}
+        # Counters exposed through stats()
+        self.allowed = 0
+        self.limited = 0
+        self.bursts = 0
+
+    def check(self, ip, email, contestant_id, count=1, now=None):
+        """Charge a submission of `count` votes to its keys; returns 0.0 if allowed, else Retry-After seconds
+
+        Raises ValueError when count is more than the limits ever allow at once.
+        """
+        if count > self.max_count:
+            raise ValueError(f"count must be at most {self.max_count}")
+        now = time.time() if now is None else now
+        keys = {"ip": ip, "email": (email or "").strip().lower(), "contestant": contestant_id}
+
+        bursts = []
+        retry_after = 0.0
+        with self.table.locked():
+            for kind, window in self.windows.items():
+                if keys[kind]:
+                    estimate = window.add(keys[kind], count=count, now=now)
+                    if estimate > self.thresholds[kind]:
+                        bursts.append((kind, estimate))
+            charged = []
+            for kind, bucket in self.limits.items():
+                if keys[kind]:
+                    retry_after = bucket.take(keys[kind], cost=count, now=now)
+                    if retry_after:
+                        # Refused, so nothing is charged for this submission
+                        for earlier in charged:
+                            self.limits[earlier].refund(keys[earlier], cost=count, now=now)
+                        break
+                    charged.append(kind)
+
+        for kind, estimate in bursts:
+            self._flag(kind, keys[kind], estimate, now)
+        with self._lock:
+            if retry_after:
+                self.limited += 1
+            else:
+                self.allowed += 1
+        return retry_after
+
+    def stats(self):
+        with self._lock:
+            return {
+                "allowed": self.allowed,
+                "limited": self.limited,
+                "bursts": self.bursts,
+                "flagged": sorted(self._flagged),
+            }
+
+    def _flag(self, kind, key, estimate, now):
+        # Logged once per key and window in this worker
+        flag = f"{kind}:{key}"
+        window = self.windows[kind].window
+        with self._lock:
+            if now - self._flagged.get(flag, 0.0) < window:
+                return
+            self._flagged[flag] = now
+            for stale in [name for name, at in self._flagged.items() if now - at >= window]:
+                del self._flagged[stale]
+            self.bursts += 1
+        logging.warning(f"Vote burst from {kind} {key}: about {estimate:.0f} votes in {window:.0f}s")
@@ -0,0 +1,582 @@
+#!/usr/bin/env python3
+"""
+Storage repositories for Smallie
+
+Contestants, tasks, votes, payments and signups are read and written through
+a repository, so a collection can move off Firestore without touching the
+code that uses it. Two implementations share one interface:
+
+  FirestoreRepository   the Firestore collections the app has always used
+  SqlRepository         SQLAlchemy tables, normally in PostgreSQL
+
+The vote ingestor writes each batch through a repository's write_votes(),
+its vote ledger. The Firestore ledger adds the votes and payments documents
+to the ingestor's write batch, as before. With VOTE_LEDGER=postgres they go
+to PostgreSQL instead, in one transaction per batch: a bulk insert of the
+votes and payments, skipping ids already present, and one atomic UPDATE
+contestants SET votes = votes + n per contestant for the votes inserted. The
+Firestore batch then only carries the shard increments and hook writes,
+whatever the number of votes, and is committed inside that transaction, so
+the two either both hold a batch's votes or the transaction is rolled back.
+Everything else, including the contestant documents the site renders, stays
+on Firestore.
+
+Readers of the ledger go through the same repository: the elimination
+replay uses iter_votes(). Tools that only know how to walk the Firestore
+collections (the admin listings and exports of votes and payments, the
+rollup backfill and the reconciler) call require_firestore_ledger() first
+and refuse to run against an empty votes collection while VOTE_LEDGER
+keeps the votes elsewhere.
+
+Usage:
+    DATABASE_URL=postgresql://... python repositories.py create-tables
+"""
+
+import os
+import sys
+import logging
+import argparse
+import datetime
+import threading
+
+from firebase_admin import firestore
+
+from vote_ingest import VOTE_PRICE_USD
+
+DEFAULT_DATABASE_URL = os.environ.get("DATABASE_URL", "")
+
+# Collections the vote ledger holds
+LEDGER_COLLECTIONS = ("votes", "payments")
+
+# Connections each worker keeps open, and extra ones it may open under load
+DEFAULT_POOL_SIZE = int(os.environ.get("DATABASE_POOL_SIZE", "5"))
+DEFAULT_MAX_OVERFLOW = int(os.environ.get("DATABASE_MAX_OVERFLOW", "10"))
+
+# Rows per INSERT statement in bulk writes
+INSERT_CHUNK_ROWS = 1000
+
+
+def _timestamp(vote):
+    return datetime.datetime.fromtimestamp(vote["received_at"], datetime.timezone.utc)
+
+
+def vote_record(vote):
+    """Return the stored fields of a vote from the ingestor's queue"""
+    return {
+        "contestantId": vote["contestantId"],
+        "count": vote["count"],
+        "email": vote["email"],
+        "day": vote["day"],
+        "timestamp": _timestamp(vote),
+        "paymentMethod": vote["paymentMethod"],
+        "transactionId": vote["transactionId"],
+    }
+
+
+def payment_record(vote):
+    """Return the stored fields of the payment behind a paid vote"""
+    return {
+        "contestantId": vote["contestantId"],
+        "voteCount": vote["count"],
+        "amount": vote["count"] * VOTE_PRICE_USD,
+        "email": vote["email"],
+        "method": vote["paymentMethod"],
+        "transactionId": vote["transactionId"],
+        "day": vote["day"],
+        "timestamp": _timestamp(vote),
+        "status": "completed",
+    }
+
+
+class FirestoreRepository:
+    """Repository over the Firestore collections"""
+
+    def __init__(self, get_db):
+        self._get_db = get_db
+
+    @property
+    def db(self):
+        """This process's Firestore client, or None while it is unavailable"""
+        return self._get_db()
+
+    # Contestants
+
+    def list_contestants(self):
+        return [dict(doc.to_dict() or {}, id=doc.id) for doc in self.db.collection("contestants").stream()]
+
+    def get_contestant(self, contestant_id):
+        doc = self.db.collection("contestants").document(str(contestant_id)).get()
+        return dict(doc.to_dict() or {}, id=doc.id) if doc.exists else None
+
+    def save_contestant(self, contestant):
+        data = {key: value for key, value in contestant.items() if key != "id"}
+        self.db.collection("contestants").document(str(contestant["id"])).set(data)
+
+    def add_votes(self, increments):
+        """Atomically add {contestant_id: votes} to the contestants' totals"""
+        batch = self.db.batch()
+        for contestant_id, count in increments.items():
+            batch.update(self.db.collection("contestants").document(str(contestant_id)),
+                         {"votes": firestore.Increment(count)})
+        batch.commit()
+
+    # Tasks
+
+    def list_tasks(self):
+        tasks = [doc.to_dict() or {} for doc in self.db.collection("tasks").stream()]
+        return sorted(tasks, key=lambda task: task.get("day") or 0)
+
+    def save_task(self, task):
+        self.db.collection("tasks").document(f"day_{task['day']}").set(task)
+
+    # Signups
+
+    def add_signup(self, signup):
+        _, ref = self.db.collection("signups").add(signup)
+        return ref.id
+
+    def list_signups(self, status=None, limit=50):
+        query = self.db.collection("signups")
+        if status:
+            query = query.where("status", "==", status)
+        return [dict(doc.to_dict() or {}, id=doc.id) for doc in query.limit(limit).stream()]
+
+    # Votes and payments
+
+    def batch_operations(self, vote):
+        """Firestore batch operations write_votes() adds for one vote"""
+        return 2 if vote.get("paymentMethod") else 1
+
+    def write_votes(self, votes, batch=None, vote_fields=None, then=None):
+        """Write votes and their payments, in the given batch if there is one
+
+        then(added), when given, is called with {contestant_id: votes} once
+        they are in the batch and commits it; without a batch or then() they
+        are committed straight away. Returns {contestant_id: votes} added.
+        """
+        own_batch = batch is None
+        if own_batch:
+            batch = self.db.batch()
+        added = {}
+        for vote in votes:
+            # committedAt is the server's commit time, which the reconciler walks the ledger by
+            record = {**vote_record(vote), "committedAt": firestore.SERVER_TIMESTAMP, **(vote_fields or {})}
+            batch.set(self.db.collection("votes").document(vote["id"]), record)
+            if vote["paymentMethod"]:
+                batch.set(self.db.collection("payments").document(vote["id"]), payment_record(vote))
+            added[vote["contestantId"]] = added.get(vote["contestantId"], 0) + vote["count"]
+        if then is not None:
+            then(added)
+        elif own_batch and votes:
+            batch.commit()
+        return added
+
+    def ensure_votes(self, votes):
+        """Store votes whose Firestore batch has committed: they were written in it"""
+
+    def iter_votes(self, day=None):
+        query = self.db.collection("votes")
+        if day is not None:
+            query = query.where("day", "==", day)
+        for doc in query.stream():
+            yield dict(doc.to_dict() or {}, id=doc.id)
+
+    def iter_payments(self, day=None):
+        query = self.db.collection("payments")
+        if day is not None:
+            query = query.where("day", "==", day)
+        for doc in query.stream():
+            yield dict(doc.to_dict() or {}, id=doc.id)
+
+
+class SqlRepository:
+    """Repository over SQLAlchemy tables, with a pooled engine per process"""
+
+    def __init__(self, url=DEFAULT_DATABASE_URL, pool_size=DEFAULT_POOL_SIZE, max_overflow=DEFAULT_MAX_OVERFLOW):
+        if not url:
+            raise ValueError("A database URL is required; set DATABASE_URL")
+        # Heroku-style URLs name the dialect "postgres", which SQLAlchemy rejects
+        if url.startswith("postgres://"):
+            url = "postgresql://" + url[len("postgres://"):]
+        self.url = url
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.tables = _tables()
+
+        self._lock = threading.Lock()
+        self._engine = None
+        self._pid = None
+
+    @property
+    def engine(self):
+        """This process's engine; pooled connections are never shared across fork()"""
+        if self._pid == os.getpid() and self._engine is not None:
+            return self._engine
+        with self._lock:
+            if self._engine is None:
+                from sqlalchemy import create_engine
+                options = {"pool_pre_ping": True, "future": True}
+                if not self.url.startswith("sqlite"):
+                    options.update(pool_size=self.pool_size, max_overflow=self.max_overflow, pool_recycle=1800)
+                self._engine = create_engine(self.url, **options)
+            elif self._pid != os.getpid():
+                # Drop the parent's connections without closing them under it
+                self._engine.dispose(close=False)
+            self._pid = os.getpid()
+            return self._engine
+
+    def create_tables(self):
+        self.tables["metadata"].create_all(self.engine)
+
+    # Contestants
+
+    def list_contestants(self):
+        contestants = self.tables["contestants"]
+        with self.engine.connect() as conn:
+            rows = conn.execute(contestants.select().order_by(contestants.c.id)).mappings()
+            return [_contestant(row) for row in rows]
+
+    def get_contestant(self, contestant_id):
+        contestants = self.tables["contestants"]
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                contestants.select().where(contestants.c.id == str(contestant_id))
+            ).mappings().first()
+            return _contestant(row) if row else None
+
+    def save_contestant(self, contestant):
+        contestants = self.tables["contestants"]
+        row = {
+            "id": str(contestant["id"]),
+            "name": contestant.get("name"),
+            "age": contestant.get("age"),
+            "location": contestant.get("location"),
+            "bio": contestant.get("bio"),
+            "votes": contestant.get("votes", 0),
+            "image_url": contestant.get("image_url"),
+            "stream_url": contestant.get("stream_url"),
+            "eliminated": bool(contestant.get("eliminated")),
+        }
+        statement = self._insert(contestants).values(row)
+        statement = statement.on_conflict_do_update(
+            index_elements=[contestants.c.id],
+            # The running total belongs to the ledger once the row exists
+            set_={key: statement.excluded[key] for key in row if key not in ("id", "votes")},
+        )
+        with self.engine.begin() as conn:
+            conn.execute(statement)
+
+    def add_votes(self, increments):
+        """Atomically add {contestant_id: votes} to the contestants' totals"""
+        with self.engine.begin() as conn:
+            self._add_votes(conn, increments)
+
+    # Tasks
+
+    def list_tasks(self):
+        tasks = self.tables["tasks"]
+        with self.engine.connect() as conn:
+            return [dict(row) for row in conn.execute(tasks.select().order_by(tasks.c.day)).mappings()]
+
+    def save_task(self, task):
+        tasks = self.tables["tasks"]
+        row = {column.name: task.get(column.name) for column in tasks.columns}
+        statement = self._insert(tasks).values(row)
+        statement = statement.on_conflict_do_update(
+            index_elements=[tasks.c.day],
+            set_={key: statement.excluded[key] for key in row if key != "day"},
+        )
+        with self.engine.begin() as conn:
+            conn.execute(statement)
+
+    # Signups
+
+    def add_signup(self, signup):
+        signups = self.tables["signups"]
+        with self.engine.begin() as conn:
+            result = conn.execute(signups.insert().values(
+                name=signup.get("name"),
+                email=signup.get("email"),
+                phone=signup.get("phone"),
+                location=signup.get("location"),
+                status=signup.get("status", "pending"),
+                created_at=signup.get("createdAt") or datetime.datetime.now(datetime.timezone.utc),
+                details=signup,
+            ))
+            return str(result.inserted_primary_key[0])
+
+    def list_signups(self, status=None, limit=50):
+        signups = self.tables["signups"]
+        query = signups.select().order_by(signups.c.created_at.desc()).limit(limit)
+        if status:
+            query = query.where(signups.c.status == status)
+        with self.engine.connect() as conn:
+            return [
+                dict(row["details"] or {}, id=str(row["id"]), status=row["status"])
+                for row in conn.execute(query).mappings()
+            ]
+
+    # Votes and payments
+
+    def batch_operations(self, vote):
+        """Firestore batch operations write_votes() adds for one vote: none"""
+        return 0
+
+    def write_votes(self, votes, batch=None, vote_fields=None, then=None):
+        """Write votes and their payments, and add them to the totals, in one transaction
+
+        Votes whose id is already stored are skipped and not counted again.
+        then(added), when given, is called with {contestant_id: votes} added
+        before the transaction commits, which it rolls back by raising. The
+        Firestore batch and vote_fields are not used.
+        Returns {contestant_id: votes} actually added.
+        """
+        if not votes:
+            if then is not None:
+                then({})
+            return {}
+        votes_table, payments_table = self.tables["votes"], self.tables["payments"]
+        vote_rows = [dict(_vote_row(vote), id=vote["id"]) for vote in votes]
+        payment_rows = [dict(_payment_row(vote), id=vote["id"]) for vote in votes if vote["paymentMethod"]]
+
+        increments = {}
+        with self.engine.begin() as conn:
+            for start in range(0, len(vote_rows), INSERT_CHUNK_ROWS):
+                statement = (
+                    self._insert(votes_table)
+                    .values(vote_rows[start:start + INSERT_CHUNK_ROWS])
+                    .on_conflict_do_nothing(index_elements=[votes_table.c.id])
+                    .returning(votes_table.c.contestant_id, votes_table.c.count)
+                )
+                for contestant_id, count in conn.execute(statement):
+                    increments[contestant_id] = increments.get(contestant_id, 0) + count
+            for start in range(0, len(payment_rows), INSERT_CHUNK_ROWS):
+                conn.execute(
+                    self._insert(payments_table)
+                    .values(payment_rows[start:start + INSERT_CHUNK_ROWS])
+                    .on_conflict_do_nothing(index_elements=[payments_table.c.id])
+                )
+            self._add_votes(conn, increments)
+            if then is not None:
+                then(increments)
+        return increments
+
+    def ensure_votes(self, votes):
+        """Store votes whose Firestore batch has committed, if their transaction did not"""
+        self.write_votes(votes)
+
+    def iter_votes(self, day=None):
+        return self._iter_rows(self.tables["votes"], day, _vote_dict)
+
+    def iter_payments(self, day=None):
+        return self._iter_rows(self.tables["payments"], day, _payment_dict)
+
+    def _iter_rows(self, table, day, to_dict):
+        query = table.select().order_by(table.c.timestamp, table.c.id)
+        if day is not None:
+            query = query.where(table.c.day == day)
+        with self.engine.connect() as conn:
+            # Stream with a server-side cursor instead of loading every row
+            result = conn.execution_options(stream_results=True, yield_per=INSERT_CHUNK_ROWS).execute(query)
+            for row in result.mappings():
+                yield to_dict(row)
+
+    def _add_votes(self, conn, increments):
+        if not increments:
+            return
+        contestants = self.tables["contestants"]
+        # INSERT ... ON CONFLICT DO UPDATE SET votes = contestants.votes + excluded.votes:
+        # one atomic statement per contestant, no read-modify-write
+        statement = self._insert(contestants)
+        statement = statement.on_conflict_do_update(
+            index_elements=[contestants.c.id],
+            set_={"votes": contestants.c.votes + statement.excluded.votes},
+        )
+        conn.execute(statement, [
+            {"id": str(contestant_id), "votes": count}
+            for contestant_id, count in sorted(increments.items())
+        ])
+
+    def _insert(self, table):
+        # Both dialects support ON CONFLICT; SQLite is handy for local runs
+        if self.engine.dialect.name == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        return insert(table)
+
+
+def _tables():
+    from sqlalchemy import (MetaData, Table, Column, Index, String, Integer, BigInteger, Boolean, Float,
+                            Text, DateTime, JSON)
+
+    metadata = MetaData()
+    contestants = Table(
+        "contestants", metadata,
+        Column("id", String(64), primary_key=True),
+        Column("name", Text),
+        Column("age", Integer),
+        Column("location", Text),
+        Column("bio", Text),
+        Column("votes", BigInteger, nullable=False, default=0),
+        Column("image_url", Text),
+        Column("stream_url", Text),
+        Column("eliminated", Boolean, nullable=False, default=False),
+    )
+    tasks = Table(
+        "tasks", metadata,
+        Column("day", Integer, primary_key=True),
+        Column("date", String(10)),
+        Column("title", Text),
+        Column("description", Text),
+        Column("release_time", String(16)),
+        Column("voting_close_time", String(16)),
+    )
+    votes = Table(
+        "votes", metadata,
+        Column("id", String(32), primary_key=True),
+        Column("contestant_id", String(64), nullable=False),
+        Column("count", Integer, nullable=False),
+        Column("email", Text),
+        Column("day", Integer),
+        Column("timestamp", DateTime(timezone=True), nullable=False),
+        Column("payment_method", String(32)),
+        Column("transaction_id", Text),
+        Index("votes_day_contestant", "day", "contestant_id"),
+        Index("votes_timestamp", "timestamp", "id"),
+    )
+    payments = Table(
+        "payments", metadata,
+        Column("id", String(32), primary_key=True),
+        Column("contestant_id", String(64), nullable=False),
+        Column("vote_count", Integer, nullable=False),
+        Column("amount", Float, nullable=False),
+        Column("email", Text),
+        Column("method", String(32), nullable=False),
+        Column("transaction_id", Text),
+        Column("day", Integer),
+        Column("timestamp", DateTime(timezone=True), nullable=False),
+        Column("status", String(16), nullable=False),
+        Index("payments_day", "day", "timestamp"),
+        Index("payments_transaction", "method", "transaction_id"),
+    )
+    signups = Table(
+        "signups", metadata,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("name", Text),
+        Column("email", Text),
+        Column("phone", Text),
+        Column("location", Text),
+        Column("status", String(16), nullable=False, default="pending"),
+        Column("created_at", DateTime(timezone=True), nullable=False),
+        # The whole form as submitted, for fields without a column
+        Column("details", JSON),
+        Index("signups_status", "status", "created_at"),
+    )
+    return {"metadata": metadata, "contestants": contestants, "tasks": tasks, "votes": votes,
+            "payments": payments, "signups": signups}
+
+
+def _vote_row(vote):
+    record = vote_record(vote)
+    return {
+        "contestant_id": record["contestantId"],
+        "count": record["count"],
+        "email": record["email"],
+        "day": record["day"],
+        "timestamp": record["timestamp"],
+        "payment_method": record["paymentMethod"],
+        "transaction_id": record["transactionId"],
+    }
+
+
+def _payment_row(vote):
+    record = payment_record(vote)
+    return {
+        "contestant_id": record["contestantId"],
+        "vote_count": record["voteCount"],
+        "amount": record["amount"],
+        "email": record["email"],
+        "method": record["method"],
+        "transaction_id": record["transactionId"],
+        "day": record["day"],
+        "timestamp": record["timestamp"],
+        "status": record["status"],
+    }
+
+
+def _contestant(row):
+    contestant = dict(row)
+    contestant["votes"] = contestant["votes"] or 0
+    return contestant
+
+
+def _vote_dict(row):
+    return {
+        "id": row["id"],
+        "contestantId": row["contestant_id"],
+        "count": row["count"],
+        "email": row["email"],
+        "day": row["day"],
+        "timestamp": row["timestamp"],
+        "paymentMethod": row["payment_method"],
+        "transactionId": row["transaction_id"],
+    }
+
+
+def _payment_dict(row):
+    return {
+        "id": row["id"],
+        "contestantId": row["contestant_id"],
+        "voteCount": row["vote_count"],
+        "amount": row["amount"],
+        "email": row["email"],
+        "method": row["method"],
+        "transactionId": row["transaction_id"],
+        "day": row["day"],
+        "timestamp": row["timestamp"],
+        "status": row["status"],
+    }
+
+
+class LedgerElsewhere(RuntimeError):
+    """Raised by Firestore readers of votes or payments while the ledger is kept elsewhere"""
+
+
+def require_firestore_ledger(reader):
+    """Raise LedgerElsewhere unless VOTE_LEDGER keeps votes and payments in Firestore"""
+    ledger = os.environ.get("VOTE_LEDGER", "firestore")
+    if ledger != "firestore":
+        raise LedgerElsewhere(f"{reader} reads votes and payments from Firestore, but VOTE_LEDGER={ledger} keeps them "
+                              f"in the database at DATABASE_URL")
+
+
+def vote_ledger(get_db):
+    """Return the repository votes are written through, chosen by VOTE_LEDGER
+
+    "firestore" (the default) or "postgres", which needs DATABASE_URL.
+    """
+    ledger = os.environ.get("VOTE_LEDGER", "firestore")
+    if ledger == "postgres":
+        logging.info("Writing the vote ledger to PostgreSQL")
+        return SqlRepository()
+    if ledger != "firestore":
+        raise ValueError(f"Unknown VOTE_LEDGER {ledger!r}; use firestore or postgres")
+    return FirestoreRepository(get_db)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Storage repository helpers")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("create-tables", help="Create the SQL tables in DATABASE_URL")
+    args = parser.parse_args(argv)
+
+    if args.command == "create-tables":
+        repository = SqlRepository()
+        repository.create_tables()
+        print(f"Created tables in {repository.engine.url.render_as_string(hide_password=True)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
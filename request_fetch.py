@@ -0,0 +1,264 @@
+"""
+Parallel, deadline-bounded data fetching for Smallie requests
+
+A request that needs several independent reads starts them together on a
+thread pool shared by the worker and waits for all of them under one
+deadline, so it takes as long as the slowest read, capped by the deadline,
+rather than the sum of the reads:
+
+    fetch = fetcher.start(deadline=0.8)
+    fetch.submit("contestants", contestant_cache.get_versioned, default=(None, None))
+    fetch.submit("task", get_current_task, default=builtin_calendar.current)
+    contestants, version = fetch.result("contestants")
+
+A read still running at the deadline, or one that failed, is answered with
+the last value that read returned in this worker, then the snapshot saved on
+disk for reads submitted with persist=True, then its default. The read
+itself is left to finish in the background. A name identifies the same read
+across requests: while one is in flight, later requests wait on it instead
+of starting another, so a slow Firestore does not fill the pool with
+duplicates.
+
+Each name has a circuit breaker (see circuit_breaker). Missed deadlines and
+errors count as failures, once per read however many requests share it: by
+the first waiter to give up on it, or else when it fails or finishes late.
+Once the breaker opens, requests get the fallback at once without waiting,
+while a single probe read runs in the background until one succeeds within
+the deadline. A read still in flight past its deadline when the name is next
+submitted is given up on and charged as a failure, so a probe that never
+returns reopens the breaker instead of holding it half-open for good.
+
+Each read runs in a copy of the submitting request's context, so its
+Firestore documents are charged to that request (see firestore_budget); a
+read shared by several requests is charged to the one that started it.
+The pool is created lazily in each process and never shared across fork().
+"""
+
+import os
+import time
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from circuit_breaker import CircuitBreaker, DEFAULT_FAILURE_THRESHOLD, DEFAULT_RESET_SECONDS
+
+DEFAULT_FETCH_WORKERS = int(os.environ.get("FETCH_WORKERS", "8"))
+DEFAULT_DEADLINE_SECONDS = float(os.environ.get("FETCH_DEADLINE", "0.8"))
+
+_MISSING = object()
+
+
+class _Read:
+    """One run of a read in the pool"""
+
+    def __init__(self, future, timeout, probe):
+        self.future = future
+        self.timeout = timeout
+        self.probe = probe
+        self.started = time.monotonic()
+        # Set once the read has been recorded as a failure with its breaker
+        self.failed = False
+
+
+class Fetcher:
+    """Per-process thread pool for request fetches, remembering each read's last good value"""
+
+    def __init__(self, max_workers=DEFAULT_FETCH_WORKERS, snapshots=None,
+                 failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_SECONDS):
+        self.max_workers = max_workers
+        self.snapshots = snapshots
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._in_flight = {}
+        self._breakers = {}
+        self._persist = set()
+        # name -> (value, saved_at) of the last read that succeeded
+        self._last = {}
+
+        # Counters exposed through stats(), per read name
+        self.completed = {}
+        self.missed = {}
+        self.failed = {}
+        self.short_circuited = {}
+
+        # The parent may have held a lock while forking
+        os.register_at_fork(after_in_child=self._reset_locks)
+
+    def start(self, deadline=DEFAULT_DEADLINE_SECONDS):
+        """Begin a request's fetches, all due `deadline` seconds from now"""
+        return Fetch(self, time.monotonic() + deadline, deadline)
+
+    def breaker(self, name):
+        """The circuit breaker of a read"""
+        with self._lock:
+            return self._breaker(name)
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            breakers = dict(self._breakers)
+            last = {name: saved_at for name, (value, saved_at) in self._last.items()}
+            stats = {
+                "in_flight": len(self._in_flight),
+                "completed": dict(self.completed),
+                "missed": dict(self.missed),
+                "failed": dict(self.failed),
+                "open": dict(self.short_circuited),
+            }
+        stats["breakers"] = {name: breaker.stats() for name, breaker in breakers.items()}
+        # Age of the newest good value of each read, which is what gets served once it fails
+        stats["staleness_seconds"] = {name: max(0.0, now - saved_at) for name, saved_at in last.items()}
+        return stats
+
+    def _submit(self, name, fn, timeout, persist):
+        """Start or join a read; returns None when its breaker answers for it"""
+        with self._lock:
+            if persist:
+                self._persist.add(name)
+            breaker = self._breaker(name)
+            overdue = self._in_flight.get(name)
+            if overdue is not None and time.monotonic() - overdue.started > overdue.timeout:
+                # It may never return, and no other read starts while it is
+                # in flight; it is left to finish in the background
+                del self._in_flight[name]
+            else:
+                overdue = None
+        if overdue is not None:
+            self._record_failure(overdue, breaker)
+
+        with self._lock:
+            decision = breaker.allow()
+            if decision is None:
+                return None
+            executor = self._ensure_executor()
+            read = self._in_flight.get(name)
+            started = read is None
+            if started:
+                context = contextvars.copy_context()
+                read = _Read(executor.submit(context.run, fn), timeout, decision == "probe")
+                self._in_flight[name] = read
+            elif decision == "probe":
+                # A read from before the breaker opened is still running; it is the probe
+                read.probe = True
+        if started:
+            read.future.add_done_callback(lambda future: self._finished(name, read, breaker))
+        # Requests do not wait for a probe; they keep getting the fallback
+        return None if decision == "probe" else read
+
+    def _finished(self, name, read, breaker):
+        elapsed = time.monotonic() - read.started
+        error = read.future.exception()
+        with self._lock:
+            if self._in_flight.get(name) is read:
+                del self._in_flight[name]
+            if error is None:
+                value = read.future.result()
+                saved_at = time.time()
+                self._last[name] = (value, saved_at)
+                self.completed[name] = self.completed.get(name, 0) + 1
+            persist = name in self._persist
+        if error is not None:
+            self._record_failure(read, breaker)
+            return
+        if elapsed <= read.timeout:
+            breaker.record_success()
+        else:
+            # Late; a no-op if a waiter already gave up on it
+            self._record_failure(read, breaker)
+        if persist and self.snapshots is not None:
+            self.snapshots.save(name, value, saved_at)
+
+    def _record_failure(self, read, breaker):
+        """Charge a read's failure to its breaker, the first time only"""
+        with self._lock:
+            if read.failed:
+                return
+            read.failed = True
+        breaker.record_failure()
+
+    def _fallback(self, name, default, counter, reason=None):
+        """Return (value, saved_at) from the last good value, the snapshot or the default"""
+        with self._lock:
+            counter[name] = counter.get(name, 0) + 1
+            last = self._last.get(name)
+            persist = name in self._persist
+        if last is None and persist and self.snapshots is not None:
+            last = self.snapshots.load(name)
+            if last is not None:
+                with self._lock:
+                    last = self._last.setdefault(name, last)
+        if last is not None:
+            if reason is not None:
+                logging.warning(f"Fetch {name} {reason}; using its last value")
+            return last
+        if reason is not None:
+            logging.warning(f"Fetch {name} {reason}; using its default")
+        return (default() if callable(default) else default), None
+
+    def _breaker(self, name):
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = self._breakers[name] = CircuitBreaker(name, self.failure_threshold, self.reset_timeout)
+        return breaker
+
+    def _reset_locks(self):
+        self._lock = threading.Lock()
+        for breaker in self._breakers.values():
+            breaker._reset_lock()
+
+    def _ensure_executor(self):
+        if self._pid != os.getpid():
+            # Threads do not survive fork(); start a fresh pool in the child
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="fetch")
+            self._in_flight = {}
+            self._pid = os.getpid()
+        return self._executor
+
+
+class Fetch:
+    """The reads of one request, sharing one deadline"""
+
+    def __init__(self, fetcher, deadline, timeout):
+        self.fetcher = fetcher
+        self.deadline = deadline
+        self.timeout = timeout
+        self._reads = {}
+        self._defaults = {}
+        # name -> saved_at of each value answered from a fallback
+        self.stale = {}
+
+    def submit(self, name, fn, default=None, persist=False):
+        """Start fn() in the pool; default (or default()) answers it if it never succeeded
+
+        With persist=True the last good value is also kept on disk.
+        """
+        self._reads[name] = self.fetcher._submit(name, fn, self.timeout, persist)
+        self._defaults[name] = default
+
+    def result(self, name):
+        """Wait for a read until the deadline and return its value or fallback"""
+        read = self._reads[name]
+        fetcher = self.fetcher
+        if read is None:
+            # The breaker is open: answer at once, without logging every request
+            value, self.stale[name] = fetcher._fallback(name, self._defaults[name], fetcher.short_circuited)
+            return value
+        try:
+            return read.future.result(timeout=max(0.0, self.deadline - time.monotonic()))
+        except TimeoutError:
+            # Charged here too, so a read that never returns still opens the breaker
+            fetcher._record_failure(read, fetcher.breaker(name))
+            value, self.stale[name] = fetcher._fallback(name, self._defaults[name], fetcher.missed, "missed its deadline")
+        except Exception as e:
+            value, self.stale[name] = fetcher._fallback(name, self._defaults[name], fetcher.failed, f"failed ({e})")
+        return value
+
+    @property
+    def partial(self):
+        """True when some value so far came from a fallback"""
+        return bool(self.stale)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Seed Smallie's Firestore collections
+
+Run once when setting up a new Firebase project. The app no longer writes
+these documents on import or on the first page view, so start-up does not
+pay for a collection scan. Existing collections are left untouched unless
+--force is given.
+
+Usage:
+    python seed.py [tasks|contestants|all] [--force]
+"""
+
+import sys
+import logging
+import argparse
+
+from firebase_client import get_db
+from competition_calendar import DAILY_TASKS, TASKS_COLLECTION
+from contestant_data import DEFAULT_CONTESTANTS
+
+
+def _is_empty(collection_ref):
+    return not list(collection_ref.limit(1).stream())
+
+
+def seed_tasks(db, force=False):
+    """Write the daily tasks if the tasks collection is empty
+
+    Returns the number of documents written.
+    """
+    tasks_ref = db.collection(TASKS_COLLECTION)
+    if not force and not _is_empty(tasks_ref):
+        logging.info("Daily tasks already exist in Firebase")
+        return 0
+
+    batch = db.batch()
+    for task in DAILY_TASKS:
+        batch.set(tasks_ref.document(f"day_{task['day']}"), task)
+    batch.commit()
+    logging.info("Daily tasks initialized in Firebase")
+    return len(DAILY_TASKS)
+
+
+def seed_contestants(db, force=False):
+    """Write the default contestants if the contestants collection is empty
+
+    Returns the number of documents written.
+    """
+    contestants_ref = db.collection('contestants')
+    if not force and not _is_empty(contestants_ref):
+        logging.info("Contestants already exist in Firebase")
+        return 0
+
+    batch = db.batch()
+    for contestant in DEFAULT_CONTESTANTS:
+        batch.set(contestants_ref.document(str(contestant['id'])), contestant)
+    batch.commit()
+    logging.info("Initialized contestants in Firestore")
+    return len(DEFAULT_CONTESTANTS)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Seed Smallie's Firestore collections")
+    parser.add_argument("target", nargs="?", choices=("tasks", "contestants", "all"), default="all")
+    parser.add_argument("--force", action="store_true", help="Overwrite documents that already exist")
+    args = parser.parse_args(argv)
+
+    db = get_db()
+    if db is None:
+        print("Error: Firebase is not configured")
+        return 1
+
+    if args.target in ("tasks", "all"):
+        print(f"Seeded {seed_tasks(db, force=args.force)} tasks")
+    if args.target in ("contestants", "all"):
+        print(f"Seeded {seed_contestants(db, force=args.force)} contestants")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
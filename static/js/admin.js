@@ -37,8 +37,8 @@ const firebaseConfig = {
 const app = initializeApp(firebaseConfig);
 const db = getFirestore(app);
 
-// Admin password (hardcoded for simplicity)
-const ADMIN_PASSWORD = 'smallie2025';
+// The server's ADMIN_API_TOKEN, entered at login and sent with every /api/admin request
+const ADMIN_TOKEN_KEY = 'admin_token';
 
 // DOM Elements - Dashboard Navigation
 const navItems = document.querySelectorAll('.nav-item');
@@ -130,7 +130,7 @@ const hideLoading = () => {
 
 // Admin Authentication
 const checkAuthentication = () => {
-    const isAuthenticated = localStorage.getItem('admin_authenticated') === 'true';
+    const isAuthenticated = Boolean(sessionStorage.getItem(ADMIN_TOKEN_KEY));
     if (!isAuthenticated) {
         loginModal.style.display = 'flex';
     } else {
@@ -139,17 +139,31 @@ const checkAuthentication = () => {
     return isAuthenticated;
 };
 
-const login = (password) => {
-    if (password === ADMIN_PASSWORD) {
-        localStorage.setItem('admin_authenticated', 'true');
-        loginModal.style.display = 'none';
-        return true;
+// GET an admin API path with the saved token; a 401 asks for the token again
+const adminFetch = async (path) => {
+    const response = await fetch(path, {
+        headers: { 'Authorization': `Bearer ${sessionStorage.getItem(ADMIN_TOKEN_KEY) || ''}` }
+    });
+    if (response.status === 401) {
+        sessionStorage.removeItem(ADMIN_TOKEN_KEY);
+        checkAuthentication();
+    }
+    return response;
+};
+
+// The token is checked by the server, so try it against the statistics endpoint
+const login = async (password) => {
+    sessionStorage.setItem(ADMIN_TOKEN_KEY, password);
+    const response = await adminFetch('/api/admin/stats?days=1');
+    if (response.status === 401) {
+        return false;
     }
-    return false;
+    loginModal.style.display = 'none';
+    return true;
 };
 
 const logout = () => {
-    localStorage.removeItem('admin_authenticated');
+    sessionStorage.removeItem(ADMIN_TOKEN_KEY);
     window.location.reload();
 };
 
@@ -248,28 +262,19 @@ const loadActiveContestants = async () => {
     }
 };
 
-const loadPendingApplications = async () => {
-    try {
-        const applicationsContainer = document.getElementById('pending-applications-grid');
-        applicationsContainer.innerHTML = '<div class="loading">Loading applications...</div>';
-        
-        const signupsRef = collection(db, 'signups');
-        const q = query(
-            signupsRef,
-            where('status', '==', 'pending')
-        );
-        
-        const querySnapshot = await getDocs(q);
-        
-        if (querySnapshot.empty) {
-            applicationsContainer.innerHTML = '<div class="empty-message">No pending applications found.</div>';
-            return;
-        }
-        
-        let html = '';
-        querySnapshot.forEach((doc) => {
-            const application = { ...doc.data(), id: doc.id };
-            html += `
+// Fetch one page of an admin listing; pass the previous page's nextCursor to continue
+const fetchAdminPage = async (collectionName, params = {}) => {
+    const query = new URLSearchParams(
+        Object.entries(params).filter(([, value]) => value !== undefined && value !== null && value !== '')
+    );
+    const response = await adminFetch(`/api/admin/${collectionName}?${query}`);
+    if (!response.ok) {
+        throw new Error(`Failed to load ${collectionName}: ${response.status}`);
+    }
+    return response.json();
+};
+
+const renderApplicationCard = (application) => `
                 <div class="admin-card">
                     <div class="admin-card-header">
                         <h3 class="admin-card-title">${application.name}</h3>
@@ -288,13 +293,41 @@ const loadPendingApplications = async () => {
                     </div>
                 </div>
             `;
-        });
+
+const loadPendingApplications = async (cursor = null) => {
+    const applicationsContainer = document.getElementById('pending-applications-grid');
+    try {
+        if (!cursor) {
+            applicationsContainer.innerHTML = '<div class="loading">Loading applications...</div>';
+        }
+        
+        // One page at a time, filtered and ordered on the server
+        const page = await fetchAdminPage('signups', { status: 'pending', pageSize: 24, cursor });
         
-        applicationsContainer.innerHTML = html;
+        if (!cursor && page.items.length === 0) {
+            applicationsContainer.innerHTML = '<div class="empty-message">No pending applications found.</div>';
+            return;
+        }
+        
+        const html = page.items.map(renderApplicationCard).join('');
+        if (cursor) {
+            applicationsContainer.querySelector('.load-more-applications')?.remove();
+            applicationsContainer.insertAdjacentHTML('beforeend', html);
+        } else {
+            applicationsContainer.innerHTML = html;
+        }
+        
+        if (page.nextCursor) {
+            applicationsContainer.insertAdjacentHTML('beforeend',
+                '<button class="btn btn-secondary load-more-applications">Load more</button>');
+            applicationsContainer.querySelector('.load-more-applications')
+                .addEventListener('click', () => loadPendingApplications(page.nextCursor));
+        }
         
         // Add event listeners to view buttons
-        const viewButtons = document.querySelectorAll('.view-application');
+        const viewButtons = applicationsContainer.querySelectorAll('.view-application:not([data-bound])');
         viewButtons.forEach(button => {
+            button.dataset.bound = 'true';
             button.addEventListener('click', () => {
                 const applicationId = button.dataset.id;
                 openApplicationModal(applicationId);
@@ -302,7 +335,7 @@ const loadPendingApplications = async () => {
         });
     } catch (error) {
         console.error('Error loading pending applications:', error);
-        document.getElementById('pending-applications-grid').innerHTML = 
+        applicationsContainer.innerHTML = 
             '<div class="error-message">Error loading applications. Please try again.</div>';
     }
 };
@@ -903,31 +936,21 @@ const deleteTask = async (taskId) => {
     }
 };
 
+// Fetch rolled-up vote statistics (totals, today's breakdown, recent days)
+const fetchVoteStats = async (days = 7) => {
+    const response = await adminFetch(`/api/admin/stats?days=${days}`);
+    if (!response.ok) {
+        throw new Error(`Failed to load vote statistics: ${response.status}`);
+    }
+    return response.json();
+};
+
 // Payout Management
 const loadDailyPayouts = async () => {
     try {
-        // Calculate today's statistics
-        const today = new Date();
-        today.setHours(0, 0, 0, 0);
-        
-        const startOfDay = Timestamp.fromDate(today);
-        const endOfDay = Timestamp.fromDate(new Date(today.setHours(23, 59, 59, 999)));
-        
-        // Get today's votes
-        const votesRef = collection(db, 'votes');
-        const q = query(
-            votesRef,
-            where('timestamp', '>=', startOfDay),
-            where('timestamp', '<=', endOfDay)
-        );
-        
-        const querySnapshot = await getDocs(q);
-        
-        let todayVotes = 0;
-        querySnapshot.forEach((doc) => {
-            const vote = doc.data();
-            todayVotes += vote.count || 1;
-        });
+        // Get today's statistics from the server-side rollups
+        const stats = await fetchVoteStats();
+        const todayVotes = stats.day.votes;
         
         // Calculate revenue and payout
         const revenue = todayVotes * 0.5; // $0.50 per vote
@@ -964,12 +987,12 @@ const loadDailyWinners = async () => {
             return;
         }
         
-        // Calculate daily votes for each contestant (this would normally come from the votes collection)
-        // For demo purposes, we'll use a random number for each contestant
+        // Today's votes per contestant come from the server-side rollups
+        const stats = await fetchVoteStats();
         const contestants = [];
         querySnapshot.forEach((doc) => {
             const contestant = doc.data();
-            const dailyVotes = Math.floor(Math.random() * 100); // Random number for demo
+            const dailyVotes = stats.day.contestants[doc.id] || 0;
             contestants.push({
                 ...contestant,
                 daily_votes: dailyVotes,
@@ -1009,15 +1032,9 @@ const loadDailyWinners = async () => {
 
 const loadFinalPayouts = async () => {
     try {
-        // Calculate total votes and revenue
-        const votesRef = collection(db, 'votes');
-        const votesSnapshot = await getDocs(votesRef);
-        
-        let totalVotes = 0;
-        votesSnapshot.forEach((doc) => {
-            const vote = doc.data();
-            totalVotes += vote.count || 1;
-        });
+        // Get total votes from the server-side rollups
+        const stats = await fetchVoteStats();
+        const totalVotes = stats.totals.votes;
         
         // Calculate revenue and prize pool
         const totalRevenue = totalVotes * 0.5; // $0.50 per vote
@@ -1134,28 +1151,9 @@ const openPayoutModal = async (type) => {
         if (type === 'daily') {
             title = 'Process Daily Payout';
             
-            // Calculate today's statistics again
-            const today = new Date();
-            today.setHours(0, 0, 0, 0);
-            
-            const startOfDay = Timestamp.fromDate(today);
-            const endOfDay = Timestamp.fromDate(new Date(today.setHours(23, 59, 59, 999)));
-            
-            // Get today's votes
-            const votesRef = collection(db, 'votes');
-            const q = query(
-                votesRef,
-                where('timestamp', '>=', startOfDay),
-                where('timestamp', '<=', endOfDay)
-            );
-            
-            const querySnapshot = await getDocs(q);
-            
-            let todayVotes = 0;
-            querySnapshot.forEach((doc) => {
-                const vote = doc.data();
-                todayVotes += vote.count || 1;
-            });
+            // Get today's statistics from the server-side rollups
+            const stats = await fetchVoteStats();
+            const todayVotes = stats.day.votes;
             
             // Calculate revenue and payout
             const revenue = todayVotes * 0.5; // $0.50 per vote
@@ -1191,15 +1189,9 @@ const openPayoutModal = async (type) => {
         } else if (type === 'final') {
             title = 'Process Final Payout';
             
-            // Calculate total votes and revenue
-            const votesRef = collection(db, 'votes');
-            const votesSnapshot = await getDocs(votesRef);
-            
-            let totalVotes = 0;
-            votesSnapshot.forEach((doc) => {
-                const vote = doc.data();
-                totalVotes += vote.count || 1;
-            });
+            // Get total votes from the server-side rollups
+            const stats = await fetchVoteStats();
+            const totalVotes = stats.totals.votes;
             
             // Calculate revenue and prize pool
             const totalRevenue = totalVotes * 0.5; // $0.50 per vote
@@ -1258,15 +1250,9 @@ const openPayoutModal = async (type) => {
 // Stats Dashboard
 const loadStatsDashboard = async () => {
     try {
-        // Calculate total votes, revenue, and prize pool
-        const votesRef = collection(db, 'votes');
-        const votesSnapshot = await getDocs(votesRef);
-        
-        let totalVotes = 0;
-        votesSnapshot.forEach((doc) => {
-            const vote = doc.data();
-            totalVotes += vote.count || 1;
-        });
+        // Get total votes from the server-side rollups
+        const stats = await fetchVoteStats();
+        const totalVotes = stats.totals.votes;
         
         // Calculate revenue and prize pool
         const totalRevenue = totalVotes * 0.5; // $0.50 per vote
@@ -1304,9 +1290,9 @@ const loadVotesChart = async () => {
         const labels = [];
         const data = [];
         
-        for (let i = 6; i >= 0; i--) {
-            const date = new Date();
-            date.setDate(date.getDate() - i);
+        const stats = await fetchVoteStats(7);
+        stats.days.forEach((day) => {
+            const date = new Date(`${day.date}T12:00:00`);
             
             const formattedDate = date.toLocaleDateString('en-US', {
                 month: 'short',
@@ -1314,10 +1300,8 @@ const loadVotesChart = async () => {
             });
             
             labels.push(formattedDate);
-            
-            // Generate random data for demo
-            data.push(Math.floor(Math.random() * 500) + 100);
-        }
+            data.push(day.votes);
+        });
         
         // Create chart
         const ctx = document.getElementById('votes-chart').getContext('2d');
@@ -1650,11 +1634,11 @@ document.addEventListener('DOMContentLoaded', () => {
     });
     
     // Set up modal event listeners
-    adminLoginForm.addEventListener('submit', (e) => {
+    adminLoginForm.addEventListener('submit', async (e) => {
         e.preventDefault();
         const password = adminPassword.value;
         
-        if (login(password)) {
+        if (await login(password)) {
             // Load initial data after login
             loadActiveContestants();
             loadTasks();
@@ -221,6 +221,55 @@ async function initContestants() {
     }
 }
 
+// How often vote badges are polled while the live stream is unavailable
+const LEADERBOARD_POLL_MS = 15000;
+// How long to poll before trying the live stream again
+const STREAM_RETRY_MS = 60000;
+
+// Keep vote badges live from the server's Server-Sent Events stream
+function connectVoteStream() {
+    if (!window.EventSource) {
+        pollLeaderboard(Infinity);
+        return;
+    }
+    
+    // EventSource reconnects by itself after network drops, but gives up
+    // when the server turns it away (503 once a worker has enough streams)
+    const source = new EventSource('/api/stream/votes');
+    source.addEventListener('votes', (event) => {
+        const updates = JSON.parse(event.data);
+        Object.entries(updates).forEach(([contestantId, state]) => {
+            updateVoteDisplay(contestantId, state.votes);
+            markContestantEliminated(contestantId, state.eliminated);
+        });
+    });
+    source.addEventListener('error', () => {
+        if (source.readyState === EventSource.CLOSED) {
+            pollLeaderboard(STREAM_RETRY_MS).then(connectVoteStream);
+        }
+    });
+}
+
+// Poll the leaderboard for `duration` ms; the browser revalidates it with its ETag
+async function pollLeaderboard(duration) {
+    const until = Date.now() + duration;
+    while (Date.now() < until) {
+        try {
+            const response = await fetch('/api/leaderboard?limit=100');
+            if (response.ok) {
+                const leaderboard = await response.json();
+                leaderboard.entries.forEach((entry) => {
+                    updateVoteDisplay(entry.id, entry.votes);
+                    markContestantEliminated(entry.id, entry.eliminated);
+                });
+            }
+        } catch (error) {
+            console.error('Error polling vote counts:', error);
+        }
+        await new Promise((resolve) => setTimeout(resolve, LEADERBOARD_POLL_MS));
+    }
+}
+
 // Initialize on page load
 document.addEventListener('DOMContentLoaded', () => {
     // Only run if we have contestant cards
@@ -238,6 +287,9 @@ document.addEventListener('DOMContentLoaded', () => {
         
         // Initialize contestants from Firestore
         initContestants();
+        
+        // Follow live vote counts
+        connectVoteStream();
     }
 });
 
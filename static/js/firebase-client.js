@@ -14,13 +14,8 @@ import {
 } from 'https://www.gstatic.com/firebasejs/11.0.2/firebase-auth.js';
 import {
     getFirestore,
-    collection,
     doc,
-    addDoc,
-    updateDoc,
-    getDoc,
-    increment,
-    serverTimestamp
+    getDoc
 } from 'https://www.gstatic.com/firebasejs/11.0.2/firebase-firestore.js';
 
 // Initialize Firebase with values from server
@@ -242,27 +237,20 @@ if (confirmVoteButton) {
         const email = voteModal.dataset.email;
         
         try {
-            // Get current day
-            const currentDay = parseInt(document.querySelector('#daily-task h2').textContent.split(' ')[1]) || 1;
-            
-            // Create a vote record
-            const voteData = {
-                contestantId: contestantId,
-                count: voteCount,
-                email: email,
-                timestamp: serverTimestamp(),
-                day: currentDay
-            };
-            
-            // Add the vote to Firebase
-            const votesRef = collection(db, 'votes');
-            await addDoc(votesRef, voteData);
-            
-            // Update contestant vote count
-            const contestantRef = doc(db, 'contestants', contestantId);
-            await updateDoc(contestantRef, {
-                votes: increment(voteCount)
+            // Submit the vote to the server, which batches the Firestore writes
+            // and counts it towards the competition day it arrives in
+            const response = await fetch('/api/votes', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    contestantId: contestantId,
+                    count: voteCount,
+                    email: email
+                })
             });
+            if (!response.ok) {
+                throw new Error(`Vote submission failed with status ${response.status}`);
+            }
             
             // Update the UI to reflect the new vote count
             const contestantCard = document.querySelector(`[data-contestant-id="${contestantId}"]`);
@@ -3,20 +3,9 @@
  * Handles Flutterwave and Solana payment processing for contestant voting
  */
 
-import {
-    getFirestore,
-    collection,
-    doc,
-    addDoc,
-    updateDoc,
-    increment,
-    serverTimestamp
-} from 'https://www.gstatic.com/firebasejs/11.0.2/firebase-firestore.js';
-
 import { getAuth } from 'https://www.gstatic.com/firebasejs/11.0.2/firebase-auth.js';
 
 // Get Firebase instances
-const db = getFirestore();
 const auth = getAuth();
 
 // DOM Elements
@@ -37,15 +26,12 @@ function formatCurrency(amount) {
 // Function to update prize fund display
 export async function updatePrizeFund() {
     try {
-        // Get total votes from all contestants
-        const contestantsRef = collection(db, 'contestants');
-        const snapshot = await getDocs(contestantsRef);
-        
-        let totalVotes = 0;
-        snapshot.forEach(doc => {
-            const contestant = doc.data();
-            totalVotes += contestant.votes || 0;
-        });
+        // Get total votes from the server-maintained leaderboard
+        const response = await fetch('/api/leaderboard?limit=1', { cache: 'no-cache' });
+        if (!response.ok) {
+            throw new Error(`Leaderboard request failed with status ${response.status}`);
+        }
+        const { totalVotes } = await response.json();
         
         // Calculate prize fund (90% of total votes at $0.50 each)
         const prizePool = totalVotes * 0.5 * 0.9 * 480; // Converting USD to NGN (approximate rate)
@@ -71,6 +57,11 @@ export function initFlutterwavePayment(customerInfo, amount, contestantId, voteC
             email: customerInfo.email,
             name: customerInfo.name || "Smallie Voter"
         },
+        // Read back by the payment webhook to credit the votes
+        meta: {
+            contestantId: contestantId,
+            voteCount: voteCount
+        },
         customizations: {
             title: "Smallie Vote Payment",
             description: `${voteCount} vote(s) for ${customerInfo.contestantName}`,
@@ -152,35 +143,22 @@ export async function initSolanaPayment(customerInfo, amount, contestantId, vote
 // Process successful payment and update votes
 async function processSuccessfulPayment(contestantId, voteCount, email, paymentMethod, transactionId) {
     try {
-        // Create payment record
-        const paymentsRef = collection(db, 'payments');
-        await addDoc(paymentsRef, {
-            contestantId: contestantId,
-            voteCount: voteCount,
-            amount: voteCount * 0.5, // $0.50 per vote
-            email: email,
-            method: paymentMethod,
-            transactionId: transactionId,
-            timestamp: serverTimestamp(),
-            status: 'completed'
-        });
-        
-        // Create votes record
-        const votesRef = collection(db, 'votes');
-        await addDoc(votesRef, {
-            contestantId: contestantId,
-            count: voteCount,
-            email: email,
-            timestamp: serverTimestamp(),
-            paymentMethod: paymentMethod,
-            transactionId: transactionId
-        });
-        
-        // Update contestant vote count
-        const contestantRef = doc(db, 'contestants', contestantId);
-        await updateDoc(contestantRef, {
-            votes: increment(voteCount)
+        // Tell the server about the payment; the votes are credited once the
+        // provider's webhook confirms it
+        const response = await fetch('/api/votes', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                contestantId: contestantId,
+                count: voteCount,
+                email: email,
+                paymentMethod: paymentMethod,
+                transactionId: transactionId
+            })
         });
+        if (!response.ok) {
+            throw new Error(`Vote submission failed with status ${response.status}`);
+        }
         
         // Update the UI to reflect the new vote count
         const contestantCard = document.querySelector(`[data-contestant-id="${contestantId}"]`);
@@ -3,20 +3,23 @@
  * Handles voting area functionality, vote selection, and payment initiation
  */
 
-import {
-    getFirestore,
-    collection,
-    getDocs,
-    query,
-    where,
-    orderBy,
-    limit
-} from 'https://www.gstatic.com/firebasejs/11.0.2/firebase-firestore.js';
-
 import { updatePrizeFund } from './payments.js';
 
-// Get Firebase instances
-const db = getFirestore();
+// Contestants requested from the leaderboard API (covers the whole competition)
+const LEADERBOARD_LIMIT = 100;
+
+// How often rankings are refreshed; unchanged rankings cost a 304
+const LEADERBOARD_REFRESH_MS = 30 * 1000;
+
+// Leaderboard state, kept current by applying delta responses from the server
+const leaderboardState = {
+    version: null,
+    entries: new Map(),
+    totalVotes: 0
+};
+
+// In-flight leaderboard request, shared by widgets refreshing together
+let leaderboardRequest = null;
 
 // DOM Elements
 const votingForm = document.getElementById('voting-form');
@@ -29,6 +32,42 @@ const emailRequired = document.getElementById('email-required-notice');
 const emailInput = document.getElementById('email');
 const voteCounterSection = document.querySelector('.vote-counter-section');
 
+// Fetch the leaderboard once for all widgets that ask at the same time
+export function refreshLeaderboard() {
+    if (!leaderboardRequest) {
+        leaderboardRequest = fetchLeaderboard().finally(() => {
+            leaderboardRequest = null;
+        });
+    }
+    return leaderboardRequest;
+}
+
+// Fetch the leaderboard, asking only for changes since the version we hold
+async function fetchLeaderboard() {
+    const params = new URLSearchParams({ limit: LEADERBOARD_LIMIT });
+    if (leaderboardState.version) {
+        params.set('since', leaderboardState.version);
+    }
+    
+    // The browser revalidates with If-None-Match, so unchanged rankings return 304
+    const response = await fetch(`/api/leaderboard?${params}`, { cache: 'no-cache' });
+    if (!response.ok) {
+        throw new Error(`Leaderboard request failed with status ${response.status}`);
+    }
+    const data = await response.json();
+    
+    if (data.full) {
+        leaderboardState.entries = new Map(data.entries.map(entry => [entry.id, entry]));
+    } else {
+        data.changed.forEach(entry => leaderboardState.entries.set(entry.id, entry));
+        data.removed.forEach(id => leaderboardState.entries.delete(id));
+    }
+    leaderboardState.version = data.version;
+    leaderboardState.totalVotes = data.totalVotes;
+    
+    return [...leaderboardState.entries.values()].sort((a, b) => a.rank - b.rank);
+}
+
 // Display the top voted contestants in the red vote tiles
 export async function showTopContestants() {
     try {
@@ -42,15 +81,8 @@ export async function showTopContestants() {
         let contestants = [];
         
         try {
-            // Try to get from Firestore
-            const contestantsRef = collection(db, 'contestants');
-            const contestantsSnapshot = await getDocs(contestantsRef);
-            
-            if (!contestantsSnapshot.empty) {
-                contestantsSnapshot.forEach(doc => {
-                    contestants.push(doc.data());
-                });
-            }
+            // Rankings come from the server-maintained leaderboard
+            contestants = await refreshLeaderboard();
         } catch (error) {
             console.error('Error fetching contestants:', error);
             // If Firestore fails, get from DOM
@@ -158,15 +190,8 @@ export async function showVotesLeaderboard() {
         let contestants = [];
         
         try {
-            // Try to get from Firestore
-            const contestantsRef = collection(db, 'contestants');
-            const contestantsSnapshot = await getDocs(contestantsRef);
-            
-            if (!contestantsSnapshot.empty) {
-                contestantsSnapshot.forEach(doc => {
-                    contestants.push(doc.data());
-                });
-            }
+            // Rankings come from the server-maintained leaderboard
+            contestants = await refreshLeaderboard();
         } catch (error) {
             console.error('Error fetching contestants:', error);
             // If Firestore fails, get from DOM
@@ -297,10 +322,10 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
     
-    // Refresh voting data every 5 minutes
+    // Refresh voting data; unchanged rankings are answered with a 304
     setInterval(() => {
         showTopContestants();
         showVotesLeaderboard();
         updatePrizeFund();
-    }, 5 * 60 * 1000);
+    }, LEADERBOARD_REFRESH_MS);
 });
\ No newline at end of file
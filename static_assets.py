@@ -0,0 +1,98 @@
+"""
+Runtime side of the static asset build for Smallie
+
+Reads static/dist/manifest.json written by build_assets.py and points
+url_for('static', filename=...) at the content-hashed copies. Hashed files
+never change, so they are served with a one-year immutable Cache-Control
+and, when the client accepts it, from their precompressed .br or .gz
+sibling. Without a manifest (no build has been run) URLs and serving are
+left exactly as Flask does them.
+"""
+
+import os
+import json
+import logging
+import mimetypes
+
+from flask import request, send_from_directory
+
+from build_assets import DIST_NAME, MANIFEST_NAME
+from page_cache import choose_encoding
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+_SIBLING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+class StaticAssets:
+    """Serves fingerprinted static assets for a Flask app"""
+
+    def __init__(self, app=None, enabled=True):
+        self.manifest = {}
+        self.enabled = enabled
+        self._static_folder = None
+        self._siblings = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._static_folder = app.static_folder
+        if self.enabled:
+            self.manifest = self._load_manifest()
+        if not self.manifest:
+            return
+        app.url_defaults(self._rewrite_url)
+        self._send_static = app.view_functions["static"]
+        app.view_functions["static"] = self.send_static
+
+    def send_static(self, filename):
+        """Serve a static file, using precompressed siblings for built assets"""
+        if not filename.startswith(DIST_NAME + "/"):
+            return self._send_static(filename=filename)
+
+        available = self._available_encodings(filename)
+        encoding = choose_encoding(request.headers.get("Accept-Encoding"), available)
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        response = send_from_directory(
+            self._static_folder, filename + _SIBLING_SUFFIXES.get(encoding, ""),
+            mimetype=mimetype, max_age=31536000,
+        )
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+    def _rewrite_url(self, endpoint, values):
+        if endpoint != "static":
+            return
+        filename = values.get("filename")
+        hashed = self.manifest.get(filename)
+        if hashed is not None:
+            values["filename"] = hashed
+
+    def _available_encodings(self, filename):
+        # Which siblings exist never changes for a hashed name, so check once
+        available = self._siblings.get(filename)
+        if available is None:
+            path = os.path.join(self._static_folder, filename)
+            available = {"identity"}
+            for encoding, suffix in _SIBLING_SUFFIXES.items():
+                if os.path.exists(path + suffix):
+                    available.add(encoding)
+            self._siblings[filename] = available
+        return available
+
+    def _load_manifest(self):
+        path = os.path.join(self._static_folder, DIST_NAME, MANIFEST_NAME)
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            logging.info("No static asset manifest; serving unbuilt assets")
+            return {}
+        except Exception as e:
+            logging.error(f"Error loading static asset manifest: {e}")
+            return {}
+        logging.info(f"Loaded static asset manifest with {len(manifest)} entries")
+        return manifest
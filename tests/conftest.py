@@ -0,0 +1,54 @@
+"""
+Fixtures for the Smallie tests: the Flask app on the in-memory Firestore from benchmarks/
+
+The app reads its configuration when it is imported, so the environment is
+set here first, with every local file it writes kept in a scratch directory.
+"""
+
+import os
+import tempfile
+
+import pytest
+
+WORK_DIR = tempfile.mkdtemp(prefix="smallie-tests-")
+PHOTO_DIR = os.path.join(WORK_DIR, "photos")
+
+ADMIN_TOKEN = "test-admin-token"
+SOLANA_SECRET = "test-solana-secret"
+
+os.environ.update({
+    "FIREBASE_WARMUP": "0",
+    "VOTE_WAL_DIR": os.path.join(WORK_DIR, "wal"),
+    "RATE_LIMIT_FILE": os.path.join(WORK_DIR, "rate-limits.bin"),
+    "SNAPSHOT_DIR": os.path.join(WORK_DIR, "snapshots"),
+    "METRICS_DIR": os.path.join(WORK_DIR, "metrics"),
+    "THUMBNAIL_CACHE_DIR": os.path.join(WORK_DIR, "thumbnails"),
+    "THUMBNAIL_SOURCE_DIR": PHOTO_DIR,
+    "ADMIN_API_TOKEN": ADMIN_TOKEN,
+    "SOLANA_WEBHOOK_SECRET": SOLANA_SECRET,
+    "VOTE_LEDGER": "firestore",
+})
+os.makedirs(PHOTO_DIR, exist_ok=True)
+
+
+@pytest.fixture(scope="session")
+def db():
+    """The in-memory Firestore every test shares"""
+    from fake_firestore import FakeFirestore
+    import firebase_client
+
+    fake = FakeFirestore()
+    firebase_client.install(fake)
+    return fake
+
+
+@pytest.fixture(scope="session")
+def smallie(db):
+    """The app module, imported once on top of the fake Firestore"""
+    import app
+    return app
+
+
+@pytest.fixture
+def client(smallie):
+    return smallie.app.test_client()
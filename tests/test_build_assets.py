@@ -0,0 +1,26 @@
+"""The asset build's own minifier keeps literals intact, and a build replaces dist/ whole"""
+
+import os
+import json
+
+import build_assets
+
+
+def test_template_substitutions_are_copied_unchanged(monkeypatch):
+    monkeypatch.setattr(build_assets, "rjsmin", None)
+    source = "const s = `a ${f(`b // x`)} c`;\nlet y = { z: `${ {k: '}'}.k }` };\n"
+    assert build_assets.minify_js(source) == "const s=`a ${f(`b // x`)} c`;let y={z:`${ {k: '}'}.k }`};\n"
+
+
+def test_build_replaces_the_previous_output(tmp_path):
+    os.makedirs(tmp_path / "js")
+    (tmp_path / "js" / "app.js").write_text("let a = 1;\n")
+    first = build_assets.build(str(tmp_path))
+    (tmp_path / "js" / "app.js").write_text("let a = 2;\n")
+    second = build_assets.build(str(tmp_path))
+
+    assert first["js/app.js"] != second["js/app.js"]
+    assert not (tmp_path / first["js/app.js"]).exists()
+    assert (tmp_path / second["js/app.js"]).read_text() == "let a=2;\n"
+    assert json.loads((tmp_path / "dist" / "manifest.json").read_text()) == second
+    assert sorted(os.listdir(tmp_path)) == ["dist", "js"]
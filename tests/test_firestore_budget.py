@@ -0,0 +1,54 @@
+"""Firestore documents read per request stay within each route's budget"""
+
+import datetime
+
+from conftest import ADMIN_TOKEN
+from firestore_budget import track
+
+# The homepage is served from the contestant listener and the cached schedule
+HOMEPAGE_READS = 2
+
+
+def test_homepage_reads_at_most_a_few_documents(client):
+    client.get("/")
+    with track() as cost:
+        response = client.get("/")
+    assert response.status_code == 200
+    assert cost.reads <= HOMEPAGE_READS
+    assert cost.writes == 0
+    assert f"reads={cost.reads} " in response.headers["Server-Timing"]
+
+
+def test_admin_page_reads_one_page_whatever_the_collection_size(client, db):
+    started = datetime.datetime(2025, 6, 1, tzinfo=datetime.timezone.utc)
+    db.load("votes", {
+        f"budget-{n}": {
+            "contestantId": "3",
+            "count": 1,
+            "email": f"voter{n}@example.com",
+            "day": 9,
+            "timestamp": started + datetime.timedelta(seconds=n),
+        }
+        for n in range(300)
+    })
+    headers = {"Authorization": f"Bearer {ADMIN_TOKEN}"}
+
+    with track() as cost:
+        response = client.get("/api/admin/votes?day=9&pageSize=20", headers=headers)
+    assert response.status_code == 200
+    assert len(response.get_json()["items"]) == 20
+    # One extra document tells whether there is another page
+    assert cost.reads <= 21
+
+    with track() as cost:
+        response = client.get(f"/api/admin/votes?day=9&pageSize=20&cursor={response.get_json()['nextCursor']}",
+                              headers=headers)
+    assert response.status_code == 200
+    assert cost.reads <= 21
+
+
+def test_admin_api_reads_nothing_without_credentials(client):
+    with track() as cost:
+        response = client.get("/api/admin/votes")
+    assert response.status_code == 401
+    assert cost.reads == 0
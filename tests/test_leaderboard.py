@@ -0,0 +1,20 @@
+"""The leaderboard answers any since value, and only its own versions reach the ETag"""
+
+import pytest
+
+
+@pytest.mark.parametrize("since", ['"', "stale-version", "a" * 2000], ids=["quote", "stale", "long"])
+def test_unknown_since_gets_the_full_ranking(client, since):
+    full = client.get("/api/leaderboard")
+    response = client.get("/api/leaderboard", query_string={"since": since})
+    assert response.status_code == 200
+    assert response.get_json()["full"] is True
+    assert response.headers["ETag"] == full.headers["ETag"]
+
+
+def test_known_since_gets_a_delta(client):
+    version = client.get("/api/leaderboard").get_json()["version"]
+    response = client.get("/api/leaderboard", query_string={"since": version})
+    assert response.status_code == 200
+    assert response.get_json()["full"] is False
+    assert version in response.headers["ETag"]
@@ -0,0 +1,89 @@
+"""Paid votes are credited once per payment, and only by the provider's signed webhook"""
+
+import hmac
+import json
+import uuid
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from conftest import SOLANA_SECRET
+from payment_webhooks import VOTE_PRICE_LAMPORTS, idempotency_key
+
+
+def solana_delivery(signature, contestant_id, votes, lamports=None):
+    body = json.dumps({
+        "signature": signature,
+        "status": "finalized",
+        "contestantId": contestant_id,
+        "voteCount": votes,
+        "email": "payer@example.com",
+        "lamports": votes * VOTE_PRICE_LAMPORTS if lamports is None else lamports,
+    }).encode("utf-8")
+    headers = {
+        "Content-Type": "application/json",
+        "x-smallie-signature": hmac.new(SOLANA_SECRET.encode("utf-8"), body, hashlib.sha256).hexdigest(),
+    }
+    return body, headers
+
+
+def votes_for(db, transaction_id):
+    return [doc.to_dict() for doc in db.collection("votes").where("transactionId", "==", transaction_id).stream()]
+
+
+def test_webhook_burst_credits_one_vote(smallie, db):
+    signature = uuid.uuid4().hex
+    body, headers = solana_delivery(signature, "1", 3)
+
+    def deliver(_):
+        return smallie.app.test_client().post("/api/webhooks/solana", data=body, headers=headers).get_json()["status"]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        statuses = list(pool.map(deliver, range(40)))
+    assert statuses.count("accepted") == 1
+    assert statuses.count("duplicate") == 39
+
+    # Another worker, which has not seen the payment, gets it too
+    smallie.recent_payments.discard(idempotency_key("solana", signature))
+    assert deliver(None) == "accepted"
+    smallie.vote_ingestor.flush()
+
+    votes = votes_for(db, signature)
+    assert [vote["count"] for vote in votes] == [3]
+    assert db.collection("payment_events").document(f"solana:{signature}").get().exists
+
+
+def test_browser_report_waits_for_the_webhook(smallie, client, db):
+    signature = uuid.uuid4().hex
+    response = client.post("/api/votes", json={
+        "contestantId": "2",
+        "count": 1000,
+        "email": "payer@example.com",
+        "paymentMethod": "solana",
+        "transactionId": signature,
+    })
+    assert response.status_code == 202
+    assert response.get_json()["status"] == "pending"
+    smallie.vote_ingestor.flush()
+    assert votes_for(db, signature) == []
+    assert db.collection("payment_reports").document(f"solana:{signature}").get().to_dict()["count"] == 1000
+
+    body, headers = solana_delivery(signature, "2", 4)
+    assert client.post("/api/webhooks/solana", data=body, headers=headers).get_json()["status"] == "accepted"
+    smallie.vote_ingestor.flush()
+    assert [vote["count"] for vote in votes_for(db, signature)] == [4]
+
+
+def test_underpaid_transfer_credits_nothing(smallie, client, db):
+    signature = uuid.uuid4().hex
+    # The browser asked for 50 votes but only paid for one
+    body, headers = solana_delivery(signature, "1", 50, lamports=VOTE_PRICE_LAMPORTS)
+    assert client.post("/api/webhooks/solana", data=body, headers=headers).status_code == 400
+    smallie.vote_ingestor.flush()
+    assert votes_for(db, signature) == []
+    assert not db.collection("payment_events").document(f"solana:{signature}").get().exists
+
+
+def test_unsigned_webhook_is_rejected(client):
+    body, headers = solana_delivery(uuid.uuid4().hex, "1", 5)
+    headers["x-smallie-signature"] = "0" * 64
+    assert client.post("/api/webhooks/solana", data=body, headers=headers).status_code == 401
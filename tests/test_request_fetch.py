@@ -0,0 +1,51 @@
+"""A read's circuit breaker recovers even when its probe never returns"""
+
+import time
+import threading
+
+from request_fetch import Fetcher
+
+
+def fetch(fetcher, fn, deadline=0.05):
+    started = fetcher.start(deadline=deadline)
+    started.submit("scores", fn, default="fallback")
+    return started.result("scores")
+
+
+def settles(breaker, state):
+    # Reads report to the breaker from the pool thread, just after their waiters return
+    deadline = time.monotonic() + 2
+    while breaker.state != state and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return breaker.state == state
+
+
+def test_hung_probe_reopens_the_breaker():
+    fetcher = Fetcher(max_workers=4, failure_threshold=1, reset_timeout=0.1)
+    breaker = fetcher.breaker("scores")
+    hung = threading.Event()
+
+    def fails():
+        raise RuntimeError("Firestore is unavailable")
+
+    try:
+        assert fetch(fetcher, fails) == "fallback"
+        assert settles(breaker, "open")
+
+        # The probe never returns
+        time.sleep(0.1)
+        assert fetch(fetcher, hung.wait) == "fallback"
+        assert breaker.state == "half_open"
+
+        # Past its deadline it is charged as a failure, which reopens the breaker
+        time.sleep(0.1)
+        assert fetch(fetcher, lambda: "scores") == "fallback"
+        assert breaker.state == "open"
+
+        # The next probe is a new read, and its success closes the breaker
+        time.sleep(0.1)
+        fetch(fetcher, lambda: "scores")
+        assert settles(breaker, "closed")
+        assert fetch(fetcher, lambda: "scores") == "scores"
+    finally:
+        hung.set()
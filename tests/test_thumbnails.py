@@ -0,0 +1,54 @@
+"""Contestant photos are resized from a local directory and cached for good"""
+
+import io
+import os
+
+import pytest
+
+from conftest import PHOTO_DIR
+
+Image = pytest.importorskip("PIL.Image")
+
+
+@pytest.fixture(scope="module")
+def photo(smallie):
+    # The first built-in contestant, whose photo is read from PHOTO_DIR by the last part of its URL
+    contestant = smallie.DEFAULT_CONTESTANTS[0]
+    buffer = io.BytesIO()
+    Image.new("RGB", (1200, 900), (200, 120, 40)).save(buffer, "JPEG")
+    with open(os.path.join(PHOTO_DIR, contestant["image_url"].rsplit("/", 1)[-1]), "wb") as f:
+        f.write(buffer.getvalue())
+    return contestant
+
+
+def test_serves_webp_at_the_requested_width(client, photo):
+    response = client.get(f"/img/{photo['id']}/320", headers={"Accept": "image/webp,image/*"})
+    assert response.status_code == 200
+    assert response.mimetype == "image/webp"
+    image = Image.open(io.BytesIO(response.get_data()))
+    assert image.format == "WEBP"
+    assert image.size == (320, 240)
+
+
+def test_versioned_url_is_immutable_and_revalidates(smallie, client, photo):
+    with smallie.app.test_request_context():
+        url = smallie.contestant_image_url(photo, 480)
+    response = client.get(url, headers={"Accept": "image/jpeg"})
+    assert response.status_code == 200
+    assert response.mimetype == "image/jpeg"
+    assert "immutable" in response.headers["Cache-Control"]
+    assert "Accept" in response.headers["Vary"]
+
+    again = client.get(url, headers={"Accept": "image/jpeg", "If-None-Match": response.headers["ETag"]})
+    assert again.status_code == 304
+
+
+def test_rejects_other_widths(client, photo):
+    assert client.get(f"/img/{photo['id']}/333").status_code == 404
+
+
+def test_links_the_original_when_it_cannot_be_resized(smallie):
+    contestant = {"id": 99, "image_url": "https://example.com/elsewhere.jpg"}
+    with smallie.app.test_request_context():
+        assert smallie.contestant_image_url(contestant) == contestant["image_url"]
+        assert smallie.contestant_image_srcset(contestant) == ""
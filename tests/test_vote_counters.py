@@ -0,0 +1,35 @@
+"""Shard seeding carries existing votes over once, and retries after a failure"""
+
+import pytest
+from google.api_core.exceptions import ServiceUnavailable
+
+import fake_firestore
+from vote_counters import ShardedVoteCounter
+
+
+def test_failed_seed_is_retried(db, monkeypatch):
+    db.collection("contestants").document("seed-1").set({"votes": 12})
+    counter = ShardedVoteCounter(lambda: db)
+    create = fake_firestore.DocumentReference.create
+
+    def unavailable(ref, data):
+        raise ServiceUnavailable("Firestore is unavailable")
+
+    monkeypatch.setattr(fake_firestore.DocumentReference, "create", unavailable)
+    with pytest.raises(ServiceUnavailable):
+        counter.increment("seed-1", 3)
+
+    monkeypatch.setattr(fake_firestore.DocumentReference, "create", create)
+    counter.increment("seed-1", 3)
+    assert counter.shard_state("seed-1") == (15, 12)
+
+
+def test_shards_seeded_by_another_worker_are_kept(db, monkeypatch):
+    counter = ShardedVoteCounter(lambda: db)
+
+    def seeded_elsewhere(ref, data):
+        raise fake_firestore.AlreadyExists(f"Document already exists: {ref.path}")
+
+    monkeypatch.setattr(fake_firestore.DocumentReference, "create", seeded_elsewhere)
+    counter.ensure_shards("seed-2")
+    assert "seed-2" in counter._initialized
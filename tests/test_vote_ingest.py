@@ -0,0 +1,33 @@
+"""Votes logged by a worker that dies mid-commit are counted exactly once"""
+
+import os
+
+from conftest import WORK_DIR
+from vote_counters import ShardedVoteCounter
+from vote_ingest import VoteIngestor
+
+
+def ingestor(db, wal_dir):
+    # A flusher that never wakes by itself, so the test decides when batches commit
+    return VoteIngestor(lambda: db, ShardedVoteCounter(lambda: db), wal_dir=wal_dir, flush_interval=3600)
+
+
+def test_batch_committed_before_a_crash_is_not_counted_again(db, monkeypatch):
+    wal_dir = os.path.join(WORK_DIR, "wal-crash")
+    crashed = ingestor(db, wal_dir)
+    survivor = ingestor(db, wal_dir)
+
+    crashed.submit({"contestantId": "crash-1", "count": 1})
+    crashed.submit({"contestantId": "crash-1", "count": 1})
+    survivor.submit({"contestantId": "crash-1", "count": 5})
+
+    # The batch commits, but the worker exits before logging that it did
+    monkeypatch.setattr(crashed, "_committed", lambda taken, votes, increments: True)
+    assert crashed.flush() == 2
+    crashed._wal.close()
+
+    survivor.drain()
+    assert survivor.stats()["pending"] == 0
+    total, _ = survivor.counter.shard_state("crash-1")
+    assert total == 7
+    survivor.stop()
@@ -0,0 +1,376 @@
+"""
+Resized contestant photos for Smallie
+
+Contestant photos are full-size originals on other hosts, several megabytes
+each, shown in cards a few hundred pixels wide. Thumbnailer fetches each
+original once, through a pluggable fetcher, and renders it at THUMBNAIL_WIDTHS
+as WebP and JPEG into a disk cache, from which /img/<contestant_id>/<width>
+serves them:
+
+    thumbnailer = Thumbnailer()
+    body = thumbnailer.get(image_url, 320, "webp")   # None: serve the original
+
+Rendering runs on a small per-process thread pool (THUMBNAIL_WORKERS), so a
+burst of first views cannot take every CPU; concurrent requests for the same
+photo wait on one render. A request that waits longer than
+THUMBNAIL_WAIT_SECONDS, or a photo that cannot be fetched or decoded, is
+answered with None and the caller falls back to the original URL. Failed
+photos are not retried for FAILURE_RETRY_SECONDS.
+
+DiskCache keeps originals and thumbnails in THUMBNAIL_CACHE_DIR, shared by the
+workers, as least-recently-used files: a hit touches the file's modification
+time, and once the directory grows past THUMBNAIL_CACHE_MAX_BYTES the oldest
+files are removed. Cache keys are derived from the photo URL, so a contestant
+whose photo changes gets new thumbnails and the old ones age out.
+
+Only photos on THUMBNAIL_SOURCE_HOSTS are fetched, since contestant photos
+come from application forms. Pillow is optional; without it every request
+falls back to the original.
+"""
+
+import io
+import os
+import time
+import hashlib
+import logging
+import threading
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+DEFAULT_WIDTHS = tuple(sorted(int(width) for width in os.environ.get("THUMBNAIL_WIDTHS", "320,480,640").split(",")))
+DEFAULT_CACHE_DIR = os.environ.get("THUMBNAIL_CACHE_DIR", "/tmp/smallie-thumbnails")
+DEFAULT_CACHE_MAX_BYTES = int(os.environ.get("THUMBNAIL_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+DEFAULT_WORKERS = int(os.environ.get("THUMBNAIL_WORKERS", "2"))
+DEFAULT_WAIT_SECONDS = float(os.environ.get("THUMBNAIL_WAIT_SECONDS", "5"))
+DEFAULT_SOURCE_HOSTS = tuple(
+    host.strip().lower()
+    for host in os.environ.get(
+        "THUMBNAIL_SOURCE_HOSTS", "images.unsplash.com,firebasestorage.googleapis.com,storage.googleapis.com"
+    ).split(",")
+    if host.strip()
+)
+
+FORMATS = {"webp": "image/webp", "jpeg": "image/jpeg"}
+QUALITY = {"webp": 80, "jpeg": 82}
+
+FETCH_TIMEOUT_SECONDS = 10.0
+MAX_SOURCE_BYTES = 20 * 1024 * 1024
+# Larger images are refused before being decoded
+MAX_SOURCE_PIXELS = 50_000_000
+FAILURE_RETRY_SECONDS = 300.0
+
+# Eviction removes files until the cache is this far below its limit, so it
+# does not run again on the next write
+EVICT_TO = 0.9
+
+
+class UrlFetcher:
+    """Fetches photos over HTTP(S) from a list of allowed hosts"""
+
+    def __init__(self, hosts=DEFAULT_SOURCE_HOSTS, timeout=FETCH_TIMEOUT_SECONDS, max_bytes=MAX_SOURCE_BYTES):
+        self.hosts = hosts
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+
+    def allows(self, url):
+        parsed = urllib.parse.urlsplit(url)
+        return parsed.scheme in ("http", "https") and (parsed.hostname or "").lower() in self.hosts
+
+    def __call__(self, url):
+        if not self.allows(url):
+            raise ValueError(f"{url} is not on an allowed photo host")
+        request = urllib.request.Request(url, headers={"User-Agent": "smallie-thumbnails"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            if not self.allows(response.geturl()):
+                raise ValueError(f"{url} redirected to {response.geturl()}")
+            data = response.read(self.max_bytes + 1)
+        if len(data) > self.max_bytes:
+            raise ValueError(f"{url} is larger than {self.max_bytes} bytes")
+        return data
+
+
+class DirectoryFetcher:
+    """Reads photos from a local directory by the last part of their URL's path, for tests and offline use"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def allows(self, url):
+        return os.path.isfile(self._path(url))
+
+    def __call__(self, url):
+        with open(self._path(url), "rb") as f:
+            return f.read()
+
+    def _path(self, url):
+        name = os.path.basename(urllib.parse.urlsplit(url).path)
+        return os.path.join(self.directory, name or "_")
+
+
+def source_fetcher():
+    """The fetcher configured by the environment: THUMBNAIL_SOURCE_DIR, else the allowed hosts"""
+    directory = os.environ.get("THUMBNAIL_SOURCE_DIR")
+    return DirectoryFetcher(directory) if directory else UrlFetcher()
+
+
+class DiskCache:
+    """Files by key in one directory, evicting the least recently used past a total size"""
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Bytes in the directory as last counted, plus this process's writes
+        self._size = None
+
+        # Counters exposed through stats()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+        # The parent may have held the lock while forking
+        os.register_at_fork(after_in_child=self._reset_lock)
+
+    def read(self, key):
+        """Return the bytes stored under key, or None"""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # The modification time orders files for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            # Never written, or evicted by another worker
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def write(self, key, data):
+        path = self._path(key)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temporary, "wb") as f:
+                f.write(data)
+            os.replace(temporary, path)
+        except OSError as e:
+            logging.error(f"Error writing {key} to the thumbnail cache: {e}")
+            return False
+        with self._lock:
+            if self._size is None:
+                self._size = self._count()
+            else:
+                self._size += len(data)
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+        return True
+
+    def evict(self):
+        """Remove the least recently used files until the cache is under its limit"""
+        with self._lock:
+            entries = []
+            try:
+                with os.scandir(self.directory) as scan:
+                    for entry in scan:
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+            except FileNotFoundError:
+                pass
+            total = sum(size for _, size, _ in entries)
+            target = self.max_bytes * EVICT_TO
+            removed = 0
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+                total -= size
+            self._size = total
+            self.evicted += removed
+        if removed:
+            logging.info(f"Evicted {removed} files from the thumbnail cache, {total} bytes left")
+        return removed
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evicted": self.evicted, "bytes": self._size}
+
+    def _count(self):
+        total = 0
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                try:
+                    total += entry.stat().st_size
+                except FileNotFoundError:
+                    pass
+        return total
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _reset_lock(self):
+        self._lock = threading.Lock()
+
+
+class Thumbnailer:
+    """Renders photos at fixed widths into a DiskCache on a bounded per-process pool"""
+
+    def __init__(self, fetcher=None, cache=None, widths=DEFAULT_WIDTHS, max_workers=DEFAULT_WORKERS,
+                 wait=DEFAULT_WAIT_SECONDS):
+        self.fetcher = fetcher if fetcher is not None else source_fetcher()
+        self.cache = cache if cache is not None else DiskCache()
+        self.widths = tuple(sorted(widths))
+        self.max_workers = max_workers
+        self.wait = wait
+
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._in_flight = {}
+        # url -> when its last render failed
+        self._failed = {}
+
+        # Counters exposed through stats()
+        self.rendered = 0
+        self.failed = 0
+        self.fallbacks = 0
+
+        os.register_at_fork(after_in_child=self._reset_lock)
+
+        if Image is None:
+            logging.warning("Pillow is not installed; contestant photos are served at full size")
+
+    @staticmethod
+    def version(url):
+        """Short digest of a photo URL, naming its cached files"""
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+
+    def key(self, url, width, image_format):
+        return f"{self.version(url)}-{width}.{image_format}"
+
+    def renders(self, url):
+        """Whether this photo can be resized here, so pages should link its thumbnails rather than the original"""
+        return Image is not None and self.fetcher.allows(url)
+
+    def get(self, url, width, image_format):
+        """Return the photo at `width` in `image_format`, rendering it if needed, or None"""
+        if width not in self.widths or image_format not in FORMATS:
+            raise ValueError(f"No {image_format} thumbnail {width} pixels wide")
+        key = self.key(url, width, image_format)
+        data = self.cache.read(key)
+        if data is not None:
+            return data
+        if not self.renders(url):
+            return self._fallback()
+
+        job = self._render_async(url)
+        if job is None:
+            return self._fallback()
+        try:
+            job.result(timeout=self.wait)
+        except TimeoutError:
+            logging.warning(f"Thumbnail of {url} not ready after {self.wait} s; serving the original")
+            return self._fallback()
+        except Exception:
+            # Logged once by _render
+            return self._fallback()
+        data = self.cache.read(key)
+        return data if data is not None else self._fallback()
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "in_flight": len(self._in_flight),
+                "rendered": self.rendered,
+                "failed": self.failed,
+                "fallbacks": self.fallbacks,
+            }
+        stats["cache"] = self.cache.stats()
+        return stats
+
+    def _render_async(self, url):
+        """Start or join the render of a photo; None while it is failing"""
+        with self._lock:
+            failed_at = self._failed.get(url)
+            if failed_at is not None:
+                if time.monotonic() - failed_at < FAILURE_RETRY_SECONDS:
+                    return None
+                del self._failed[url]
+            executor = self._ensure_executor()
+            job = self._in_flight.get(url)
+            if job is None:
+                job = self._in_flight[url] = executor.submit(self._render, url)
+                job.add_done_callback(lambda future: self._finished(url, future))
+            return job
+
+    def _finished(self, url, future):
+        with self._lock:
+            if self._in_flight.get(url) is future:
+                del self._in_flight[url]
+            if future.exception() is None:
+                self.rendered += 1
+            else:
+                self.failed += 1
+                self._failed[url] = time.monotonic()
+
+    def _render(self, url):
+        started = time.perf_counter()
+        source_key = f"{self.version(url)}.source"
+        try:
+            source = self.cache.read(source_key)
+            if source is None:
+                source = self.fetcher(url)
+                self.cache.write(source_key, source)
+
+            image = Image.open(io.BytesIO(source))
+            if image.width * image.height > MAX_SOURCE_PIXELS:
+                raise ValueError(f"{image.width}x{image.height} is too large to resize")
+            # Let JPEG decode at a reduced scale that still covers the largest width
+            largest = self.widths[-1]
+            image.draft("RGB", (largest, largest * image.height // max(image.width, 1)))
+            image = ImageOps.exif_transpose(image).convert("RGB")
+
+            # Largest first, each width resized from the one before
+            for width in reversed(self.widths):
+                if width < image.width:
+                    image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+                for image_format in FORMATS:
+                    buffer = io.BytesIO()
+                    image.save(buffer, image_format.upper(), quality=QUALITY[image_format], optimize=True)
+                    self.cache.write(self.key(url, width, image_format), buffer.getvalue())
+        except Exception as e:
+            logging.error(f"Error rendering thumbnails of {url}: {e}")
+            raise
+        logging.info(f"Rendered thumbnails of {url} in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    def _fallback(self):
+        with self._lock:
+            self.fallbacks += 1
+        return None
+
+    def _reset_lock(self):
+        self._lock = threading.Lock()
+
+    def _ensure_executor(self):
+        if self._pid != os.getpid():
+            # Threads do not survive fork(); start a fresh pool in the child
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="thumbnail")
+            self._in_flight = {}
+            self._pid = os.getpid()
+        return self._executor
@@ -0,0 +1,187 @@
+"""
+Sharded vote counters for Smallie
+
+Firestore throttles sustained writes to a single document, so each
+contestant's vote count is spread over several shard documents stored under
+contestants/{id}/vote_shards. Reads sum the shards and are cached briefly.
+The summed total is periodically written back to contestants/{id}.votes so
+templates and existing clients can keep reading that field.
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+
+from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists
+
+# Number of shards new increments are spread over. Raising it later is safe
+# because totals are summed over every shard document that exists.
+DEFAULT_SHARD_COUNT = int(os.environ.get("VOTE_COUNTER_SHARDS", "10"))
+
+# How long a summed total is served from memory before re-reading the shards
+DEFAULT_TOTAL_TTL_SECONDS = float(os.environ.get("VOTE_TOTAL_CACHE_TTL", "5"))
+
+# How often dirty totals are copied back onto the contestant documents
+DEFAULT_PUBLISH_INTERVAL_SECONDS = float(os.environ.get("VOTE_COUNTER_PUBLISH_INTERVAL", "5"))
+
+SHARD_COLLECTION = "vote_shards"
+
+
+class ShardedVoteCounter:
+    """Distributed vote counter with one shard set per contestant"""
+
+    def __init__(self, get_db, shard_count=DEFAULT_SHARD_COUNT, total_ttl=DEFAULT_TOTAL_TTL_SECONDS,
+                 publish_interval=DEFAULT_PUBLISH_INTERVAL_SECONDS, collection="contestants"):
+        if shard_count < 1:
+            raise ValueError("shard_count must be at least 1")
+        self._get_db = get_db
+        self.shard_count = shard_count
+        self.total_ttl = total_ttl
+        self.publish_interval = publish_interval
+        self.collection = collection
+
+        self._lock = threading.Lock()
+        self._totals = {}
+        self._initialized = set()
+        self._dirty = set()
+        self._publisher = None
+        self._stop_event = threading.Event()
+
+    @property
+    def db(self):
+        """This process's Firestore client, or None while it is unavailable"""
+        return self._get_db()
+
+    def increment(self, contestant_id, count=1, batch=None):
+        """Add votes to a randomly chosen shard
+
+        When a write batch is given the increment is added to it and the
+        caller must call record_committed() once the batch has committed.
+        """
+        contestant_id = str(contestant_id)
+        self.ensure_shards(contestant_id)
+
+        shard_ref = self._shards_ref(contestant_id).document(str(random.randrange(self.shard_count)))
+        update = {"count": firestore.Increment(count)}
+        if batch is not None:
+            batch.set(shard_ref, update, merge=True)
+            return
+        shard_ref.set(update, merge=True)
+        self.record_committed(contestant_id, count)
+
+    def record_committed(self, contestant_id, count):
+        """Account for an increment that has been written to a shard"""
+        contestant_id = str(contestant_id)
+        with self._lock:
+            # Keep this worker's view consistent with its own writes
+            if contestant_id in self._totals:
+                total, fetched_at = self._totals[contestant_id]
+                self._totals[contestant_id] = (total + count, fetched_at)
+            self._dirty.add(contestant_id)
+        self._ensure_publisher()
+
+    def total(self, contestant_id):
+        """Return the summed vote count for a contestant"""
+        contestant_id = str(contestant_id)
+        with self._lock:
+            cached = self._totals.get(contestant_id)
+            if cached is not None and (time.monotonic() - cached[1]) < self.total_ttl:
+                return cached[0]
+
+        total = sum((doc.to_dict() or {}).get("count", 0) for doc in self._shards_ref(contestant_id).get())
+        with self._lock:
+            self._totals[contestant_id] = (total, time.monotonic())
+        return total
+
+    def shard_state(self, contestant_id):
+        """Return (total, seeded) read from the shards, bypassing the cache
+
+        seeded is the count carried over from before sharding, or None when
+        the shards predate that being recorded or do not exist yet.
+        """
+        total = 0
+        seeded = None
+        for doc in self._shards_ref(str(contestant_id)).get():
+            data = doc.to_dict() or {}
+            total += data.get("count", 0)
+            if doc.id == "0" and "seeded" in data:
+                seeded = data["seeded"]
+        return total, seeded
+
+    def ensure_shards(self, contestant_id):
+        """Seed shard 0 from the contestant's existing votes field, once
+
+        Counts recorded before sharding was enabled live on the contestant
+        document; they are carried over so totals never go backwards. Errors
+        other than another worker seeding first propagate, and the next call
+        tries again.
+        """
+        contestant_id = str(contestant_id)
+        if contestant_id in self._initialized:
+            return
+
+        seed_ref = self._shards_ref(contestant_id).document("0")
+        if not seed_ref.get().exists:
+            contestant_doc = self.db.collection(self.collection).document(contestant_id).get()
+            existing_votes = (contestant_doc.to_dict() or {}).get("votes", 0) if contestant_doc.exists else 0
+            try:
+                # create() fails if another worker seeded the shard first; the
+                # seeded votes are kept apart so reconciliation knows the baseline
+                seed_ref.create({"count": existing_votes, "seeded": existing_votes})
+                logging.info(f"Seeded vote shards for contestant {contestant_id} with {existing_votes} votes")
+            except AlreadyExists:
+                logging.debug(f"Vote shards for contestant {contestant_id} were already seeded")
+
+        with self._lock:
+            self._initialized.add(contestant_id)
+
+    def invalidate(self, contestant_id=None):
+        """Forget cached totals for one contestant, or for all of them"""
+        with self._lock:
+            if contestant_id is None:
+                self._totals.clear()
+            else:
+                self._totals.pop(str(contestant_id), None)
+
+    def publish_dirty(self):
+        """Copy totals of recently incremented contestants onto their documents"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+
+        for contestant_id in dirty:
+            try:
+                self.invalidate(contestant_id)
+                self.db.collection(self.collection).document(contestant_id).update(
+                    {"votes": self.total(contestant_id)}
+                )
+            except Exception as e:
+                logging.error(f"Error publishing vote total for contestant {contestant_id}: {e}")
+                with self._lock:
+                    self._dirty.add(contestant_id)
+        return len(dirty)
+
+    def stop(self):
+        """Stop the background publisher after a final publish"""
+        self._stop_event.set()
+        if self._publisher is not None:
+            self._publisher.join(timeout=self.publish_interval + 1)
+        self.publish_dirty()
+
+    def _shards_ref(self, contestant_id):
+        return self.db.collection(self.collection).document(contestant_id).collection(SHARD_COLLECTION)
+
+    def _ensure_publisher(self):
+        # Started on first use so it runs inside the serving worker process
+        with self._lock:
+            if self._publisher is not None and self._publisher.is_alive():
+                return
+            self._stop_event.clear()
+            self._publisher = threading.Thread(target=self._publish_loop, name="vote-counter-publisher", daemon=True)
+            self._publisher.start()
+
+    def _publish_loop(self):
+        while not self._stop_event.wait(self.publish_interval):
+            self.publish_dirty()
@@ -0,0 +1,452 @@
+"""
+Server-side vote ingestion for Smallie
+
+Votes posted to /api/votes are appended to a local write-ahead log and
+acknowledged straight away. A background flusher group-commits them to
+Firestore in write batches of at most 500 operations, merging the vote
+counter increments for each contestant inside a batch. Votes stay in the log
+until their batch commits, so a Firestore outage only delays them. The votes
+and payments themselves are written through a ledger repository, the
+Firestore batch by default or PostgreSQL (see repositories.py).
+
+Each worker owns its own log file, locked with flock. On start-up a worker
+adopts the logs of workers that have exited and re-queues their uncommitted
+votes.
+
+Counter, rollup and tally increments are not idempotent, so each batch is
+committed at most once: its votes are recorded in the log under a batch id
+before the first attempt, and the Firestore batch creates a marker document
+vote_batches/{batch id}. A batch is only retried with exactly the same votes;
+a retry, whether after a commit that timed out or after a crash before the
+log's commit record, first looks for the marker and, finding it, treats the
+batch as committed. Markers carry an expireAt time for a Firestore TTL policy.
+"""
+
+import os
+import json
+import time
+import uuid
+import fcntl
+import logging
+import datetime
+import threading
+from collections import deque
+
+from firebase_admin import firestore
+
+# Firestore rejects write batches with more than 500 operations
+MAX_BATCH_OPERATIONS = 500
+
+# Price of a single vote in USD, as charged by the payment modal
+VOTE_PRICE_USD = 0.5
+
+# Upper bound on votes in a single submission
+MAX_VOTES_PER_SUBMISSION = 1000
+
+# Upper bound on votes in one batch, for ledgers that add few Firestore operations
+MAX_BATCH_VOTES = 5000
+
+# Marker documents of committed batches, and how long they must be kept
+BATCH_COLLECTION = "vote_batches"
+BATCH_MARKER_TTL = datetime.timedelta(days=7)
+
+DEFAULT_WAL_DIR = os.environ.get("VOTE_WAL_DIR", "/tmp/smallie-vote-wal")
+DEFAULT_FLUSH_INTERVAL_SECONDS = float(os.environ.get("VOTE_FLUSH_INTERVAL", "0.5"))
+DEFAULT_WAL_FSYNC = os.environ.get("VOTE_WAL_FSYNC", "1") != "0"
+
+# Retry delays after a failed commit, doubling up to the maximum
+RETRY_BASE_SECONDS = 1.0
+RETRY_MAX_SECONDS = 30.0
+
+
+def parse_vote(data):
+    """Validate a vote submission and return the normalized vote record
+
+    Raises ValueError describing the first invalid field.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Vote must be a JSON object")
+
+    contestant_id = data.get("contestantId")
+    if contestant_id is None or str(contestant_id).strip() == "":
+        raise ValueError("contestantId is required")
+
+    try:
+        count = int(data.get("count", 1))
+    except (TypeError, ValueError):
+        raise ValueError("count must be an integer")
+    if not 1 <= count <= MAX_VOTES_PER_SUBMISSION:
+        raise ValueError(f"count must be between 1 and {MAX_VOTES_PER_SUBMISSION}")
+
+    # The competition day is decided on the server from when the vote arrived;
+    # a day sent by the client is ignored
+    return {
+        "contestantId": str(contestant_id).strip(),
+        "count": count,
+        "email": str(data.get("email") or ""),
+        "day": None,
+        "paymentMethod": data.get("paymentMethod") or None,
+        "transactionId": data.get("transactionId") or None,
+    }
+
+
+class VoteIngestor:
+    """Write-ahead logged, group-committing vote writer"""
+
+    def __init__(self, get_db, counter, wal_dir=DEFAULT_WAL_DIR, flush_interval=DEFAULT_FLUSH_INTERVAL_SECONDS,
+                 fsync=DEFAULT_WAL_FSYNC, max_batch_operations=MAX_BATCH_OPERATIONS, day_resolver=None,
+                 ledger=None):
+        self._get_db = get_db
+        self.counter = counter
+        if ledger is None:
+            from repositories import FirestoreRepository
+            ledger = FirestoreRepository(get_db)
+        # Repository the votes and payments are written through
+        self.ledger = ledger
+        # Maps a UNIX timestamp to the competition day a vote received then counts towards
+        self.day_resolver = day_resolver
+        self.wal_dir = wal_dir
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.max_batch_operations = max_batch_operations
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._pending = deque()
+        self._wal = None
+        self._wal_path = None
+        self._flusher = None
+        self._pid = None
+        self._retry_delay = 0.0
+        self._hooks = []
+        # Batches that may have committed without this worker knowing
+        self._attempted = set()
+
+        # Counters exposed through stats()
+        self.accepted = 0
+        self.committed = 0
+        self.batches = 0
+        self.failed_commits = 0
+        self.dropped = 0
+
+    @property
+    def db(self):
+        """This process's Firestore client, or None while it is unavailable"""
+        return self._get_db()
+
+    def submit(self, data, idempotency_key=None):
+        """Log a vote and queue it for the next batch, returning the vote record
+
+        idempotency_key identifies the payment behind the vote, for hooks that
+        make sure each payment is counted once.
+        """
+        vote = parse_vote(data)
+        vote["id"] = uuid.uuid4().hex
+        if idempotency_key is not None:
+            vote["idempotencyKey"] = idempotency_key
+        vote["received_at"] = time.time()
+        if self.day_resolver is not None:
+            vote["day"] = self.day_resolver(vote["received_at"])
+
+        self.start()
+        with self._lock:
+            self._append({"op": "vote", "vote": vote})
+            self._pending.append(vote)
+            self.accepted += 1
+            queued = len(self._pending)
+
+        # Wake the flusher early once a full batch is waiting
+        if queued * 3 >= self.max_batch_operations:
+            self._wake.set()
+        return vote
+
+    def add_hook(self, hook):
+        """Register an object that takes part in every batch commit
+
+        Hooks may define any of:
+          vote_fields          extra fields stamped onto each votes document
+          filter_batch(votes)  return the votes that should be written; the
+                               rest are dropped from the log unwritten
+          batch_keys(vote)     keys of the documents the hook writes for a
+                               vote; each distinct key costs one operation
+          extend_batch(batch, votes)  add writes to the batch before commit
+          on_commit(votes)     called after the batch has committed
+        """
+        self._hooks.append(hook)
+
+    def start(self):
+        """Open this worker's log, adopt orphaned logs and start the flusher"""
+        if self._pid == os.getpid() and self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # Never share a log or a thread inherited across fork()
+                self._wal = None
+                self._pending.clear()
+                self._attempted.clear()
+                self._open_wal()
+                self._adopt_orphans()
+                self._pid = os.getpid()
+            if self._flusher is None or not self._flusher.is_alive():
+                self._stop_event.clear()
+                self._flusher = threading.Thread(target=self._flush_loop, name="vote-flusher", daemon=True)
+                self._flusher.start()
+
+    def stop(self, timeout=10.0):
+        """Stop the flusher after trying to commit everything still queued"""
+        self._stop_event.set()
+        self._wake.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=timeout)
+
+    def drain(self):
+        """Adopt the logs of exited workers now, then flush()
+
+        Returns the number of votes committed.
+        """
+        self.start()
+        # Adopted batches go to the front of the queue, which must not move
+        # under a commit in progress
+        with self._flush_lock, self._lock:
+            self._adopt_orphans()
+        return self.flush()
+
+    def flush(self):
+        """Commit queued votes until the queue is empty or a commit fails
+
+        Returns the number of votes committed.
+        """
+        total = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch_votes = self._take_batch()
+                if not batch_votes or not self._commit(batch_votes):
+                    return total
+                total += len(batch_votes)
+
+    def stats(self):
+        """Return ingestion counters and the current backlog"""
+        with self._lock:
+            return {
+                "accepted": self.accepted,
+                "committed": self.committed,
+                "pending": len(self._pending),
+                "batches": self.batches,
+                "failed_commits": self.failed_commits,
+                "dropped": self.dropped,
+                "votes_per_batch": (self.committed / self.batches) if self.batches else 0.0,
+            }
+
+    def _take_batch(self):
+        # A batch already given an id is retried with exactly the same votes,
+        # which are always at the front of the queue
+        if self._pending and self._pending[0].get("batch"):
+            batch_id = self._pending[0]["batch"]
+            votes = []
+            for vote in self._pending:
+                if vote.get("batch") != batch_id:
+                    break
+                votes.append(vote)
+            return votes
+
+        # Greedily take queued votes while the batch stays within the limit.
+        # A Firestore ledger writes each vote's own votes document, plus a
+        # payments document when it was paid for. Shared documents such as a
+        # contestant's shard increment cost one operation per batch however
+        # many votes touch them, and the batch marker costs one.
+        votes = []
+        keys = set()
+        operations = 1
+        for vote in self._pending:
+            if len(votes) >= MAX_BATCH_VOTES or vote.get("batch"):
+                # A vote already in a batch is only ever committed with it
+                break
+            vote_keys = {("shard", vote["contestantId"])}
+            for hook in self._hooks:
+                if hasattr(hook, "batch_keys"):
+                    vote_keys.update(hook.batch_keys(vote))
+            new_keys = vote_keys - keys
+            cost = self.ledger.batch_operations(vote) + len(new_keys)
+            if votes and operations + cost > self.max_batch_operations:
+                break
+            votes.append(vote)
+            keys |= new_keys
+            operations += cost
+
+        if votes:
+            batch_id = uuid.uuid4().hex
+            for vote in votes:
+                vote["batch"] = batch_id
+            self._append({"op": "batch", "id": batch_id, "ids": [vote["id"] for vote in votes]})
+        return votes
+
+    def _commit(self, taken):
+        batch_id = taken[0]["batch"]
+        marker_ref = self.db.collection(BATCH_COLLECTION).document(batch_id)
+        try:
+            if batch_id in self._attempted:
+                marker = marker_ref.get()
+                if marker.exists:
+                    return self._already_committed(taken, marker.to_dict() or {})
+
+            # Hooks may drop votes that must not be written, such as replayed payments
+            votes = taken
+            for hook in self._hooks:
+                if hasattr(hook, "filter_batch"):
+                    votes = hook.filter_batch(votes)
+        except Exception as e:
+            return self._commit_failed(taken, e)
+
+        batch = self.db.batch()
+        vote_fields = {}
+        for hook in self._hooks:
+            vote_fields.update(getattr(hook, "vote_fields", {}))
+        increments = {}
+
+        def commit(added):
+            # Only the votes the ledger added are counted; a ledger outside
+            # Firestore calls this inside its own transaction, which is rolled
+            # back if the Firestore batch fails
+            increments.update(added)
+            for contestant_id, count in added.items():
+                self.counter.increment(contestant_id, count, batch=batch)
+            for hook in self._hooks:
+                if hasattr(hook, "extend_batch"):
+                    hook.extend_batch(batch, votes)
+            batch.create(marker_ref, {
+                "ids": [vote["id"] for vote in votes],
+                "increments": added,
+                "committedAt": firestore.SERVER_TIMESTAMP,
+                "expireAt": datetime.datetime.now(datetime.timezone.utc) + BATCH_MARKER_TTL,
+            })
+            batch.commit()
+
+        try:
+            self.ledger.write_votes(votes, batch=batch, vote_fields=vote_fields, then=commit)
+        except Exception as e:
+            # Timed out or not, the batch may have been applied
+            self._attempted.add(batch_id)
+            return self._commit_failed(taken, e)
+        return self._committed(taken, votes, increments)
+
+    def _already_committed(self, taken, marker):
+        # An earlier attempt committed the Firestore batch; make sure the
+        # ledger has the votes too, then finish as that attempt would have
+        committed_ids = set(marker.get("ids", []))
+        votes = [vote for vote in taken if vote["id"] in committed_ids]
+        self.ledger.ensure_votes(votes)
+        logging.warning(f"Batch {taken[0]['batch']} of {len(votes)} votes was already committed")
+        return self._committed(taken, votes, marker.get("increments", {}))
+
+    def _committed(self, taken, votes, increments):
+        self._attempted.discard(taken[0]["batch"])
+        self._retry_delay = 0.0
+        for contestant_id, count in increments.items():
+            self.counter.record_committed(contestant_id, count)
+        for hook in self._hooks:
+            if hasattr(hook, "on_commit"):
+                try:
+                    hook.on_commit(votes)
+                except Exception as e:
+                    logging.error(f"Error in vote commit hook {type(hook).__name__}: {e}")
+
+        with self._lock:
+            # Committed votes are always the oldest ones in the queue
+            for _ in taken:
+                self._pending.popleft()
+            self.committed += len(votes)
+            self.dropped += len(taken) - len(votes)
+            self.batches += 1
+            if self._pending:
+                self._append({"op": "commit", "ids": [vote["id"] for vote in taken]})
+            else:
+                # Nothing outstanding, so the log can start over
+                self._wal.seek(0)
+                self._wal.truncate()
+        logging.debug(f"Committed {len(votes)} votes for {len(increments)} contestants in one batch")
+        return True
+
+    def _commit_failed(self, votes, error):
+        with self._lock:
+            self.failed_commits += 1
+        self._retry_delay = min(max(self._retry_delay * 2, RETRY_BASE_SECONDS), RETRY_MAX_SECONDS)
+        logging.error(f"Error committing {len(votes)} votes, retrying in {self._retry_delay:.0f}s: {error}")
+        return False
+
+    def _flush_loop(self):
+        while not self._stop_event.is_set():
+            self._wake.wait(self._retry_delay or self.flush_interval)
+            self._wake.clear()
+            self.flush()
+        self.flush()
+
+    def _append(self, record):
+        self._wal.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._wal.flush()
+        if self.fsync:
+            os.fsync(self._wal.fileno())
+
+    def _open_wal(self):
+        os.makedirs(self.wal_dir, exist_ok=True)
+        self._wal_path = os.path.join(self.wal_dir, f"votes-{os.getpid()}-{uuid.uuid4().hex[:8]}.wal")
+        self._wal = open(self._wal_path, "a+", encoding="utf-8")
+        fcntl.flock(self._wal.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _adopt_orphans(self):
+        # A log whose lock can be taken belongs to a worker that has exited
+        for name in sorted(os.listdir(self.wal_dir)):
+            path = os.path.join(self.wal_dir, name)
+            if not name.endswith(".wal") or path == self._wal_path:
+                continue
+            try:
+                with open(path, "r+", encoding="utf-8") as orphan:
+                    try:
+                        fcntl.flock(orphan.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        continue
+                    votes = read_uncommitted(orphan)
+                    batches = {}
+                    for vote in votes:
+                        self._append({"op": "vote", "vote": vote})
+                        if vote.get("batch"):
+                            # The exited worker may have committed it before crashing
+                            batches.setdefault(vote["batch"], []).append(vote)
+                            self._attempted.add(vote["batch"])
+                        else:
+                            self._pending.append(vote)
+                    # Each old batch is retried whole under its own id, and so
+                    # its marker, ahead of any votes not yet batched
+                    for batch_votes in reversed(list(batches.values())):
+                        self._pending.extendleft(reversed(batch_votes))
+                    os.unlink(path)
+                if votes:
+                    logging.warning(f"Recovered {len(votes)} uncommitted votes from {name}")
+            except Exception as e:
+                logging.error(f"Error recovering vote log {name}: {e}")
+
+
+def read_uncommitted(wal_file):
+    """Return the votes in a log that have no matching commit record
+
+    Votes that were put in a batch carry its id under "batch".
+    """
+    votes = {}
+    for line in wal_file:
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            # A torn final line from a crash mid-write
+            continue
+        if record.get("op") == "vote":
+            votes[record["vote"]["id"]] = record["vote"]
+        elif record.get("op") == "batch":
+            for vote_id in record.get("ids", []):
+                if vote_id in votes:
+                    votes[vote_id]["batch"] = record["id"]
+        elif record.get("op") == "commit":
+            for vote_id in record.get("ids", []):
+                votes.pop(vote_id, None)
+    return list(votes.values())
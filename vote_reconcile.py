@@ -0,0 +1,316 @@
+"""
+Incremental vote-count reconciliation for Smallie
+
+Checks each contestant's vote counters against the votes ledger:
+
+    expected   = votes seeded into the shards before sharding + votes in the ledger
+    counter    = sum of contestants/{id}/vote_shards, which expected should equal
+    published  = contestants/{id}.votes, the copy the site reads
+
+Live votes update the ledger and the shards in one batch, but admin edits,
+failed publishes and writes from outside the ingestion path make them drift.
+
+The ledger is walked in (committedAt, id) order from the checkpoint in
+stats/_reconcile, which also holds each contestant's running ledger sum, so
+a run reads only the votes committed since the previous one. committedAt is
+the server timestamp of the batch that stored the vote; its receipt time
+will not do, since a vote can be committed minutes after it was received,
+behind a checkpoint that has already moved on. Votes committed within
+RECONCILE_LAG_SECONDS are summed on every run but not checkpointed; `run
+--full` starts over from the first vote. Votes stored before committedAt
+was written are given one by `stamp`, and folded in by the next run. Shards are read before and after the
+ledger tail, and a contestant whose counter moved in between is reported as
+busy rather than drifted.
+
+Repairs add the difference to the counter, then publish the total onto the
+contestant. A repair that would lower a counter is only made with
+--allow-decrease, since votes missing from the walk look just like an
+inflated counter. Contestants whose shards predate the seeded baseline being
+recorded are reported but never repaired, since their expected total is not
+known. Run one reconciler at a time. The ledger is read from Firestore, so
+runs are refused while VOTE_LEDGER keeps the votes in PostgreSQL, where an
+empty votes collection would look like every counter had drifted.
+
+Usage:
+    python vote_reconcile.py run [--repair [--allow-decrease]] [--full] [--every SECONDS]
+    python vote_reconcile.py stamp
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import datetime
+
+from firebase_admin import firestore
+
+from vote_counters import ShardedVoteCounter
+from vote_rollups import STATS_COLLECTION
+from repositories import LedgerElsewhere, require_firestore_ledger
+
+CHECKPOINT_DOC = "_reconcile"
+
+# Commit time of each vote, set by the batch that stores it
+COMMIT_FIELD = "committedAt"
+
+# Votes younger than this are summed on each run but never checkpointed
+DEFAULT_LAG_SECONDS = float(os.environ.get("RECONCILE_LAG_SECONDS", "900"))
+
+DEFAULT_PAGE_SIZE = 500
+
+# Attempts at reading a consistent counter for contestants receiving votes
+SETTLE_ATTEMPTS = 3
+
+
+class VoteReconciler:
+    """Checkpointed comparison of vote counters with the votes ledger"""
+
+    def __init__(self, get_db, counter=None, lag=DEFAULT_LAG_SECONDS, page_size=DEFAULT_PAGE_SIZE,
+                 collection="contestants", votes_collection="votes"):
+        self._get_db = get_db
+        self.counter = counter if counter is not None else ShardedVoteCounter(get_db, collection=collection)
+        self.lag = lag
+        self.page_size = page_size
+        self.collection = collection
+        self.votes_collection = votes_collection
+
+    @property
+    def db(self):
+        """This process's Firestore client, or None while it is unavailable"""
+        return self._get_db()
+
+    def run(self, repair=False, full=False, now=None, allow_decrease=False):
+        """Fold new votes into the checkpoint, then compare and optionally repair
+
+        Counters above their expected total are only lowered with
+        allow_decrease. Returns a report with the votes scanned and one
+        entry per contestant.
+        Raises repositories.LedgerElsewhere while VOTE_LEDGER keeps the votes
+        outside Firestore.
+        """
+        require_firestore_ledger("Vote reconciliation")
+        started = time.monotonic()
+        if now is None:
+            now = time.time()
+        cutoff = datetime.datetime.fromtimestamp(now - self.lag, datetime.timezone.utc)
+
+        checkpoint_ref = self.db.collection(STATS_COLLECTION).document(CHECKPOINT_DOC)
+        checkpoint = {}
+        if full:
+            checkpoint_ref.set({"sums": {}, "processed": 0})
+        else:
+            checkpoint_doc = checkpoint_ref.get()
+            checkpoint = checkpoint_doc.to_dict() if checkpoint_doc.exists else {}
+            if "last_timestamp" in checkpoint:
+                # Saved while the ledger was walked by receipt time
+                logging.info("Reconciliation checkpoint predates commit times; starting over")
+                checkpoint = {}
+                checkpoint_ref.set({"sums": {}, "processed": 0})
+        sums = dict(checkpoint.get("sums", {}))
+        processed = checkpoint.get("processed", 0)
+        scanned = self._fold(checkpoint_ref, checkpoint, sums, cutoff)
+
+        contestants = {doc.id: doc.to_dict() or {} for doc in self.db.collection(self.collection).stream()}
+        entries = self._compare(contestants, sums, cutoff)
+        if repair:
+            for entry in entries:
+                if entry["status"] == "drift" and entry["expected"] < entry["counter"] and not allow_decrease:
+                    entry["held"] = True
+                elif entry["status"] == "drift":
+                    self._repair(entry)
+                elif entry["status"] == "unpublished":
+                    self._publish(entry)
+
+        report = {
+            "scanned": scanned,
+            "processed": processed + scanned,
+            "checkpoint": cutoff.isoformat(),
+            "seconds": round(time.monotonic() - started, 3),
+            "drifted": sum(1 for entry in entries if entry["status"] in ("drift", "unpublished")),
+            "repaired": sum(1 for entry in entries if entry.get("repaired")),
+            "held": sum(1 for entry in entries if entry.get("held")),
+            "contestants": entries,
+        }
+        checkpoint_ref.set({
+            "last_report": {key: value for key, value in report.items() if key != "contestants"},
+            "updated_at": firestore.SERVER_TIMESTAMP,
+        }, merge=True)
+        for entry in entries:
+            if entry["status"] in ("drift", "unpublished"):
+                logging.warning(
+                    f"Vote drift for contestant {entry['contestantId']}: expected {entry['expected']}, "
+                    f"counter {entry['counter']}, published {entry['published']}"
+                    + (" (repaired)" if entry.get("repaired") else "")
+                    + (" (not lowered without --allow-decrease)" if entry.get("held") else "")
+                )
+        logging.info(f"Reconciled votes: {scanned} new votes scanned, {report['drifted']} contestants drifted")
+        return report
+
+    def _fold(self, checkpoint_ref, checkpoint, sums, cutoff):
+        # Add every vote between the checkpoint and the cutoff to the running
+        # sums, saving the checkpoint after each page so a run can be resumed
+        votes_ref = self.db.collection(self.votes_collection)
+        last_committed = checkpoint.get("last_committed_at")
+        last_id = checkpoint.get("last_vote_id")
+        processed = checkpoint.get("processed", 0)
+        scanned = 0
+        while True:
+            query = votes_ref.where(COMMIT_FIELD, "<", cutoff).order_by(COMMIT_FIELD).order_by("__name__")
+            if last_committed is not None:
+                query = query.start_after({COMMIT_FIELD: last_committed, "__name__": votes_ref.document(last_id)})
+            page = list(query.limit(self.page_size).stream())
+            if not page:
+                return scanned
+
+            for doc in page:
+                vote = doc.to_dict() or {}
+                contestant_id = str(vote.get("contestantId", ""))
+                sums[contestant_id] = sums.get(contestant_id, 0) + (vote.get("count") or 1)
+            last_committed = (page[-1].to_dict() or {}).get(COMMIT_FIELD)
+            last_id = page[-1].id
+            scanned += len(page)
+            # Replaced whole, so contestants dropped from the sums do not linger
+            checkpoint_ref.set({
+                "last_committed_at": last_committed,
+                "last_vote_id": last_id,
+                "processed": processed + scanned,
+                "sums": sums,
+            })
+
+    def _tail(self, cutoff):
+        tail = {}
+        for doc in self.db.collection(self.votes_collection).where(COMMIT_FIELD, ">=", cutoff).stream():
+            vote = doc.to_dict() or {}
+            contestant_id = str(vote.get("contestantId", ""))
+            tail[contestant_id] = tail.get(contestant_id, 0) + (vote.get("count") or 1)
+        return tail
+
+    def stamp(self):
+        """Give votes stored without a commit time the current one; returns how many
+
+        A one-off for votes written before committedAt was. The next run
+        folds them in, as votes committed since its checkpoint.
+        """
+        votes_ref = self.db.collection(self.votes_collection)
+        stamped = 0
+        cursor = None
+        while True:
+            query = votes_ref.order_by("__name__").limit(self.page_size)
+            if cursor is not None:
+                query = query.start_after(cursor)
+            page = list(query.stream())
+            if not page:
+                return stamped
+            batch = self.db.batch()
+            unstamped = [doc for doc in page if COMMIT_FIELD not in (doc.to_dict() or {})]
+            for doc in unstamped:
+                batch.update(doc.reference, {COMMIT_FIELD: firestore.SERVER_TIMESTAMP})
+            if unstamped:
+                batch.commit()
+            stamped += len(unstamped)
+            cursor = page[-1]
+
+    def _compare(self, contestants, sums, cutoff):
+        contestant_ids = sorted(set(contestants) | {cid for cid in sums if cid})
+        pending = set(contestant_ids)
+        settled = {}
+        tail = {}
+        for _ in range(SETTLE_ATTEMPTS):
+            # A vote batch updates the ledger and the shards together; a counter
+            # unchanged across the ledger read is consistent with it
+            before = {cid: self.counter.shard_state(cid) for cid in pending}
+            tail = self._tail(cutoff)
+            after = {cid: self.counter.shard_state(cid) for cid in pending}
+            for cid in list(pending):
+                if before[cid][0] == after[cid][0]:
+                    settled[cid] = (after[cid], tail.get(cid, 0))
+                    pending.discard(cid)
+            if not pending:
+                break
+
+        entries = []
+        for cid in contestant_ids:
+            published = contestants.get(cid, {}).get("votes")
+            ledger = sums.get(cid, 0)
+            entry = {"contestantId": cid, "ledger": ledger, "published": published}
+            if cid not in settled:
+                entry.update(status="busy", counter=None, expected=None)
+                entries.append(entry)
+                continue
+            (counter, seeded), recent = settled[cid]
+            entry["ledger"] = ledger + recent
+            entry["counter"] = counter
+            if seeded is None:
+                # No shards yet, or shards seeded before the baseline was kept
+                entry.update(status="unknown" if counter else "unsharded", expected=None)
+            else:
+                entry["expected"] = seeded + entry["ledger"]
+                if counter != entry["expected"]:
+                    entry["status"] = "drift"
+                elif published != counter:
+                    entry["status"] = "unpublished"
+                else:
+                    entry["status"] = "ok"
+            entries.append(entry)
+        return entries
+
+    def _repair(self, entry):
+        batch = self.db.batch()
+        self.counter.increment(entry["contestantId"], entry["expected"] - entry["counter"], batch=batch)
+        batch.commit()
+        self._publish(entry)
+
+    def _publish(self, entry):
+        self.counter.invalidate(entry["contestantId"])
+        total = self.counter.total(entry["contestantId"])
+        self.db.collection(self.collection).document(entry["contestantId"]).update({"votes": total})
+        entry["repaired"] = True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconcile Smallie vote counters with the votes ledger")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="Check counters against the ledger")
+    run_parser.add_argument("--repair", action="store_true", help="Correct drifted counters and published totals")
+    run_parser.add_argument("--allow-decrease", action="store_true",
+                            help="Also lower counters that are above the ledger's total")
+    run_parser.add_argument("--full", action="store_true", help="Ignore the checkpoint and scan every vote")
+    run_parser.add_argument("--every", type=float, default=None, help="Keep running every SECONDS")
+    run_parser.add_argument("--lag", type=float, default=DEFAULT_LAG_SECONDS)
+    subparsers.add_parser("stamp", help="Give votes stored before commit times were kept one")
+    args = parser.parse_args(argv)
+
+    try:
+        require_firestore_ledger("Vote reconciliation")
+    except LedgerElsewhere as e:
+        print(f"Error: {e}")
+        return 1
+
+    from firebase_client import get_db
+    db = get_db()
+    if db is None:
+        print("Error: Firebase is not configured")
+        return 1
+
+    if args.command == "stamp":
+        stamped = VoteReconciler(get_db).stamp()
+        print(f"Stamped {stamped} votes with a commit time")
+        return 0
+
+    reconciler = VoteReconciler(get_db, lag=args.lag)
+    full = args.full
+    while True:
+        report = reconciler.run(repair=args.repair, full=full, allow_decrease=args.allow_decrease)
+        print(json.dumps(report, default=str))
+        if args.every is None:
+            # Drift left unrepaired, including counters held back from being lowered
+            return 1 if report["drifted"] > report["repaired"] else 0
+        full = False
+        time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
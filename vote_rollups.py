@@ -0,0 +1,267 @@
+"""
+Incremental vote rollups for Smallie
+
+Keeps aggregate documents in the stats collection up to date as votes are
+ingested, so admin dashboards read a handful of documents instead of the
+whole votes collection:
+
+    stats/global            votes and revenue since the competition began
+    stats/day_YYYY-MM-DD    votes and revenue for one WAT calendar day, with
+                            per-contestant counts and hourly buckets as maps
+
+Live votes are rolled up inside the same write batch that stores them and are
+stamped with rolled_up=True. Votes written before rollups existed are folded
+in by a checkpointed backfill that skips stamped votes, so no vote is counted
+twice.
+
+Usage:
+    python vote_rollups.py backfill [--page-size 400] [--max-pages N]
+"""
+
+import sys
+import time
+import logging
+import argparse
+import datetime
+import threading
+
+from firebase_admin import firestore
+
+from vote_ingest import VOTE_PRICE_USD
+from repositories import LedgerElsewhere, require_firestore_ledger
+
+# Nigeria observes West Africa Time all year round, with no daylight saving
+WAT = datetime.timezone(datetime.timedelta(hours=1), "WAT")
+
+STATS_COLLECTION = "stats"
+GLOBAL_DOC = "global"
+BACKFILL_DOC = "_backfill"
+
+# Rollup reads are cached briefly so dashboards polling together share them
+DEFAULT_STATS_TTL_SECONDS = 5.0
+
+# Most days a single stats response may cover
+MAX_STATS_DAYS = 31
+
+
+def day_doc_id(date):
+    """Return the stats document id for a WAT calendar date"""
+    return f"day_{date.isoformat()}"
+
+
+def to_wat(moment):
+    """Convert an aware datetime, or a UNIX timestamp, to WAT"""
+    if isinstance(moment, (int, float)):
+        return datetime.datetime.fromtimestamp(moment, WAT)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return moment.astimezone(WAT)
+
+
+class VoteRollups:
+    """Maintains and serves aggregate vote statistics"""
+
+    # Stamped onto every votes document written by the ingestion path
+    vote_fields = {"rolled_up": True}
+
+    def __init__(self, get_db, collection=STATS_COLLECTION, stats_ttl=DEFAULT_STATS_TTL_SECONDS):
+        self._get_db = get_db
+        self.collection = collection
+        self.stats_ttl = stats_ttl
+
+        self._lock = threading.Lock()
+        self._cache = {}
+
+    @property
+    def db(self):
+        """This process's Firestore client, or None while it is unavailable"""
+        return self._get_db()
+
+    def batch_keys(self, vote):
+        """Stats documents a live vote contributes to"""
+        return {("rollup", GLOBAL_DOC), ("rollup", day_doc_id(to_wat(vote["received_at"]).date()))}
+
+    def extend_batch(self, batch, votes):
+        """Add rollup increments for freshly ingested votes to a write batch"""
+        self._add_increments(batch, [
+            (vote["contestantId"], vote["count"], to_wat(vote["received_at"])) for vote in votes
+        ])
+
+    def on_commit(self, votes):
+        # Let the next dashboard read see the new totals
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self, date=None, days=7):
+        """Return global totals, one day's breakdown and recent daily totals
+
+        Reads at most days + 1 documents in a single round-trip regardless of
+        how many votes have been cast.
+        """
+        if date is None:
+            date = datetime.datetime.now(WAT).date()
+        days = max(1, min(int(days), MAX_STATS_DAYS))
+
+        cache_key = (date, days)
+        with self._lock:
+            cached = self._cache.get(cache_key)
+            if cached is not None and (time.monotonic() - cached[1]) < self.stats_ttl:
+                return cached[0]
+
+        dates = [date - datetime.timedelta(days=offset) for offset in range(days - 1, -1, -1)]
+        stats_ref = self.db.collection(self.collection)
+        refs = [stats_ref.document(GLOBAL_DOC)] + [stats_ref.document(day_doc_id(d)) for d in dates]
+        docs = {doc.id: (doc.to_dict() or {}) if doc.exists else {} for doc in self.db.get_all(refs)}
+
+        totals = docs.get(GLOBAL_DOC, {})
+        today = docs.get(day_doc_id(date), {})
+        result = {
+            "totals": {
+                "votes": totals.get("votes", 0),
+                "revenue": totals.get("revenue", 0),
+            },
+            "day": {
+                "date": date.isoformat(),
+                "votes": today.get("votes", 0),
+                "revenue": today.get("revenue", 0),
+                "contestants": today.get("contestants", {}),
+                "hours": today.get("hours", {}),
+            },
+            "days": [
+                {
+                    "date": d.isoformat(),
+                    "votes": docs.get(day_doc_id(d), {}).get("votes", 0),
+                    "revenue": docs.get(day_doc_id(d), {}).get("revenue", 0),
+                }
+                for d in dates
+            ],
+        }
+        with self._lock:
+            self._cache[cache_key] = (result, time.monotonic())
+        return result
+
+    def backfill(self, page_size=400, max_pages=None):
+        """Fold votes that predate live rollups into the stats documents
+
+        Walks the votes collection in timestamp order from the saved
+        checkpoint. Each page commits its rollup increments, the rolled_up
+        stamps and the new checkpoint in one batch, so an interrupted run
+        resumes exactly where it stopped. Returns the number of votes folded in.
+        Raises repositories.LedgerElsewhere while VOTE_LEDGER keeps the votes
+        outside Firestore.
+        """
+        require_firestore_ledger("The rollup backfill")
+        if page_size > 450:
+            # Leave room in each batch for the stats and checkpoint writes
+            raise ValueError("page_size must be at most 450")
+        checkpoint_ref = self.db.collection(self.collection).document(BACKFILL_DOC)
+        votes_ref = self.db.collection("votes")
+        checkpoint_doc = checkpoint_ref.get()
+        checkpoint = checkpoint_doc.to_dict() if checkpoint_doc.exists else {}
+
+        cursor = None
+        if checkpoint.get("last_vote_id"):
+            cursor = votes_ref.document(checkpoint["last_vote_id"]).get()
+            if not cursor.exists:
+                raise RuntimeError(f"Backfill checkpoint vote {checkpoint['last_vote_id']} no longer exists")
+
+        processed = checkpoint.get("processed", 0)
+        folded = 0
+        pages = 0
+        while max_pages is None or pages < max_pages:
+            query = votes_ref.order_by("timestamp").limit(page_size)
+            if cursor is not None:
+                query = query.start_after(cursor)
+            page = list(query.stream())
+            if not page:
+                break
+
+            batch = self.db.batch()
+            items = []
+            for doc in page:
+                vote = doc.to_dict() or {}
+                if vote.get("rolled_up"):
+                    continue
+                timestamp = vote.get("timestamp")
+                items.append((
+                    str(vote.get("contestantId", "")),
+                    vote.get("count") or 1,
+                    to_wat(timestamp) if timestamp else None,
+                ))
+                batch.update(doc.reference, {"rolled_up": True})
+
+            self._add_increments(batch, items)
+            processed += len(page)
+            batch.set(checkpoint_ref, {
+                "last_vote_id": page[-1].id,
+                "processed": processed,
+                "updated_at": firestore.SERVER_TIMESTAMP,
+            }, merge=True)
+            batch.commit()
+
+            folded += len(items)
+            pages += 1
+            cursor = page[-1]
+            logging.info(f"Rollup backfill: {processed} votes scanned, {folded} folded in this run")
+
+        with self._lock:
+            self._cache.clear()
+        return folded
+
+    def _add_increments(self, batch, items):
+        # items are (contestant_id, count, moment_in_wat_or_None)
+        if not items:
+            return
+        stats_ref = self.db.collection(self.collection)
+        total_votes = 0
+        per_day = {}
+        for contestant_id, count, moment in items:
+            total_votes += count
+            if moment is None:
+                continue
+            day = per_day.setdefault(moment.date(), {"votes": 0, "contestants": {}, "hours": {}})
+            day["votes"] += count
+            day["contestants"][contestant_id] = day["contestants"].get(contestant_id, 0) + count
+            hour = f"{moment.hour:02d}"
+            day["hours"][hour] = day["hours"].get(hour, 0) + count
+
+        batch.set(stats_ref.document(GLOBAL_DOC), {
+            "votes": firestore.Increment(total_votes),
+            "revenue": firestore.Increment(total_votes * VOTE_PRICE_USD),
+        }, merge=True)
+        for date, day in per_day.items():
+            batch.set(stats_ref.document(day_doc_id(date)), {
+                "date": date.isoformat(),
+                "votes": firestore.Increment(day["votes"]),
+                "revenue": firestore.Increment(day["votes"] * VOTE_PRICE_USD),
+                "contestants": {cid: firestore.Increment(n) for cid, n in day["contestants"].items()},
+                "hours": {hour: firestore.Increment(n) for hour, n in day["hours"].items()},
+            }, merge=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain Smallie vote rollups")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = subparsers.add_parser("backfill", help="Fold existing votes into the stats documents")
+    backfill_parser.add_argument("--page-size", type=int, default=400)
+    backfill_parser.add_argument("--max-pages", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    from firebase_client import get_db
+    db = get_db()
+    if db is None:
+        print("Error: Firebase is not configured")
+        return 1
+
+    if args.command == "backfill":
+        try:
+            folded = VoteRollups(get_db).backfill(page_size=args.page_size, max_pages=args.max_pages)
+        except LedgerElsewhere as e:
+            print(f"Error: {e}")
+            return 1
+        print(f"Folded {folded} votes into rollups")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""
+Server-Sent Events fan-out of live vote counts for Smallie
+
+One upstream feed per process (the contestant cache's Firestore listener)
+is broadcast to every connected browser through /api/stream/votes. Updates
+arriving in quick succession are coalesced into one frame per tick, and each
+client keeps only the latest value per contestant while it is not reading, so
+a slow connection costs O(contestants) memory however far behind it falls.
+Quiet streams get a heartbeat comment so proxies do not close them.
+
+Each open stream occupies a greenlet under the gevent workers that
+gunicorn_config.py uses by default, or a whole thread under gthread, for as
+long as the page is open. VOTE_STREAM_MAX_CLIENTS caps the streams per
+worker; gunicorn_config.py sets it to half of a gevent worker's connections,
+or to a quarter of a gthread worker's threads so pages and votes keep most of
+them. Beyond the cap /api/stream/votes answers 503 with a Retry-After of
+FULL_RETRY_AFTER_SECONDS and browsers poll /api/leaderboard instead until then.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+
+DEFAULT_TICK_SECONDS = float(os.environ.get("VOTE_STREAM_TICK", "1"))
+DEFAULT_HEARTBEAT_SECONDS = float(os.environ.get("VOTE_STREAM_HEARTBEAT", "15"))
+DEFAULT_MAX_CLIENTS = int(os.environ.get("VOTE_STREAM_MAX_CLIENTS", "5000"))
+
+# Tell clients how long to wait before reconnecting after a drop
+RETRY_MILLISECONDS = 5000
+
+# How long a client turned away from a full hub should poll before trying again
+FULL_RETRY_AFTER_SECONDS = 60
+
+
+class HubFull(Exception):
+    """Raised when a worker already serves its maximum number of streams"""
+
+
+def _state(contestant):
+    return {"votes": contestant.get("votes", 0) or 0, "eliminated": bool(contestant.get("eliminated", False))}
+
+
+class _Client:
+    """A connected stream and the updates it has not consumed yet"""
+
+    def __init__(self):
+        self.pending = {}
+        self.ready = threading.Event()
+        self.connected_at = time.monotonic()
+
+
+class VoteBroadcastHub:
+    """Coalescing broadcaster of contestant vote counts to SSE clients"""
+
+    def __init__(self, tick=DEFAULT_TICK_SECONDS, heartbeat=DEFAULT_HEARTBEAT_SECONDS,
+                 max_clients=DEFAULT_MAX_CLIENTS):
+        self.tick = tick
+        self.heartbeat = heartbeat
+        self.max_clients = max_clients
+
+        self._lock = threading.Lock()
+        self._clients = set()
+        self._state = {}
+        self._changes = {}
+        self._sequence = 0
+        self._ticker = None
+
+        # Counters exposed through stats()
+        self.frames_broadcast = 0
+        self.updates_coalesced = 0
+
+    def publish(self, contestants):
+        """Record the latest contestant list; changes go out on the next tick"""
+        with self._lock:
+            for contestant in contestants:
+                contestant_id = str(contestant.get("id", ""))
+                state = _state(contestant)
+                if self._state.get(contestant_id) == state:
+                    continue
+                if contestant_id in self._changes:
+                    self.updates_coalesced += 1
+                self._state[contestant_id] = state
+                self._changes[contestant_id] = state
+
+    def connect(self):
+        """Register a new client, returning it with a full snapshot queued"""
+        with self._lock:
+            if len(self._clients) >= self.max_clients:
+                raise HubFull()
+            client = _Client()
+            client.pending = dict(self._state)
+            client.ready.set()
+            self._clients.add(client)
+        self._ensure_ticker()
+        return client
+
+    def disconnect(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def stream(self, client):
+        """Yield SSE frames for a client until the connection closes"""
+        try:
+            yield f"retry: {RETRY_MILLISECONDS}\n\n"
+            while True:
+                if not client.ready.wait(self.heartbeat):
+                    yield ": heartbeat\n\n"
+                    continue
+                with self._lock:
+                    client.ready.clear()
+                    updates, client.pending = client.pending, {}
+                    sequence = self._sequence
+                if updates:
+                    yield f"id: {sequence}\nevent: votes\ndata: {json.dumps(updates, separators=(',', ':'))}\n\n"
+        finally:
+            self.disconnect(client)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clients": len(self._clients),
+                "frames_broadcast": self.frames_broadcast,
+                "updates_coalesced": self.updates_coalesced,
+            }
+
+    def _broadcast(self):
+        with self._lock:
+            if not self._changes:
+                return
+            changes, self._changes = self._changes, {}
+            self._sequence += 1
+            for client in self._clients:
+                # Merging keeps only the newest value per contestant for slow clients
+                client.pending.update(changes)
+                client.ready.set()
+            self.frames_broadcast += 1
+
+    def _ensure_ticker(self):
+        # Started with the first client so it runs in the serving worker process
+        with self._lock:
+            if self._ticker is not None and self._ticker.is_alive():
+                return
+            self._ticker = threading.Thread(target=self._tick_loop, name="vote-stream-ticker", daemon=True)
+            self._ticker.start()
+
+    def _tick_loop(self):
+        while True:
+            time.sleep(self.tick)
+            try:
+                self._broadcast()
+            except Exception as e:
+                logging.error(f"Error broadcasting vote updates: {e}")
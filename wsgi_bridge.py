@@ -0,0 +1,160 @@
+"""
+WSGI-to-serverless bridge for Smallie on Vercel
+
+Translates a serverless request object into a WSGI environ, runs the Flask
+app and converts its output into the response dict the platform expects.
+Response bodies are collected as bytes and joined once, binary bodies are
+base64-encoded, and repeated headers such as Set-Cookie are returned in
+multiValueHeaders instead of being collapsed.
+"""
+
+import io
+import sys
+import base64
+import functools
+from urllib.parse import unquote
+
+# Content types that can be returned as text; everything else is base64-encoded
+TEXT_CONTENT_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "application/xhtml+xml",
+    "image/svg+xml",
+)
+
+# Headers that WSGI expects without the HTTP_ prefix
+_UNPREFIXED_HEADERS = {"CONTENT_TYPE", "CONTENT_LENGTH"}
+
+# Entries that are the same for every request
+_BASE_ENVIRON = {
+    "wsgi.version": (1, 0),
+    "wsgi.errors": sys.stderr,
+    "wsgi.multithread": False,
+    "wsgi.multiprocess": False,
+    "wsgi.run_once": False,
+    "SCRIPT_NAME": "",
+    "SERVER_PROTOCOL": "HTTP/1.1",
+}
+
+
+# Header names are chosen by clients, so only the most recent ones are remembered
+@functools.lru_cache(maxsize=256)
+def _environ_key(header_name):
+    key = header_name.upper().replace("-", "_")
+    if key not in _UNPREFIXED_HEADERS:
+        key = "HTTP_" + key
+    return key
+
+
+def _header_items(headers):
+    # Prefer an API that preserves repeated headers when the object has one
+    if hasattr(headers, "raw_items"):
+        return headers.raw_items()
+    if hasattr(headers, "items"):
+        try:
+            return headers.items(multi=True)
+        except TypeError:
+            return headers.items()
+    return headers
+
+
+def build_environ(request):
+    """Build a WSGI environ for a serverless request object"""
+    body = request.body or b""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+
+    scheme, _, rest = request.url.partition("://")
+    query_string = request.query_string
+    if isinstance(query_string, bytes):
+        query_string = query_string.decode("latin-1")
+
+    environ = dict(_BASE_ENVIRON)
+    environ["wsgi.url_scheme"] = scheme or "https"
+    environ["wsgi.input"] = io.BytesIO(body)
+    environ["REQUEST_METHOD"] = request.method
+    # WSGI carries the decoded path as latin-1 characters of the UTF-8 bytes
+    environ["PATH_INFO"] = unquote(request.path, encoding="latin-1")
+    environ["QUERY_STRING"] = query_string
+
+    for name, value in _header_items(request.headers):
+        key = _environ_key(name)
+        if key in environ and key.startswith("HTTP_"):
+            # Repeated headers are combined as RFC 9110 allows; cookies use "; "
+            separator = "; " if key == "HTTP_COOKIE" else ", "
+            environ[key] = f"{environ[key]}{separator}{value}"
+        else:
+            environ[key] = value
+    # The body we actually pass on is authoritative, whatever the header said
+    environ["CONTENT_LENGTH"] = str(len(body))
+
+    host = environ.get("HTTP_HOST") or rest.split("/", 1)[0] or "localhost"
+    environ["HTTP_HOST"] = host
+    server_name, _, server_port = host.partition(":")
+    environ["SERVER_NAME"] = server_name
+    environ["SERVER_PORT"] = server_port or ("443" if environ["wsgi.url_scheme"] == "https" else "80")
+    return environ
+
+
+def _is_text(headers):
+    content_type = ""
+    for name, value in headers:
+        lowered = name.lower()
+        if lowered == "content-encoding":
+            # Compressed bodies are binary whatever their content type
+            return False
+        if lowered == "content-type":
+            content_type = value.lower()
+    return content_type.startswith(TEXT_CONTENT_TYPES)
+
+
+def handle(app, request):
+    """Run a WSGI app for a serverless request and return the response dict"""
+    response = {}
+    chunks = []
+
+    def start_response(status, response_headers, exc_info=None):
+        if exc_info and response:
+            raise exc_info[1].with_traceback(exc_info[2])
+        response["status"] = status
+        response["headers"] = response_headers
+        # Legacy write() callable; appended like any other chunk
+        return chunks.append
+
+    result = app(build_environ(request), start_response)
+    try:
+        for chunk in result:
+            if chunk:
+                chunks.append(chunk)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+
+    body = chunks[0] if len(chunks) == 1 else b"".join(chunks)
+    headers = response["headers"]
+
+    single = {}
+    multi = {}
+    for name, value in headers:
+        if name in multi:
+            multi[name].append(value)
+        elif name in single:
+            multi[name] = [single.pop(name), value]
+        else:
+            single[name] = value
+
+    payload = {"statusCode": int(response["status"].split(" ", 1)[0]), "headers": single}
+    if multi:
+        payload["multiValueHeaders"] = multi
+    if _is_text(headers):
+        try:
+            payload["body"] = body.decode("utf-8")
+            payload["isBase64Encoded"] = False
+            return payload
+        except UnicodeDecodeError:
+            pass
+    payload["body"] = base64.b64encode(body).decode("ascii")
+    payload["isBase64Encoded"] = True
+    return payload